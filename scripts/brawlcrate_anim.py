@@ -0,0 +1,295 @@
+"""Parser for the Maya .anim files that BrawlCrate exports, without any blender dependency.
+
+This needs to be installed next to the importer script, see README.md.
+"""
+
+import hashlib, multiprocessing, os, pickle, tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+#==============================================================================#
+
+ANIM_HEADER = (
+    "animVersion 1.1;", "mayaVersion 2015;", "timeUnit ntscf;",
+    "linearUnit cm;", "angularUnit deg;", "startTime 0;",
+)
+
+CHANNEL_NAMES = (
+    "translateX", "translateY", "translateZ",
+    "rotateX", "rotateY", "rotateZ",
+    "scaleX", "scaleY", "scaleZ",
+)
+
+class AnimChannel():
+    """Keys of one channel as arrays, in the units of the file.
+
+    Tangent angles are in degrees, and in and out tangents are always the same.
+    """
+
+    def __init__(self, frames=(), values=(), angles=(), weights=()):
+        self.frames = np.asarray(frames, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.angles = np.asarray(angles, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def slopes(self):
+        """Tangents as the change in value per frame."""
+        return np.tan(np.radians(self.angles))
+
+class BrawlCrateBone():
+    def __init__(self):
+        for name in CHANNEL_NAMES:
+            setattr(self, name, AnimChannel())
+
+    def assert_constant(self, boneName):
+        assert len(self.translateX) <= 1, boneName
+        assert len(self.translateY) <= 1, boneName
+        assert len(self.translateZ) <= 1, boneName
+        assert len(self.rotateX) <= 1, boneName
+        assert len(self.rotateY) <= 1, boneName
+        assert len(self.rotateZ) <= 1, boneName
+
+class BrawlCrateAnim():
+    def __init__(self):
+        self.endTime = 0
+        self.bones = {}
+
+    def bone(self, boneName):
+        """Get a bone, bones without any channels in the file have constant defaults."""
+        return self.bones.get(boneName) or BrawlCrateBone()
+
+#==============================================================================#
+
+def parse_anim(lines, verbose=False):
+    """Parse an .anim file from an iterable of lines, such as an open file.
+
+    Lines are consumed one at a time, so the file never needs to be fully in
+    memory as text. Set verbose to print each line as it's parsed.
+    """
+
+    lines = (line.rstrip("\r\n") for line in lines)
+
+    for expected in ANIM_HEADER:
+        line = next(lines)
+        assert line == expected, "unexpected line '%s'" % line
+
+    anim = BrawlCrateAnim()
+
+    tokens = next(lines).split()
+    assert tokens[0] == "endTime", "unexpected line '%s'" % " ".join(tokens)
+    anim.endTime = int(tokens[1].rstrip(';'))
+
+    if verbose: print("endTime", anim.endTime)
+
+    for line in lines:
+
+        if not line: continue
+        if verbose: print(line)
+
+        tokens = line.split()
+        assert tokens[0] == "anim", "unexpected line '%s'" % line
+
+        # channels that aren't animated don't have a block
+        if not tokens[1].startswith(("translate", "rotate", "scale")):
+            assert line.endswith(" 0 0 0;") and len(tokens) == 5
+            continue
+
+        channelName, boneName = tokens[2], tokens[3]
+        assert channelName in CHANNEL_NAMES, "unknown channel '%s'" % channelName
+        isRotate = channelName.startswith("rotate")
+
+        assert next(lines) == "animData {"
+        assert next(lines) == "  input time;"
+        assert next(lines).endswith("output angular;" if isRotate else "output linear;")
+        assert next(lines).endswith("weighted 1;")
+        assert next(lines).endswith("preInfinity constant;")
+        assert next(lines).endswith("postInfinity constant;")
+        assert next(lines).endswith("keys {")
+
+        frames, values, angles, weights = [], [], [], []
+
+        for line in lines:
+
+            if line.endswith("}"): break
+            if verbose: print(line)
+
+            # time value inType outType tanLock weightLock breakdown inAngle inWeight outAngle outWeight;
+            tokens = line.split()
+            assert tokens[2] == 'fixed' and tokens[3] == 'fixed'
+            assert tokens[4] == '1' and tokens[5] == '1' and tokens[6] == '0'
+            assert tokens[7] == tokens[9] and tokens[8] == tokens[10].rstrip(';')
+
+            frames.append(int(tokens[0]))
+            values.append(float(tokens[1]))
+            angles.append(float(tokens[7]))
+            weights.append(float(tokens[8]))
+
+        assert next(lines) == "}"
+        assert not frames or max(frames) <= anim.endTime
+
+        bone = anim.bones.setdefault(boneName, BrawlCrateBone())
+        order = np.argsort(frames, kind='stable')
+        # when there is more than one key on a frame, only the last one is used
+        sortedFrames = np.asarray(frames, dtype=np.int64)[order]
+        order = order[np.append(sortedFrames[1:] != sortedFrames[:-1], True)] if frames else order
+        channel = AnimChannel(frames, values, angles, weights)
+        for attr in ('frames', 'values', 'angles', 'weights'):
+            setattr(channel, attr, getattr(channel, attr)[order])
+        setattr(bone, channelName, channel)
+
+    return anim
+
+def read_anim(filepath, verbose=False):
+    with open(filepath, 'r') as inFile:
+        return parse_anim(inFile, verbose)
+
+#==============================================================================#
+
+def sample_keys(channel, frames, default, hermite=True):
+    """Evaluate a channel at every frame at once.
+
+    Uses the same cubic hermite curves as BrawlCrate, or straight lines between
+    keys if hermite is False. Values are held constant before the first key and
+    after the last, matching preInfinity and postInfinity constant.
+    """
+
+    if len(channel) == 0: return np.full(len(frames), default, dtype=np.float64)
+
+    times, values = channel.frames.astype(np.float64), channel.values
+
+    if len(times) == 1 or not hermite:
+        return np.interp(frames, times, values)
+
+    slopes = channel.slopes()
+
+    index = np.clip(np.searchsorted(times, frames, side='right') - 1, 0, len(times) - 2)
+    span = times[index + 1] - times[index]
+    offset = np.clip(frames - times[index], 0.0, span)
+
+    time = offset / span
+    inv = time - 1.0
+    diff = values[index + 1] - values[index]
+
+    result = values[index] + offset * inv * (inv * slopes[index] + time * slopes[index + 1])
+    result += time * time * (3.0 - 2.0 * time) * diff
+
+    return result
+
+#==============================================================================#
+
+def read_colours(filepath):
+    """Read a clr.txt file, returns a uint8 array of rgba colours by frame, bone and channel.
+
+    Bones are separated by blank lines, and each line is an RRGGBBAA hex colour.
+    Every bone has the same number of frames, so the whole file is decoded at once.
+    """
+
+    with open(filepath, 'r') as inFile:
+        text = inFile.read()
+
+    boneCount = len([ block for block in text.split('\n\n') if block.strip() ])
+    colours = np.frombuffer(bytes.fromhex("".join(text.split())), dtype=np.uint8)
+
+    assert len(colours) % (boneCount * 4) == 0, "bones in '%s' have different lengths" % filepath
+    return colours.reshape(boneCount, -1, 4).transpose(1, 0, 2)
+
+def linear_key_indices(values):
+    """Indices of the samples needed to rebuild values exactly with linear keys.
+
+    Values that never change need only one key, and runs that change by the
+    same amount each frame, including holds, only need keys at their ends.
+    """
+
+    values = np.asarray(values, dtype=np.int64)
+    if np.all(values == values[0]): return np.zeros(1, dtype=np.int64)
+
+    bends = np.flatnonzero(np.diff(values, n=2)) + 1
+    return np.concatenate(([0], bends, [len(values) - 1]))
+
+def parse_files(animPath, colourPath=None):
+    """Parse an .anim file and optionally its clr.txt, returns (anim, colours)."""
+    anim = read_anim(animPath)
+    colours = read_colours(colourPath) if colourPath else None
+    return anim, colours
+
+#==============================================================================#
+
+# change this whenever the parsed classes change, so old cache entries are ignored
+PARSE_CACHE_VERSION = 3
+
+class ParseCache():
+    """Parsed files stored by the hash of their contents, in the temp directory."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "brawlcrate_anim_cache")
+
+    @staticmethod
+    def key(*paths):
+        hasher = hashlib.sha1(b"%d" % PARSE_CACHE_VERSION)
+        for path in paths:
+            hasher.update(b"\0")
+            if path is not None:
+                with open(path, 'rb') as f:
+                    hasher.update(f.read())
+        return hasher.hexdigest()
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.directory, key + ".pickle"), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key + ".pickle")
+        # write to a temporary file first so that other processes never see half a file
+        tempPath = path + ".tmp%d" % os.getpid()
+        with open(tempPath, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempPath, path)
+
+def parse_files_parallel(pathPairs, jobs=0, cache=None):
+    """Parse a list of (animPath, colourPath) pairs, returns a list of (anim, colours).
+
+    Files whose contents are already in the cache are not parsed again, the rest
+    are parsed in a pool of jobs processes, or one for each cpu if jobs is zero.
+    """
+
+    results = [None] * len(pathPairs)
+    keys = [None] * len(pathPairs)
+    pending = []
+
+    for index, (animPath, colourPath) in enumerate(pathPairs):
+        if cache is not None:
+            keys[index] = cache.key(animPath, colourPath)
+            results[index] = cache.get(keys[index])
+        if results[index] is None:
+            pending.append(index)
+
+    workers = min(jobs or os.cpu_count() or 1, len(pending))
+
+    if workers <= 1:
+        parsed = [ parse_files(*pathPairs[index]) for index in pending ]
+    else:
+        # fork is not safe inside of blender, so always start fresh interpreters
+        mpContext = multiprocessing.get_context('spawn')
+        parsed = []
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mpContext) as pool:
+                for result in pool.map(parse_files, *zip(*[pathPairs[index] for index in pending])):
+                    parsed.append(result)
+        except BrokenProcessPool:
+            print("worker processes failed, parsing in this process instead")
+            parsed += [ parse_files(*pathPairs[index]) for index in pending[len(parsed):] ]
+
+    for index, result in zip(pending, parsed):
+        results[index] = result
+        if cache is not None:
+            cache.put(keys[index], result)
+
+    return results
@@ -0,0 +1,193 @@
+"""Convert BrawlCrate .anim files straight to SQEE animations, without blender.
+
+Run from a shell with a normal python:
+
+    python scripts/brawlcrate_to_sqa.py --armature Mario.json [options] [files or directories]
+
+The armature is the .json written by the SQEE armature exporter. The result is
+the same as importing each file with the BrawlCrate importer, then exporting
+the action with the SQEE animation exporter.
+"""
+
+import argparse, multiprocessing, os, sys, time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from brawlcrate_anim import CHANNEL_NAMES, ParseCache, parse_files_parallel, sample_keys
+from sqee_io import AnimJob, PoseBoneData, armature_rest_matrices, read_armature_json, run_anim_job
+
+#==============================================================================#
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Convert BrawlCrate .anim files to SQEE animations")
+
+    parser.add_argument("inputs", nargs="+", type=Path,
+                        help=".anim files, or directories to search for them")
+    parser.add_argument("--armature", type=Path, required=True,
+                        help="armature .json written by the SQEE armature exporter")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="directory to write to, by default next to each .anim file")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of processes to run at once")
+    parser.add_argument("--format", choices=("TEXT", "BINARY", "CHUNKED"), default="BINARY",
+                        help="file format for exported animations")
+    parser.add_argument("--chunk-frames", type=int, default=32,
+                        help="frames in each chunk of a chunked file")
+    parser.add_argument("--precision", type=int, default=5,
+                        help="number of decimal places in text files")
+    parser.add_argument("--swap-yz", action="store_true",
+                        help="swap the Y and Z axes of all exported data")
+    parser.add_argument("--colours", action="store_true",
+                        help="export colours from the clr.txt next to each file as custom properties")
+    parser.add_argument("--linear", action="store_true",
+                        help="straight lines between keys instead of BrawlCrate's hermite curves")
+    parser.add_argument("--ignore-last-frame", action="store_true",
+                        help="don't export the last frame")
+    parser.add_argument("--reduce", action="store_true",
+                        help="remove keyframes that can be interpolated")
+    parser.add_argument("--offset-tolerance", type=float, default=0.0005)
+    parser.add_argument("--rotation-tolerance", type=float, default=0.05,
+                        help="in degrees")
+    parser.add_argument("--scale-tolerance", type=float, default=0.0005)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse every file, even ones that were parsed before")
+
+    return parser.parse_args()
+
+def find_anim_files(inputs):
+    files = []
+    for path in inputs:
+        if path.is_file(): files.append(path)
+        else: files.extend(sorted(path.rglob("*.anim")))
+    return files
+
+#==============================================================================#
+
+def chain_lengths(bones):
+    """Longest distance from each bone to the head of any bone below it.
+
+    The json has no tails, so this is a bit shorter than what the exporter uses,
+    but it's only used to scale the keyframe reduction tolerances.
+    """
+    heads = armature_rest_matrices(bones)[:, :3, 3]
+    lengths = np.zeros(len(bones))
+    for index in reversed(range(len(bones))):
+        parentIndex = bones[index]['parentIndex']
+        if parentIndex >= 0:
+            distance = np.linalg.norm(heads[index] - heads[parentIndex])
+            lengths[parentIndex] = max(lengths[parentIndex], distance + lengths[index])
+    return { bone['name']: float(length) for bone, length in zip(bones, lengths) }
+
+def make_job(filepath, anim, colours, bones, chainLengths, hermite, options):
+    """Build the same job that exporting the imported action would.
+
+    The importer keys each bone with the inverse of its rest offset times the
+    BrawlCrate transform, and the exporter multiplies the rest offset back in,
+    so a bone's local transform is just its BrawlCrate transform. Giving every
+    bone an identity rest matrix gets exactly that out of sample_local_matrices.
+
+    Bones whose parent isn't in the json are treated the same way, which is only
+    exact when the hidden parent is at the origin.
+    """
+
+    frameCount = anim.endTime + 1 - int(options['ignoreLastFrame'])
+    frames = np.arange(frameCount, dtype=np.float64)
+
+    jobBones = []
+    for bone in bones:
+        brawlBone = anim.bone(bone['name'])
+        channels = []
+        for name in CHANNEL_NAMES:
+            default = 1.0 if name.startswith("scale") else 0.0
+            channels.append(sample_keys(getattr(brawlBone, name), frames, default, hermite))
+        jobBones.append ( PoseBoneData ( bone['name'], bone['parentIndex'], np.eye(4), 'XYZ',
+                                         [ values * 0.1 for values in channels[0:3] ],
+                                         [ np.radians(values) for values in channels[3:6] ],
+                                         channels[6:9] ) )
+
+    # the importer puts colours on every bone except the root, in order
+    extraKeys, extraChannels = [], []
+    if colours is not None:
+        frameIndices = np.minimum(np.arange(frameCount), len(colours) - 1)
+        for boneIndex, bone in enumerate(bones[1:colours.shape[1]+1]):
+            boneColours = colours[frameIndices, boneIndex] / 255.0
+            extraKeys.append((bone['name'], "colour"))
+            extraChannels.append([ boneColours[:, index] for index in range(4) ])
+
+    boneNames = [ bone['name'] for bone in bones ]
+    job = AnimJob(str(filepath), frameCount, boneNames, chainLengths, extraKeys, options)
+    job.bones = jobBones
+    job.extraChannels = extraChannels
+
+    return job
+
+#==============================================================================#
+
+def main():
+
+    args = parse_args()
+
+    animFiles = find_anim_files(args.inputs)
+    if not animFiles:
+        print("no .anim files found")
+        return 0
+
+    bones = read_armature_json(args.armature)
+    chainLengths = chain_lengths(bones)
+
+    options = { 'precision': args.precision,
+                'swapYZ': args.swap_yz,
+                'exportCustom': args.colours,
+                'ignoreLastFrame': args.ignore_last_frame,
+                'reduceKeyframes': args.reduce,
+                'offsetTolerance': args.offset_tolerance,
+                'rotationTolerance': args.rotation_tolerance,
+                'scaleTolerance': args.scale_tolerance,
+                'fileFormat': args.format,
+                'chunkFrames': args.chunk_frames }
+
+    startTime = time.perf_counter()
+
+    pathPairs = []
+    for path in animFiles:
+        colourPath = path.with_name("clr.txt")
+        pathPairs.append((str(path), str(colourPath) if args.colours and colourPath.is_file() else None))
+
+    cache = None if args.no_cache else ParseCache()
+    parsed = parse_files_parallel(pathPairs, args.jobs, cache)
+
+    parseTime = time.perf_counter() - startTime
+
+    jobs = []
+    for path, (anim, colours) in zip(animFiles, parsed):
+        outputDir = args.output or path.parent
+        outputDir.mkdir(parents=True, exist_ok=True)
+        jobs.append(make_job(outputDir / (path.stem + ".sqa"), anim, colours, bones, chainLengths, not args.linear, options))
+
+    if args.jobs <= 1 or len(jobs) <= 1:
+        results = [ run_anim_job(job) for job in jobs ]
+    else:
+        mpContext = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(jobs)), mp_context=mpContext) as pool:
+            results = list(pool.map(run_anim_job, jobs))
+
+    totalTime = time.perf_counter() - startTime
+
+    #----------------------------------------------------------#
+
+    print("\n{:<60} {:>10} {:>8}".format("File", "Bytes", "Seconds"))
+
+    for filepath, elapsed, size, log in results:
+        print("{:<60} {:>10} {:>8.3f}".format(filepath, size, elapsed))
+        for line in log: print("    " + line)
+
+    print("\n%d files, %.2fs parsing, %.2fs total" % (len(results), parseTime, totalTime))
+
+    return 0
+
+#==============================================================================#
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,15 @@
-import bpy
-from collections import defaultdict
-from math import radians
-from mathutils import Vector, Euler, Matrix
+import bpy, os
+import numpy as np
+
+# the shared modules are separate files, so check for them first to give a clear error
+try:
+    import brawlcrate_anim, sqee_io
+except ImportError as error:
+    if error.name not in ("brawlcrate_anim", "sqee_io"): raise
+    raise ImportError("%s.py was not found, it needs to be installed in the same folder as this add-on, see README.md" % error.name) from None
+
+from brawlcrate_anim import CHANNEL_NAMES, read_anim, read_colours, linear_key_indices, sample_keys, ParseCache, parse_files_parallel
+from sqee_io import STAGE_TIMER, eulers_to_matrices, decompose_matrices, make_quaternions_continuous, ordered_bones
 
 bl_info = {
     "name": "BrawlCrate .anim Importer",
@@ -17,28 +25,6 @@ bl_info = {
 }
 
 #==============================================================================#
-
-class BrawlCrateBone():
-    def __init__(self):
-        self.translateX = {}
-        self.translateY = {}
-        self.translateZ = {}
-        self.rotateX = {}
-        self.rotateY = {}
-        self.rotateZ = {}
-        self.scaleX = {}
-        self.scaleY = {}
-        self.scaleZ = {}
-    
-    def assert_constant(self, boneName):
-        assert len(self.translateX) <= 1, boneName
-        assert len(self.translateY) <= 1, boneName
-        assert len(self.translateZ) <= 1, boneName
-        assert len(self.rotateX) <= 1, boneName
-        assert len(self.rotateY) <= 1, boneName
-        assert len(self.rotateZ) <= 1, boneName
-        
-#==============================================================================#
         
 def mat_offset(pose_bone):
     bone = pose_bone.bone
@@ -48,38 +34,43 @@ def mat_offset(pose_bone):
         mat.translation.y += bone.parent.length
     return mat
 
-def get_interpolated_value(frame, data, default):
+def rest_offsets_inverted(boneList):
+    """Inverse of mat_offset for each bone, as one array. Only needs doing once per armature."""
+    return np.array([ np.array(mat_offset(poseBone).inverted()) for poseBone in boneList ], dtype=np.float64).reshape(-1, 4, 4)
 
-    # todo: we have some tangent data too, need to use it to get intended results
-    
-    if not data: return default
-    if frame in data: return data[frame]
-    
-    lessValues = list((k,v) for k,v in data.items() if k < frame)
-    moreValues = list((k,v) for k,v in data.items() if k > frame)
-    
-    if not lessValues: return moreValues[0][1]
-    if not moreValues: return lessValues[-1][1]
+def add_linear_fcurve(action, dataPath, index, group, frames, values):
+    """Create an F-Curve with a linear keyframe for each frame, all in one go.
+
+    Much faster than calling keyframe_points.insert for every frame.
+    """
+
+    curve = action.fcurves.new(dataPath, index=index, action_group=group)
 
-    more, less = moreValues[0], lessValues[-1]
-    factor = (frame - less[0]) / (more[0] - less[0])
+    co = np.empty(len(frames) * 2, dtype=np.float32)
+    co[0::2], co[1::2] = frames, values
 
-    return less[1] * (1.0 - factor) + more[1] * factor
+    linear = bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items['LINEAR'].value
+
+    points = curve.keyframe_points
+    points.add(len(frames))
+    points.foreach_set('co', co)
+    points.foreach_set('interpolation', np.full(len(frames), linear, dtype=np.int32))
+
+    curve.update()
+    return curve
 
 #==============================================================================#
 
-def read_brawlcrate_anim(context, actionName, inFile):
+def read_brawlcrate_anim(context, actionName, anim, hermite=True, restOffsets=None):
+    """Create an action from a parsed .anim file.
 
-    assert inFile.readline() == "animVersion 1.1;\n"
-    assert inFile.readline() == "mayaVersion 2015;\n"
-    assert inFile.readline() == "timeUnit ntscf;\n"
-    assert inFile.readline() == "linearUnit cm;\n"
-    assert inFile.readline() == "angularUnit deg;\n"
-    assert inFile.readline() == "startTime 0;\n"
-    
-    line = inFile.readline().split()
-    print(line)
-    endTime = int(line[1][:-1])
+    The conversion to pose space is done for all bones and frames at once. Pass
+    restOffsets from rest_offsets_inverted to reuse them between animations.
+    """
+
+    STAGE_TIMER.lap("import.setup")
+
+    endTime = anim.endTime
 
     arm = bpy.context.active_object
 
@@ -91,171 +82,75 @@ def read_brawlcrate_anim(context, actionName, inFile):
     arm.animation_data_create()
     action = bpy.data.actions.new(name=actionName)
     arm.animation_data.action = action
-    
-    bones = defaultdict(BrawlCrateBone)
-    
-    currentTrack = None
-    trackType = None
-    
-    expected = "anim"
-    
-    for line in inFile.read().splitlines():
-        tokens = line.split()
-        #print(line)
-
-        if expected == "anim":
-            assert tokens[0] == "anim"
-            if tokens[1].startswith("translate"):
-                currentTrack = getattr(bones[tokens[3]], tokens[2])
-                trackType = 'translate'
-                expected = "animData"
-            elif tokens[1].startswith("rotate"):
-                currentTrack = getattr(bones[tokens[3]], tokens[2])
-                trackType = 'rotate'
-                expected = "animData"
-            elif tokens[1].startswith("scale"):
-                currentTrack = getattr(bones[tokens[3]], tokens[2])
-                trackType = 'scale'
-                expected = "animData"
-            else:
-                assert line.endswith(" 0 0 0;") and len(tokens) == 5
-                expected = "anim"
-        
-        elif expected == "animData":
-            assert line == "animData {"
-            expected = "input"
-            
-        elif expected == "input":
-            assert line == "  input time;"
-            expected = "output"
-       
-        elif expected == "output":
-            if trackType == 'rotate':
-                assert line.endswith("output angular;")
-            else: 
-                assert line.endswith("output linear;")
-            expected = "weighted"
-            
-        elif expected == "weighted":
-            assert line.endswith("weighted 1;")
-            expected = "preInfinity"
-            
-        elif expected == "preInfinity":
-            assert line.endswith("preInfinity constant;")
-            expected = "postInfinity"
-            
-        elif expected == "postInfinity":
-            assert line.endswith("postInfinity constant;")
-            expected = "keys"
-        
-        elif expected == "keys":
-            assert line.endswith("keys {")
-            expected = "value"
-        
-        elif expected == "value":
-            if line.endswith("}"):
-                expected = "}"
-                continue
-            
-            print(tokens)
-            
-            assert tokens[2] == 'fixed'
-            assert tokens[3] == 'fixed'
-            assert tokens[4] == '1'
-            assert tokens[5] == '1'
-            assert tokens[6] == '0'
-            assert tokens[7] == tokens[9] and tokens[8] == tokens[10].rstrip(';')
-            assert int(tokens[0]) <= endTime
-            
-            if trackType == 'rotate':
-                currentTrack[int(tokens[0])] = radians(float(tokens[1]))
-            else:
-                currentTrack[int(tokens[0])] = float(tokens[1])
-            
-        elif expected == "}":
-            assert line == "}"
-            expected = "anim"
-
-    boneList = sorted ( arm.pose.bones, key = lambda bone: (len(bone.parent_recursive), bone.name) )
-    boneList = [ bone for bone in boneList if bone.name[0] != '.' ]
-
-    for poseBone in boneList:
-        
+
+    boneList = ordered_bones(arm.pose.bones, arm.data)
+
+    if restOffsets is None:
+        restOffsets = rest_offsets_inverted(boneList)
+
+    frames = np.arange(0, endTime+1, dtype=np.float64)
+
+    # todo: for loc and rot, default should be the rest value
+
+    STAGE_TIMER.lap("import.sample")
+
+    # location xyz, rotation xyz, then scale xyz for every bone and frame
+    channels = np.empty((len(boneList), len(frames), 9), dtype=np.float64)
+
+    for boneIndex, poseBone in enumerate(boneList):
+        bone = anim.bone(poseBone.name)
+        for index, name in enumerate(CHANNEL_NAMES):
+            default = 1.0 if name.startswith("scale") else 0.0
+            channels[boneIndex, :, index] = sample_keys(getattr(bone, name), frames, default, hermite)
+
+    STAGE_TIMER.lap("import.convert")
+
+    basisMats = np.zeros((len(boneList), len(frames), 4, 4), dtype=np.float64)
+    basisMats[..., :3, :3] = eulers_to_matrices(np.radians(channels[..., 3:6]), "XYZ") * channels[..., None, 6:9]
+    basisMats[..., :3, 3] = channels[..., 0:3] * 0.1
+    basisMats[..., 3, 3] = 1.0
+
+    basisMats = restOffsets[:, None] @ basisMats
+
+    locations, rotations, scales = decompose_matrices(basisMats, allowNegativeScale=True)
+    rotations = make_quaternions_continuous(rotations, axis=1)
+
+    STAGE_TIMER.lap("import.fcurves")
+
+    for boneIndex, poseBone in enumerate(boneList):
+
         boneName = poseBone.name
-        bone = bones[boneName]
-        
+        poseBone.rotation_mode = "QUATERNION"
+
         dataPathLoc = 'pose.bones["%s"].location' % boneName
         dataPathRot = 'pose.bones["%s"].rotation_quaternion' % boneName
         dataPathSca = 'pose.bones["%s"].scale' % boneName
 
-        curveLX = action.fcurves.new(dataPathLoc, index=0, action_group=boneName)
-        curveLY = action.fcurves.new(dataPathLoc, index=1, action_group=boneName)
-        curveLZ = action.fcurves.new(dataPathLoc, index=2, action_group=boneName)
+        for index in range(3):
+            add_linear_fcurve(action, dataPathLoc, index, boneName, frames, locations[boneIndex, :, index])
+        for index in range(4):
+            add_linear_fcurve(action, dataPathRot, index, boneName, frames, rotations[boneIndex, :, index])
+        for index in range(3):
+            add_linear_fcurve(action, dataPathSca, index, boneName, frames, scales[boneIndex, :, index])
 
-        curveRW = action.fcurves.new(dataPathRot, index=0, action_group=boneName)    
-        curveRX = action.fcurves.new(dataPathRot, index=1, action_group=boneName)
-        curveRY = action.fcurves.new(dataPathRot, index=2, action_group=boneName)
-        curveRZ = action.fcurves.new(dataPathRot, index=3, action_group=boneName)
-
-        curveSX = action.fcurves.new(dataPathSca, index=0, action_group=boneName)
-        curveSY = action.fcurves.new(dataPathSca, index=1, action_group=boneName)
-        curveSZ = action.fcurves.new(dataPathSca, index=2, action_group=boneName)
-        
-        arm.pose.bones[boneName].rotation_mode = "QUATERNION"
-        
-        for frame in range(0, endTime+1):
-            
-            # todo: for loc and rot, default should be the rest value
-            
-            locX = get_interpolated_value(frame, bone.translateX, 0.0)
-            locY = get_interpolated_value(frame, bone.translateY, 0.0)
-            locZ = get_interpolated_value(frame, bone.translateZ, 0.0)
-        
-            rotX = get_interpolated_value(frame, bone.rotateX, 0.0)
-            rotY = get_interpolated_value(frame, bone.rotateY, 0.0)
-            rotZ = get_interpolated_value(frame, bone.rotateZ, 0.0)
-            
-            scaX = get_interpolated_value(frame, bone.scaleX, 1.0)
-            scaY = get_interpolated_value(frame, bone.scaleY, 1.0)
-            scaZ = get_interpolated_value(frame, bone.scaleZ, 1.0)
-            
-            loc = Vector((locX, locY, locZ)) * 0.1
-            rot = Euler((rotX, rotY, rotZ), "XYZ")
-            sca = Vector((scaX, scaY, scaZ))
-            
-            locMat = Matrix.Translation(loc)
-            rotMat = rot.to_matrix().to_4x4()
-            scaMat = Matrix.Diagonal(sca).to_4x4()
-            
-            basisMat = locMat @ rotMat @ scaMat
-            basisMat = mat_offset(arm.pose.bones[boneName]).inverted() @ basisMat
-            
-            loc, rot, sca = basisMat.decompose()
-            
-            curveLX.keyframe_points.insert(frame, loc.x).interpolation = 'LINEAR'
-            curveLY.keyframe_points.insert(frame, loc.y).interpolation = 'LINEAR'
-            curveLZ.keyframe_points.insert(frame, loc.z).interpolation = 'LINEAR'
-            
-            curveRW.keyframe_points.insert(frame, rot.w).interpolation = 'LINEAR'
-            curveRX.keyframe_points.insert(frame, rot.x).interpolation = 'LINEAR'
-            curveRY.keyframe_points.insert(frame, rot.y).interpolation = 'LINEAR'
-            curveRZ.keyframe_points.insert(frame, rot.z).interpolation = 'LINEAR'
-            
-            curveSX.keyframe_points.insert(frame, sca.x).interpolation = 'LINEAR'
-            curveSY.keyframe_points.insert(frame, sca.y).interpolation = 'LINEAR'
-            curveSZ.keyframe_points.insert(frame, sca.z).interpolation = 'LINEAR'
+    STAGE_TIMER.end()
 
 #==============================================================================#
 
-def read_colour_anim(context, inFile):
-    
+def read_colour_anim(context, colours):
+    """Key a colour property on each bone from the frames x bones x rgba array of read_colours.
+
+    Only the frames where a channel starts or stops changing get a keyframe.
+    """
+
+    STAGE_TIMER.lap("import.colours")
+
     arm = context.active_object
     action = arm.animation_data.action
 
-    boneList = sorted ( arm.pose.bones, key = lambda bone: (len(bone.parent_recursive), bone.name) )
-    boneList = [ bone for bone in boneList if bone.name[0] != '.' ][1:] # without root bone
+    boneList = ordered_bones(arm.pose.bones, arm.data)[1:] # without root bone
 
-    for poseBone, clrLines in zip(boneList, inFile.read().split('\n\n')):
+    for boneIndex, poseBone in enumerate(boneList[:colours.shape[1]]):
 
         boneName = poseBone.name
         
@@ -268,24 +163,17 @@ def read_colour_anim(context, inFile):
         rna_ui['colour'] = { 'subtype': 'COLOR' }
 
         dataPath = 'pose.bones["%s"]["colour"]' % boneName
-        
-        curveR = action.fcurves.new(dataPath, index=0, action_group=boneName)
-        curveG = action.fcurves.new(dataPath, index=1, action_group=boneName)
-        curveB = action.fcurves.new(dataPath, index=2, action_group=boneName)
-        curveA = action.fcurves.new(dataPath, index=3, action_group=boneName)
 
-        for frame, line in enumerate(clrLines.split()):
+        for index in range(4):
+            values = colours[:, boneIndex, index]
+            keyIndices = linear_key_indices(values)
+            add_linear_fcurve(action, dataPath, index, boneName, keyIndices.astype(np.float64), values[keyIndices] / 255.0)
 
-            curveR.keyframe_points.insert(frame, int(line[0:2], 16) / 255.0).interpolation = 'LINEAR'
-            curveG.keyframe_points.insert(frame, int(line[2:4], 16) / 255.0).interpolation = 'LINEAR'
-            curveB.keyframe_points.insert(frame, int(line[4:6], 16) / 255.0).interpolation = 'LINEAR'
-            curveA.keyframe_points.insert(frame, int(line[6:8], 16) / 255.0).interpolation = 'LINEAR'
+    STAGE_TIMER.end()
 
 #==============================================================================#
 
 from bpy_extras.io_utils import ImportHelper
-from bpy.props import StringProperty, BoolProperty, EnumProperty
-from bpy.types import Operator
 
 class BrawlCrateAnimImport_operator(bpy.types.Operator, ImportHelper):
     """Import an animation exported from BrawlCrate"""
@@ -297,19 +185,77 @@ class BrawlCrateAnimImport_operator(bpy.types.Operator, ImportHelper):
 
     filter_glob: bpy.props.StringProperty(default="*.anim", options={'HIDDEN'})
     importColour: bpy.props.BoolProperty(name="import colour from clr.txt", default=False)
+    verbose:      bpy.props.BoolProperty(name="Print Parsed Lines",           default=False)
+
+    importFolder: bpy.props.BoolProperty(name="Import Whole Folder",         default=False,
+                                         description="Import every .anim file in the folder of the selected file and its subfolders")
+    useCache:     bpy.props.BoolProperty(name="Cache Parsed Files",          default=True,
+                                         description="Keep parsed files in the temp folder, unchanged files are not parsed again")
+    jobs:         bpy.props.IntProperty (name="Parse Jobs", min=0,          default=0,
+                                         description="Number of processes used to parse files, zero for one per cpu")
+
+    interpolation: bpy.props.EnumProperty (
+        name = "Interpolation",
+        items = (
+            ('HERMITE', "Hermite", "Use the key tangents, the same as BrawlCrate"),
+            ('LINEAR', "Linear", "Straight lines between keys, ignoring tangents"),
+        ),
+        default = 'HERMITE',
+    )
     
     def execute(self, context):
     
         from pathlib import PurePath
 
-        with open(self.filepath, 'r') as inFile:    
-            actionName = PurePath(self.filepath).with_suffix("").name
-            read_brawlcrate_anim(context, actionName, inFile)
+        hermite = self.interpolation == 'HERMITE'
+
+        if self.importFolder:
+            return self.import_folder(context, os.path.dirname(self.filepath), hermite)
+
+        actionName = PurePath(self.filepath).with_suffix("").name
+        anim = read_anim(self.filepath, self.verbose)
+        read_brawlcrate_anim(context, actionName, anim, hermite)
 
         if self.importColour:
             clrTxtPath = PurePath(self.filepath).with_name("clr.txt")
-            with open(clrTxtPath, 'r') as inFile:
-                read_colour_anim(context, inFile)
+            read_colour_anim(context, read_colours(clrTxtPath))
+
+        return {'FINISHED'}
+
+    def import_folder(self, context, folder, hermite):
+        """Parse every file in worker processes, then create the actions here one by one."""
+
+        import time
+
+        pathPairs = []
+        for dirPath, dirNames, fileNames in os.walk(folder):
+            dirNames.sort()
+            colourPath = os.path.join(dirPath, "clr.txt")
+            if not self.importColour or not os.path.isfile(colourPath):
+                colourPath = None
+            for fileName in sorted(fileNames):
+                if fileName.endswith(".anim"):
+                    pathPairs.append((os.path.join(dirPath, fileName), colourPath))
+
+        startTime = time.perf_counter()
+        cache = ParseCache() if self.useCache else None
+        parsed = parse_files_parallel(pathPairs, self.jobs, cache)
+        parseTime = time.perf_counter() - startTime
+
+        boneList = ordered_bones(context.active_object.pose.bones, context.active_object.data)
+        restOffsets = rest_offsets_inverted(boneList)
+
+        # bpy can only be used from the main thread, so actions are always created in order
+        for (animPath, colourPath), (anim, colours) in zip(pathPairs, parsed):
+            actionName = os.path.splitext(os.path.basename(animPath))[0]
+            read_brawlcrate_anim(context, actionName, anim, hermite, restOffsets)
+            # only the last action stays assigned, so keep the others from being discarded
+            context.active_object.animation_data.action.use_fake_user = True
+            if colours is not None:
+                read_colour_anim(context, colours)
+
+        print("imported %d animations from '%s', parsing took %.3fs, total %.3fs"
+              % (len(pathPairs), folder, parseTime, time.perf_counter() - startTime))
 
         return {'FINISHED'}
 
@@ -1,7 +1,19 @@
-import bpy
+import bpy, fnmatch, multiprocessing, os, re, time
+import numpy as np
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from bpy_extras.io_utils import ExportHelper
-from mathutils import Vector, Quaternion
+
+# sqee_io is a separate file, so check for it first to give a clear error
+try:
+    import sqee_io
+except ImportError as error:
+    if error.name != "sqee_io": raise
+    raise ImportError("sqee_io.py was not found, it needs to be installed in the same folder as this add-on, see README.md") from None
+
+from sqee_io import ExportCache, Fingerprint, STAGE_TIMER, ordered_bones
+from sqee_io import FCurveKeys, PoseBoneData, SqeeAnim, AnimJob, run_anim_job
 
 #==============================================================================#
 
@@ -20,21 +32,32 @@ bl_info = {
 
 #==============================================================================#
 
-class SqeeAnim():
-    def __init__(self):
-        self.boneCount = 0
-        self.frameCount = 0
-        self.baseTracks = defaultdict(dict)
-        self.extraTracks = defaultdict(dict)
-
-def tidy_value(precision, value):
-    result = ("%%.%df" % precision % value).rstrip("0")
-    if result.endswith("."): result += "0"
-    if result == "-0.0": result = "0.0"
-    return result
-
-def tidy_values(precision, *values):
-    return tuple(tidy_value(precision, val) for val in values)
+# splits a pose bone data path into the bone name and the rest of the path
+FCURVE_BONE_PATH = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\](.+)$')
+
+class SqeeSkeleton():
+    """Bone order and hierarchy of an armature, worked out once and shared by every action."""
+
+    def __init__(self, obj, exportCustom=False):
+        self.allBones = ordered_bones(obj.pose.bones, obj.data, hidden=True)
+        self.boneIndices = { pb.name: index for index, pb in enumerate(self.allBones) }
+        self.poseBoneList = [ pb for pb in self.allBones if pb.name[0] != '.' ]
+        self.boneNames = [ pb.name for pb in self.poseBoneList ]
+
+        self.chainLengths = {}
+        for pb in self.poseBoneList:
+            bone = pb.bone
+            chain = [bone, *bone.children_recursive]
+            self.chainLengths[pb.name] = max((child.tail_local - bone.head_local).length for child in chain)
+
+        # other properties can be anything, so only check them when they get exported
+        self.extraKeys = []
+        if exportCustom:
+            for pb in self.poseBoneList:
+                for key, value in pb.items():
+                    if key[0] not in "._":
+                        assert len(value) == 4 and type(value[0]) == float, "unsupported property type"
+                        self.extraKeys.append((pb.name, key))
 
 #==============================================================================#
 
@@ -52,6 +75,32 @@ class SqeeExportAnimation_operator(bpy.types.Operator, ExportHelper):
     swapYZ:          bpy.props.BoolProperty(name="Swap Y and Z Axis",        default=False)
     exportCustom:    bpy.props.BoolProperty(name="Export Custom Properties", default=False)
     ignoreLastFrame: bpy.props.BoolProperty(name="Don't Export Last Frame",  default=False)
+    useCache:        bpy.props.BoolProperty(name="Skip If Unchanged",        default=False)
+    legacySample:    bpy.props.BoolProperty(name="Sample With frame_set",    default=False)
+
+    reduceKeyframes:   bpy.props.BoolProperty (name="Reduce Keyframes",             default=False)
+    offsetTolerance:   bpy.props.FloatProperty(name="Offset Tolerance",             default=0.0005, min=0.0, precision=5)
+    rotationTolerance: bpy.props.FloatProperty(name="Rotation Tolerance (Degrees)", default=0.05,   min=0.0, precision=3)
+    scaleTolerance:    bpy.props.FloatProperty(name="Scale Tolerance",              default=0.0005, min=0.0, precision=5)
+
+    fileFormat: bpy.props.EnumProperty (
+        name = "File Format",
+        items = (
+            ('TEXT', "Text", "Human readable text, useful for debugging"),
+            ('BINARY', "Binary", "Quantized little endian data, stored one frame after another"),
+            ('CHUNKED', "Chunked Binary", "Binary data split into chunks that can be decoded on their own"),
+        ),
+        default = 'TEXT',
+    )
+
+    chunkFrames: bpy.props.IntProperty(name="Frames Per Chunk", default=32, min=1, max=1024)
+
+    # batch mode, each action is written next to the chosen file using its own name
+
+    exportActions: bpy.props.BoolProperty  (name="Export All Matching Actions", default=False)
+    actionFilter:  bpy.props.StringProperty(name="Action Name Filter",          default="*")
+    jobs:          bpy.props.IntProperty   (name="Worker Processes",            default=0, min=0, max=64,
+        description="Number of processes used to export actions, zero uses one for each cpu")
 
     def invoke(self, context, event):
         self.filepath = bpy.context.active_object.animation_data.action.name
@@ -62,23 +111,136 @@ class SqeeExportAnimation_operator(bpy.types.Operator, ExportHelper):
 
     def execute(self, context):
 
-        scene = bpy.context.scene
         obj = bpy.context.active_object
-        action = obj.animation_data.action
+        skeleton = SqeeSkeleton(obj, self.exportCustom)
 
-        anim = SqeeAnim()
-        
-        poseBoneList = sorted ( obj.pose.bones, key = lambda pb: (len(pb.parent_recursive), pb.name) )
-        poseBoneList = [ pb for pb in poseBoneList if pb.name[0] != '.' ]
+        if self.exportActions:
+            directory = os.path.dirname(self.filepath)
+            actions = [ action for action in bpy.data.actions
+                        if fnmatch.fnmatchcase(action.name, self.actionFilter) and self.animates(action, skeleton) ]
+            targets = [ (action, os.path.join(directory, action.name + self.filename_ext)) for action in actions ]
+        else:
+            targets = [ (obj.animation_data.action, self.filepath) ]
 
-        anim.boneCount = len(poseBoneList)
-        anim.frameCount = int(action.frame_range[1]) + 1 - int(self.ignoreLastFrame)
+        #----------------------------------------------------------#
+
+        jobs, fingerprints, prepareTimes = [], [], []
+
+        useFrameSet = self.legacySample or self.needs_frame_set(obj)
+        originalAction, originalFrame = obj.animation_data.action, context.scene.frame_current
+
+        for action, filepath in targets:
+
+            STAGE_TIMER.lap("animation.prepare")
+            startTime = time.perf_counter()
+            frameCount = int(action.frame_range[1]) + 1 - int(self.ignoreLastFrame)
+
+            # skip the export if nothing has changed since the last time
+            fingerprint = None
+            if self.useCache:
+                fingerprint = self.fingerprint(obj, action, skeleton, frameCount)
+                if fingerprint and ExportCache.for_file(filepath).is_current(filepath, fingerprint):
+                    print("'%s' is up to date" % filepath)
+                    continue
+
+            options = self.as_keywords(ignore=("filepath", "filter_glob", "check_existing"))
+            job = AnimJob(filepath, frameCount, skeleton.boneNames, skeleton.chainLengths, skeleton.extraKeys, options)
+
+            if useFrameSet:
+                obj.animation_data.action = action
+                job.anim = self.sample_frame_set(context.scene, skeleton.poseBoneList, frameCount)
+            else:
+                self.prepare_job(job, action, skeleton)
+
+            jobs.append(job)
+            fingerprints.append(fingerprint)
+            prepareTimes.append(time.perf_counter() - startTime)
+
+        if useFrameSet:
+            obj.animation_data.action = originalAction
+            context.scene.frame_set(originalFrame)
 
         #----------------------------------------------------------#
 
+        results = self.run_jobs(jobs)
+        STAGE_TIMER.end()
+
+        for (filepath, seconds, size, log), fingerprint in zip(results, fingerprints):
+            for line in log: print(line)
+            if fingerprint:
+                cache = ExportCache.for_file(filepath)
+                cache.store(filepath, fingerprint)
+                cache.save()
+
+        if self.exportActions:
+            print("\n{:<40} {:>6} {:>10} {:>8}".format("Action", "Frames", "Bytes", "Seconds"))
+            for job, (filepath, seconds, size, log), prepareTime in zip(jobs, results, prepareTimes):
+                name = os.path.splitext(os.path.basename(filepath))[0]
+                print("{:<40} {:>6} {:>10} {:>8.3f}".format(name, job.frameCount, size, prepareTime + seconds))
+            print("\nexported %d of %d actions, %d bytes" % (len(results), len(targets), sum(r[2] for r in results)))
+
+        #----------------------------------------------------------#
+
+        return {'FINISHED'}
+
+    #----------------------------------------------------------#
+
+    def animates(self, action, skeleton):
+        """Check if an action has any F-Curves for bones of the skeleton."""
+
+        for fcurve in action.fcurves:
+            match = FCURVE_BONE_PATH.match(fcurve.data_path)
+            if match and re.sub(r'\\(.)', r'\1', match.group(1)) in skeleton.boneIndices:
+                return True
+        return False
+
+    def run_jobs(self, jobs):
+        """Run export jobs in worker processes, or in this process if there is only one."""
+
+        workers = min(self.jobs or os.cpu_count() or 1, len(jobs))
+        if workers <= 1:
+            return [ run_anim_job(job) for job in jobs ]
+
+        # fork is not safe inside of blender, so always start fresh interpreters
+        mpContext = multiprocessing.get_context('spawn')
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mpContext) as pool:
+                return list(pool.map(run_anim_job, jobs))
+        except BrokenProcessPool:
+            print("worker processes failed, exporting in this process instead")
+            return [ run_anim_job(job) for job in jobs ]
+
+    #----------------------------------------------------------#
+
+    def needs_frame_set(self, obj):
+        """Check for anything that prepare_job can't reproduce."""
+
+        animData = obj.animation_data
+        if animData.drivers or animData.nla_tracks or animData.action_influence != 1.0:
+            return True
+
+        for pb in obj.pose.bones:
+            if pb.constraints or pb.rotation_mode == 'AXIS_ANGLE':
+                return True
+            bone = pb.bone
+            if not bone.use_inherit_rotation or bone.inherit_scale != 'FULL' or not bone.use_local_location:
+                return True
+
+        return False
+
+    #----------------------------------------------------------#
+
+    def sample_frame_set(self, scene, poseBoneList, frameCount):
+        """Sample the pose by setting every frame of the scene, slow but always correct."""
+
+        anim = SqeeAnim()
+        anim.boneCount = len(poseBoneList)
+        anim.frameCount = frameCount
+
         for frame in range(0, anim.frameCount):
             scene.frame_set(frame)
-            
+
             for pb in poseBoneList:
 
                 mat = pb.matrix
@@ -99,7 +261,7 @@ class SqeeExportAnimation_operator(bpy.types.Operator, ExportHelper):
                 v = mat.to_scale()
                 if self.swapYZ: track[frame] = ( v.x, v.z, v.y )
                 else: track[frame] = ( v.x, v.y, v.z )
-                    
+
                 if self.exportCustom:
                     for key, value in pb.items():
                         if key[0] not in "._":
@@ -109,70 +271,122 @@ class SqeeExportAnimation_operator(bpy.types.Operator, ExportHelper):
                                 assert False, "unsupported property type"
                             track[frame] = tuple(value)
 
-        #----------------------------------------------------------#
+        return anim
+
+    #----------------------------------------------------------#
 
-        for trackName, trackDict in anim.baseTracks.items():
-            first = Vector(trackDict[0])
-            if all((first - Vector(value)).length < 0.0001 for value in trackDict.values()):
-                anim.baseTracks[trackName] = first
+    def prepare_job(self, job, action, skeleton):
+        """Gather the F-Curves of an action, so that a job can build the poses with numpy.
 
-        for trackName, trackDict in anim.extraTracks.items():
-            first = Vector(trackDict[0])
-            if all((first - Vector(value)).length < 0.0001 for value in trackDict.values()):
-                anim.extraTracks[trackName] = first
+        Gives the same tracks as sample_frame_set, as long as needs_frame_set is False.
+        """
 
-        #----------------------------------------------------------#
+        frames = np.arange(job.frameCount, dtype=np.float64)
+        channels = self.action_channels(action, frames)
 
-        with open(self.filepath, 'w', encoding='utf-8') as o:
-            
-            frameFmtStr = "\n %{}d".format(len(str(anim.frameCount - 1)))
+        def channel(pb, path, defaults):
+            curves = channels[pb.name].get(path, {})
+            return [ curves.get(index, default) for index, default in enumerate(defaults) ]
 
-            o.write("# SQEE Animation Format\n")
+        job.bones = []
+        for pb in skeleton.allBones:
+            if pb.rotation_mode == 'QUATERNION':
+                rotation = channel(pb, ".rotation_quaternion", pb.rotation_quaternion)
+            else:
+                rotation = channel(pb, ".rotation_euler", pb.rotation_euler)
+            job.bones.append ( PoseBoneData (
+                pb.name, skeleton.boneIndices[pb.parent.name] if pb.parent else -1,
+                pb.bone.matrix_local, pb.rotation_mode, channel(pb, ".location", pb.location),
+                rotation, channel(pb, ".scale", pb.scale) ) )
 
-            o.write("\n\n################################################################################\n")
+        job.extraChannels = []
+        for boneName, key in skeleton.extraKeys:
+            pb = skeleton.allBones[skeleton.boneIndices[boneName]]
+            path = '["%s"]' % bpy.utils.escape_identifier(key)
+            job.extraChannels.append(channel(pb, path, tuple(pb[key])))
 
-            o.write("\nSECTION Header\n")
+    def action_channels(self, action, frames):
+        """Keyframes of every bone F-Curve in the action, by bone name, path, then array index.
 
-            o.write("\nBoneCount %d" % anim.boneCount)
-            o.write("\nFrameCount %d\n" % anim.frameCount)
+        Curves that use modifiers or easing interpolation get evaluated by blender
+        instead, which is slower but still doesn't need frame_set.
+        """
 
-            o.write("\n\n################################################################################\n")
+        channels = defaultdict(lambda: defaultdict(dict))
 
-            o.write("\nSECTION BaseTracks\n")
+        for fcurve in action.fcurves:
 
-            for trackName, trackData in anim.baseTracks.items():
-                o.write("\nTRACK %s" % trackName)
-                if type(trackData) is not dict:
-                    for val in tidy_values(self.precision, *trackData):
-                        o.write(" %s" % val)
-                else:
-                    for frame, frameData in trackData.items():
-                        o.write(frameFmtStr % frame)
-                        for val in tidy_values(self.precision, *frameData):
-                            o.write(" %s" % val)
-                o.write("\n")
-            
-            if self.exportCustom:
+            match = FCURVE_BONE_PATH.match(fcurve.data_path)
+            if fcurve.mute or match is None:
+                continue
 
-                o.write("\n\n################################################################################\n")
+            boneName = re.sub(r'\\(.)', r'\1', match.group(1))
+            points = fcurve.keyframe_points
 
-                o.write("\nSECTION ExtraTracks\n")
+            interpolation = np.empty(len(points), dtype=np.int32)
+            points.foreach_get('interpolation', interpolation)
 
-                for trackName, trackData in anim.extraTracks.items():
-                    o.write("\nTRACK %s" % trackName)
-                    if type(trackData) is not dict:
-                        for val in tidy_values(self.precision, *trackData):
-                            o.write(" %s" % val)
-                    else:
-                        for frame, frameData in trackData.items():
-                            o.write(frameFmtStr % frame)
-                            for val in tidy_values(self.precision, *frameData):
-                                o.write(" %s" % val)
-                    o.write("\n")
+            if fcurve.modifiers or np.any(interpolation > 2):
+                values = np.array([ fcurve.evaluate(frame) for frame in frames ])
+            else:
+                arrays = []
+                for attr in ('co', 'handle_left', 'handle_right'):
+                    values = np.empty(len(points) * 2, dtype=np.float32)
+                    points.foreach_get(attr, values)
+                    arrays.append(values)
+                values = FCurveKeys(*arrays, interpolation, fcurve.extrapolation)
 
-        #----------------------------------------------------------#
+            channels[boneName][match.group(2)][fcurve.array_index] = values
 
-        return {'FINISHED'}
+        return channels
+
+    #----------------------------------------------------------#
+
+    def fingerprint(self, obj, action, skeleton, frameCount):
+        """Hash of the action, the rest pose and the export options.
+
+        Hashing the keyframes gives the same answer as hashing the sampled poses
+        without having to sample them. That only holds if nothing else affects the
+        pose, so returns None when there are drivers, constraints or NLA tracks.
+        """
+
+        if obj.animation_data.drivers or obj.animation_data.nla_tracks:
+            return None
+        if any(pb.constraints for pb in obj.pose.bones):
+            return None
+
+        ignore = ("filepath", "filter_glob", "check_existing", "useCache", "exportActions", "actionFilter", "jobs")
+        options = self.as_keywords(ignore=ignore)
+        fingerprint = Fingerprint("animation", bl_info["version"], options)
+
+        fingerprint.add(frameCount)
+
+        # hidden bones aren't exported, but they still move the bones below them
+        for pb in skeleton.allBones:
+            bone = pb.bone
+            parentName = pb.parent.name if pb.parent else None
+            fingerprint.add(pb.name, parentName, [tuple(row) for row in bone.matrix_local])
+            fingerprint.add(bone.use_inherit_rotation, bone.inherit_scale, bone.use_local_location)
+            # channels without F-Curves keep whatever value the pose has
+            fingerprint.add(pb.rotation_mode, tuple(pb.location), tuple(pb.rotation_quaternion),
+                            tuple(pb.rotation_euler), tuple(pb.scale))
+            if self.exportCustom and pb.name[0] != '.':
+                fingerprint.add(sorted((key, tuple(value)) for key, value in pb.items() if key[0] not in "._"))
+
+        for fcurve in action.fcurves:
+            fingerprint.add(fcurve.data_path, fcurve.array_index, fcurve.extrapolation, fcurve.mute)
+            fingerprint.add([(m.type, m.mute, m.influence) for m in fcurve.modifiers])
+            points = fcurve.keyframe_points
+            for attr in ('co', 'handle_left', 'handle_right'):
+                values = np.empty(len(points) * 2, dtype=np.float32)
+                points.foreach_get(attr, values)
+                fingerprint.add(values)
+            for attr in ('interpolation', 'easing'):
+                values = np.empty(len(points), dtype=np.int32)
+                points.foreach_get(attr, values)
+                fingerprint.add(values)
+
+        return fingerprint.hexdigest()
 
 #==============================================================================#
 
@@ -1,6 +1,14 @@
-import bpy, json, re
+import bpy, os
 from bpy_extras.io_utils import ExportHelper
-from mathutils import Vector, Quaternion
+
+# sqee_io is a separate file, so check for it first to give a clear error
+try:
+    import sqee_io
+except ImportError as error:
+    if error.name != "sqee_io": raise
+    raise ImportError("sqee_io.py was not found, it needs to be installed in the same folder as this add-on, see README.md") from None
+
+from sqee_io import ExportCache, Fingerprint, STAGE_TIMER, ordered_bones, write_armature_json, encode_skeleton
 
 #==============================================================================#
 
@@ -19,12 +27,6 @@ bl_info = {
 
 #==============================================================================#
 
-def round_values(precision, *values):
-    rounded = ( round(val, precision) for val in values )
-    return tuple(0.0 if val == -0.0 else val for val in rounded)
-
-#==============================================================================#
-
 class SqeeExportArmature_operator(bpy.types.Operator, ExportHelper):
     """Export an armature in the SQEE format"""
 
@@ -37,6 +39,17 @@ class SqeeExportArmature_operator(bpy.types.Operator, ExportHelper):
 
     precision: bpy.props.IntProperty (name="Number of Decimal Places", default=5, min=3, max=7)
     swapYZ:    bpy.props.BoolProperty(name="Swap Y and Z Axis",        default=False)
+    useCache:  bpy.props.BoolProperty(name="Skip If Unchanged",        default=False)
+
+    fileFormat: bpy.props.EnumProperty (
+        name = "File Format",
+        items = (
+            ('JSON', "Json", "Bones with parent names, read by name at load time"),
+            ('BINARY', "Binary", "Written to an .sqs file next to the chosen path, with parent "
+                                 "indices, bind matrices and a name hash table, ready to use"),
+        ),
+        default = 'JSON',
+    )
 
     def invoke(self, context, event):
         self.filepath = bpy.context.active_object.name
@@ -47,12 +60,31 @@ class SqeeExportArmature_operator(bpy.types.Operator, ExportHelper):
 
     def execute(self, context):
 
+        STAGE_TIMER.lap("armature.gather")
+
         arma = bpy.context.active_object.data
         
-        boneList = sorted ( arma.bones, key = lambda b: (len(b.parent_recursive), b.name) )
-        boneList = [ b for b in boneList if b.name[0] != '.' ]
+        boneList = ordered_bones(arma.bones, arma)
         
+        filepath = self.filepath
+        if self.fileFormat == 'BINARY':
+            filepath = os.path.splitext(filepath)[0] + ".sqs"
+
+        # skip the export if nothing has changed since the last time
+        if self.useCache:
+            cache = ExportCache.for_file(filepath)
+            options = self.as_keywords(ignore=("filepath", "filter_glob", "check_existing", "useCache"))
+            fingerprint = Fingerprint("armature", bl_info["version"], options)
+            for bone in boneList:
+                parentName = bone.parent.name if bone.parent else None
+                fingerprint.add(bone.name, parentName, [tuple(row) for row in bone.matrix_local])
+            fingerprint = fingerprint.hexdigest()
+            if cache.is_current(filepath, fingerprint):
+                print("'%s' is up to date" % filepath)
+                return {'FINISHED'}
+
         jsonArmature = []
+        boneIndices = { bone.name: index for index, bone in enumerate(boneList) }
 
         #----------------------------------------------------------#
 
@@ -62,36 +94,42 @@ class SqeeExportArmature_operator(bpy.types.Operator, ExportHelper):
 
             if bone.parent and bone.parent.name[0] != '.':
                 jb['parent'] = bone.parent.name
+                jb['parentIndex'] = boneIndices[bone.parent.name]
                 mat = bone.parent.matrix_local.inverted() @ bone.matrix_local
             else:
                 jb['parent'] = None
+                jb['parentIndex'] = -1
                 mat = bone.matrix_local
 
             v = mat.to_translation()
-            if self.swapYZ: jb['offset'] = round_values(self.precision, v.x, v.z, v.y)
-            else: jb['offset'] = round_values(self.precision, v.x, v.y, v.z)
+            if self.swapYZ: jb['offset'] = (v.x, v.z, v.y)
+            else: jb['offset'] = (v.x, v.y, v.z)
 
             q = mat.to_quaternion()
-            if self.swapYZ: jb['rotation'] = round_values(self.precision, -q.x, -q.z, -q.y, q.w)
-            else: jb['rotation'] = round_values(self.precision, q.x, q.y, q.z, q.w)
+            if self.swapYZ: jb['rotation'] = (-q.x, -q.z, -q.y, q.w)
+            else: jb['rotation'] = (q.x, q.y, q.z, q.w)
 
             v = mat.to_scale()
-            if self.swapYZ: jb['scale'] = round_values(self.precision, v.x, v.z, v.y)
-            else: jb['scale'] = round_values(self.precision, v.x, v.y, v.z)
+            if self.swapYZ: jb['scale'] = (v.x, v.z, v.y)
+            else: jb['scale'] = (v.x, v.y, v.z)
             
             jsonArmature.append(jb)
 
         #----------------------------------------------------------#
 
-        with open(self.filepath, 'w', encoding='utf-8') as o:
+        STAGE_TIMER.lap("armature.write")
 
-            jstr = json.dumps(jsonArmature, indent=2)
+        if self.fileFormat == 'BINARY':
+            with open(filepath, 'wb') as o:
+                o.write(encode_skeleton(jsonArmature))
+        else:
+            write_armature_json(filepath, jsonArmature, self.precision)
 
-            jstr = re.sub(r"(\d),\n *", r"\1, ", jstr)
-            jstr = re.sub(r"\n *([\-\d])", r" \1", jstr)
-            jstr = re.sub(r"(\d)\n *", r"\1 ", jstr)
+        STAGE_TIMER.end()
 
-            o.write(jstr)
+        if self.useCache:
+            cache.store(filepath, fingerprint)
+            cache.save()
 
         #----------------------------------------------------------#
 
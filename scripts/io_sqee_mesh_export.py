@@ -1,7 +1,17 @@
-import bpy
+import bpy, struct
+import numpy as np
 from bpy_extras.io_utils import ExportHelper
 from mathutils import Vector
 
+# sqee_io is a separate file, so check for it first to give a clear error
+try:
+    import sqee_io
+except ImportError as error:
+    if error.name != "sqee_io": raise
+    raise ImportError("sqee_io.py was not found, it needs to be installed in the same folder as this add-on, see README.md") from None
+
+from sqee_io import ExportCache, Fingerprint, STAGE_TIMER, ordered_bones, tidy_value, tidy_values, tidy_rows
+
 #==============================================================================#
 
 bl_info = {
@@ -19,12 +29,137 @@ bl_info = {
 
 #==============================================================================#
 
+# layout of binary files, all values are little endian
+#
+#   header        64 bytes, see SQM_HEADER
+#   submeshes     32 bytes each, see SQM_SUBMESH
+#   blocks        24 bytes each, see SQM_BLOCK
+#   block data    each block starts on a 16 byte boundary
+#
+# block data is tightly packed and can be handed directly to the gpu:
+#
+#   VERT   vertex buffer, attributes interleaved in the same order as the text format,
+#          using the formats in the header, see SQM_FORMATS and SQM_ATTRIBUTE_TYPES
+#   INDX   index buffer, uint16 if there are at most 65536 vertices, otherwise uint32
+#
+# these blocks are only present if the matching attribute flag is set:
+#
+#   MSUB   (firstMeshlet, meshletCount) for each submesh, see SQM_MESHLET_RANGE
+#   MSHL   meshlet table and culling bounds, see SQM_MESHLET
+#   MSHV   uint32 vertex indices used by the meshlets
+#   MSHT   uint8 triangle corners, indexing into each meshlet's vertices
+#   SUBB   (origin, extents, radius) for each submesh, see SQM_BOUNDS
+#   BONB   (origin, extents, radius) for each bone in bone space, radius is -1 if unused
+#   LODS   screen size threshold and error for each lod after the first, see SQM_LOD
+#   LODR   (firstIndex, indexCount) in LODI for each lod and submesh, see SQM_INDEX_RANGE
+#   LODI   index buffer for all lods, same type as INDX and using the same vertices
+#   QPOS   float32 offset xyz and scale xyz, present if positions are UNORM16
+#
+# the header's format field stores four bits for each attribute, starting with
+# the lowest bits for position, then texcoord, normal, tangent, colour, bones
+# and weights. attributes that are not enabled have a format of zero.
+#
+# UNORM16 positions are followed by two bytes of padding. OCT_SNORM16 vectors are
+# octahedral encoded, for tangents the lowest bit of the second component is set
+# if the bitangent sign is negative.
+
+SQM_MAGIC = b"SQMB"
+SQM_VERSION = 2
+
+SQM_HEADER = struct.Struct("<4sHHIIIHHII3f3ffI")
+SQM_SUBMESH = struct.Struct("<16sIIII")
+SQM_BLOCK = struct.Struct("<4sIQQ")
+
+SQM_MESHLET_RANGE = np.dtype([('firstMeshlet', '<u4'), ('meshletCount', '<u4')])
+SQM_INDEX_RANGE = np.dtype([('firstIndex', '<u4'), ('indexCount', '<u4')])
+SQM_LOD = np.dtype([('screenSize', '<f4'), ('error', '<f4')])
+SQM_BOUNDS = np.dtype([('origin', '<f4', 3), ('extents', '<f4', 3), ('radius', '<f4'), ('padding', '<u4')])
+
+SQM_MESHLET = np.dtype ([
+    ('vertexOffset', '<u4'), ('triangleOffset', '<u4'), ('vertexCount', '<u2'), ('triangleCount', '<u2'),
+    ('centre', '<f4', 3), ('radius', '<f4'), ('axis', '<f4', 3), ('cutoff', '<f4'), ('padding', '<u4'),
+])
+
+SQM_ATTRIBUTE_FLAGS = {
+    'TexCoords': 1 << 0, 'Normals': 1 << 1, 'Tangents': 1 << 2,
+    'Colours': 1 << 3, 'Bones': 1 << 4, 'Bounds': 1 << 5, 'Meshlets': 1 << 6, 'LODs': 1 << 7,
+}
+
+SQM_FORMATS = {
+    'FLOAT32': 1, 'FLOAT16': 2, 'OCT_SNORM16': 3, 'UNORM8': 4, 'UNORM16': 5, 'UINT8': 6,
+}
+
+SQM_ATTRIBUTE_ORDER = ('position', 'texcoord', 'normal', 'tangent', 'colour', 'bones', 'weights')
+
+# numpy type for each supported combination of attribute and format
+SQM_ATTRIBUTE_TYPES = {
+    ('position', 'FLOAT32'): ('<f4', 3), ('position', 'UNORM16'): ('<u2', 4),
+    ('texcoord', 'FLOAT32'): ('<f4', 2), ('texcoord', 'FLOAT16'): ('<f2', 2),
+    ('normal', 'FLOAT32'): ('<f4', 3), ('normal', 'OCT_SNORM16'): ('<i2', 2),
+    ('tangent', 'FLOAT32'): ('<f4', 4), ('tangent', 'OCT_SNORM16'): ('<i2', 2),
+    ('colour', 'FLOAT32'): ('<f4', 4), ('colour', 'UNORM8'): ('<u1', 4),
+    ('bones', 'UINT8'): ('<u1', 4),
+    ('weights', 'FLOAT32'): ('<f4', 4), ('weights', 'UNORM16'): ('<u2', 4), ('weights', 'UNORM8'): ('<u1', 4),
+}
+
+def align_offset(offset, alignment=16):
+    return (offset + alignment - 1) // alignment * alignment
+
+#==============================================================================#
+
+def octahedral_encode(vectors):
+    """Map unit vectors onto an octahedron, then unfold that into a square."""
+    lengths = np.abs(vectors).sum(axis=1, keepdims=True)
+    v = vectors / np.where(lengths > 0.0, lengths, 1.0)
+    xy = v[:, :2].copy()
+    lower = v[:, 2] < 0.0
+    signs = np.where(xy[lower] >= 0.0, 1.0, -1.0)
+    xy[lower] = (1.0 - np.abs(xy[lower][:, ::-1])) * signs
+    return np.round(np.clip(xy, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+def octahedral_decode(encoded):
+    xy = encoded.astype(np.float64) / 32767.0
+    z = 1.0 - np.abs(xy).sum(axis=1)
+    lower = z < 0.0
+    signs = np.where(xy[lower] >= 0.0, 1.0, -1.0)
+    xy[lower] = (1.0 - np.abs(xy[lower][:, ::-1])) * signs
+    v = np.column_stack((xy, z))
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+def angle_error(a, b):
+    """Largest angle between matching unit vectors, in degrees."""
+    if len(a) == 0: return 0.0
+    return float(np.degrees(np.arccos(np.clip(np.einsum('ij,ij->i', a, b), -1.0, 1.0))).max())
+
+def quantize_weights(weights, maxValue):
+    """Quantize rows of bone weights so that each row still sums to exactly maxValue.
+
+    Rounding errors are corrected by giving the leftover units to the weights
+    that lost the most to rounding down. Rows with no weights stay empty.
+    """
+    totals = weights.sum(axis=1, keepdims=True)
+    scaled = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0.0) * maxValue
+    quantized = np.floor(scaled)
+    missing = np.where(totals[:, 0] > 0.0, maxValue - quantized.sum(axis=1), 0.0).astype(np.int64)
+    order = np.argsort(quantized - scaled, axis=1, kind='stable')
+    for slot in range(weights.shape[1]):
+        rows = missing > slot
+        quantized[rows, order[rows, slot]] += 1.0
+    return quantized
+
+#==============================================================================#
+
 class SqeeSubMesh():
     def __init__(self, name):
         self.name = name
         self.vertexDict = {}
         self.vertexList = []
         self.faceList = []
+        self.vertices = None
+        self.indices = None
+        self.meshlets = None
+        self.lods = []
+        self.bounds = None
 
 class SqeeMesh():
     def __init__(self):
@@ -32,16 +167,477 @@ class SqeeMesh():
         self.extents = None
         self.radius = 0.0
         self.subMeshList = []
+        self.lodThresholds = []
+        self.lodErrors = []
+        self.boneBounds = None
+
+#==============================================================================#
+
+def foreach_array(collection, attr, dtype, width=1):
+    """Read an attribute of every item in a bpy collection into a numpy array."""
+    array = np.empty(len(collection) * width, dtype=dtype)
+    collection.foreach_get(attr, array)
+    return array.reshape(-1, width) if width > 1 else array
+
+def normalized_f32(vectors):
+    """Normalize float32 rows the same way mathutils' Vector.normalized does.
+
+    The squared length is accumulated in double precision from single precision
+    products, last component first, and the scale factor is applied in single
+    precision, so the results match the per-loop path bit for bit.
+    """
+    products = (vectors * vectors).astype(np.float64)
+    lengthSq = np.zeros(len(vectors), dtype=np.float64)
+    for column in reversed(range(vectors.shape[1])):
+        lengthSq += products[:, column]
+    length = np.sqrt(lengthSq).astype(np.float32)
+    valid = lengthSq > 1.0e-35
+    scale = np.zeros(len(vectors), dtype=np.float32)
+    scale[valid] = np.float32(1.0) / length[valid]
+    return vectors * scale[:, None]
+
+def rounded(values, precision):
+    """Equivalent of to_tuple(precision) for float32 data.
+
+    Multiplying a float32 value by 10^precision is exact in double precision, so
+    numpy's multiply/rint/divide rounding gives the same results as mathutils.
+    """
+    return np.round(values.astype(np.float64), precision)
+
+def compute_bounds(positions):
+    """Axis aligned box and sphere as (origin xyz, extents xyz, radius).
+
+    Both share the same centre, so the sphere is not the tightest possible, but
+    that's what the engine expects. All zero if there are no positions.
+    """
+    if len(positions) == 0: return np.zeros(7)
+    boundsMin, boundsMax = positions.min(axis=0), positions.max(axis=0)
+    origin = (boundsMin + boundsMax) * 0.5
+    radius = np.sqrt(((positions - origin) ** 2).sum(axis=1).max())
+    return np.concatenate((origin, (boundsMax - boundsMin) * 0.5, [radius]))
+
+def vertex_group_arrays(mesh, boneIndexMap):
+    """Armature bone indices and weights for up to four groups per vertex."""
+    # vertex groups are variable length, so these still need a loop per vertex
+    bones = np.full((len(mesh.vertices), 4), -1.0, dtype=np.float64)
+    weights = np.zeros((len(mesh.vertices), 4), dtype=np.float32)
+    for v in mesh.vertices:
+        for index, group in enumerate(v.groups):
+            bones[v.index, index] = boneIndexMap[group.group]
+            weights[v.index, index] = group.weight
+    return bones, weights
+
+#==============================================================================#
+
+def dedupe_vertices(corners):
+    """Merge identical rows of a corner attribute array.
+
+    Returns the unique rows in order of first use, along with the index of the
+    unique row for each corner, which is the same result the old vertexDict
+    approach gave.
+    """
+    # adding zero turns -0.0 into 0.0, otherwise they would compare unequal
+    rows = np.ascontiguousarray(corners + 0.0)
+    keys = rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).ravel()
+
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    # np.unique sorts by key, so put the rows back into first use order
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    return rows[first[order]], rank[inverse.ravel()]
+
+def weld_vertices(vertices, tolerances):
+    """Merge vertices where every column is within the given tolerance.
+
+    Candidates are found with a spatial hash on the position, using the position
+    tolerance as the cell size. Each vertex is merged into the first vertex
+    before it that matches and isn't merged itself, looking through neighbouring
+    cells in a fixed order, then the survivors are compacted keeping their order.
+    Returns the welded vertices and a remap from old to new indices.
+    """
+    if len(vertices) == 0: return vertices, np.zeros(0, dtype=np.int64)
+
+    positions = vertices[:, :3]
+    extent = np.ptp(positions, axis=0)
+
+    # bigger cells only give more candidates, so grow them until the keys fit in an int64
+    cellSize = max(tolerances[:3].max(), extent.max() / 2.0**20, 1e-12)
+    cells = np.floor(positions / cellSize).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    dims = cells.max(axis=0) + 2
+    strides = np.array([dims[1] * dims[2], dims[2], 1], dtype=np.int64)
+
+    # keys of neighbouring cells differ by a constant, so searching for all of
+    # them at once is a search for the sorted keys plus that constant
+    keys = cells @ strides
+    order = np.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+
+    # every pair of vertices in neighbouring cells with the later one first, and
+    # the neighbour the earlier one was in from the point of view of the later one
+    laters, earliers, neighbours = [], [], []
+    offsets = [ (x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1) ]
+    for neighbour, offset in enumerate(offsets):
+        shifted = sortedKeys + np.dot(offset, strides)
+        first = np.searchsorted(sortedKeys, shifted, 'left')
+        counts = np.searchsorted(sortedKeys, shifted, 'right') - first
+        later = np.repeat(order, counts)
+        earlier = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)]
+        before = earlier < later
+        laters.append(later[before])
+        earliers.append(earlier[before])
+        neighbours.append(np.full(np.count_nonzero(before), neighbour, dtype=np.int64))
+
+    later, earlier, neighbour = np.concatenate(laters), np.concatenate(earliers), np.concatenate(neighbours)
+    matches = np.all(np.abs(vertices[later] - vertices[earlier]) <= tolerances, axis=1)
+    later, earlier, neighbour = later[matches], earlier[matches], neighbour[matches]
+    priority = neighbour * len(vertices) + earlier
+
+    # whether a vertex survives only depends on earlier vertices, so repeating
+    # this settles at least one more step of every chain of matches each time
+    target = np.arange(len(vertices))
+    while True:
+        candidates = target[earlier] == earlier
+        best = np.full(len(vertices), np.iinfo(np.int64).max)
+        np.minimum.at(best, later[candidates], priority[candidates])
+        newTarget = np.where(best == np.iinfo(np.int64).max, np.arange(len(vertices)), best % len(vertices))
+        if np.array_equal(newTarget, target): break
+        target = newTarget
+
+    keep = target == np.arange(len(vertices))
+    compact = np.cumsum(keep) - 1
+
+    return vertices[keep], compact[target]
+
+#==============================================================================#
+
+def compute_acmr(indices, cacheSize):
+    """Average cache miss ratio of a triangle list with a FIFO vertex cache."""
+    if len(indices) == 0: return 0.0
+    cache, cached, misses = [], set(), 0
+    for index in indices.ravel().tolist():
+        if index not in cached:
+            misses += 1
+            cache.append(index)
+            cached.add(index)
+            if len(cache) > cacheSize:
+                cached.discard(cache.pop(0))
+    return misses / len(indices)
+
+def optimize_vertex_cache(indices, vertexCount, cacheSize):
+    """Reorder triangles for the post-transform cache with the Tipsify algorithm.
+
+    From "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw",
+    Sander, Nehab and Barczak, 2007. Returns the new triangle order and the
+    positions in that order where the cache gets flushed, which mark the edges
+    of the clusters used by sort_clusters_for_overdraw.
+    """
+    triCount = len(indices)
+    flat = indices.ravel()
+
+    # vertex to triangle adjacency, stored as offsets into a flat array
+    adjacency = (np.argsort(flat, kind='stable') // 3).tolist()
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(flat, minlength=vertexCount)))).tolist()
+
+    triangles = indices.tolist()
+    liveCount = np.bincount(flat, minlength=vertexCount).tolist()
+    cacheTime = [0] * vertexCount
+    emitted = [False] * triCount
+    deadEnd = []
+
+    order, clusterStarts = [], [0]
+    fanning, timeStamp, cursor = 0, cacheSize + 1, 1
+
+    while fanning >= 0:
+
+        candidates = []
+
+        for tri in adjacency[offsets[fanning] : offsets[fanning + 1]]:
+            if emitted[tri]: continue
+            order.append(tri)
+            emitted[tri] = True
+            for v in triangles[tri]:
+                deadEnd.append(v)
+                candidates.append(v)
+                liveCount[v] -= 1
+                if timeStamp - cacheTime[v] > cacheSize:
+                    cacheTime[v] = timeStamp
+                    timeStamp += 1
+
+        # pick the candidate that will still be in the cache with the most triangles left
+        fanning, best = -1, -1
+        for v in candidates:
+            if liveCount[v] > 0:
+                priority = 0
+                if timeStamp - cacheTime[v] + 2 * liveCount[v] <= cacheSize:
+                    priority = timeStamp - cacheTime[v]
+                if priority > best:
+                    fanning, best = v, priority
+
+        # no good candidates, so try recently used vertices then just scan forward
+        if fanning == -1:
+            while deadEnd and fanning == -1:
+                v = deadEnd.pop()
+                if liveCount[v] > 0: fanning = v
+            while cursor < vertexCount and fanning == -1:
+                if liveCount[cursor] > 0: fanning = cursor
+                cursor += 1
+            if fanning != -1 and len(order) < triCount:
+                clusterStarts.append(len(order))
+
+    return indices[np.array(order, dtype=np.int64)], clusterStarts
+
+def sort_clusters_for_overdraw(indices, positions, clusterStarts):
+    """Sort clusters of triangles so that ones facing outwards are drawn first.
+
+    Each cluster is scored by how much its average normal points away from the
+    centre of the mesh, which approximates how likely it is to occlude the rest.
+    """
+    corners = positions[indices]
+    faceNormals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    faceCentres = corners.mean(axis=1)
+    meshCentre = faceCentres.mean(axis=0)
+
+    bounds = list(zip(clusterStarts, clusterStarts[1:] + [len(indices)]))
+
+    scores = []
+    for begin, end in bounds:
+        # cross product length is twice the area, so this is area weighted
+        normal = faceNormals[begin:end].sum(axis=0)
+        centre = faceCentres[begin:end].mean(axis=0)
+        length = np.linalg.norm(normal)
+        scores.append(np.dot(centre - meshCentre, normal / length) if length > 0.0 else 0.0)
+
+    ranking = sorted(range(len(bounds)), key=lambda c: -scores[c])
+    return np.concatenate([indices[bounds[c][0] : bounds[c][1]] for c in ranking])
+
+def reorder_vertices(vertices, indices):
+    """Renumber vertices in the order they are first used by the index buffer.
+
+    Vertices that aren't used by any triangle are removed. Returns the new
+    vertices and a remap from old to new indices.
+    """
+    flat = indices.ravel()
+    unique, first = np.unique(flat, return_index=True)
+    order = unique[np.argsort(first)]
+    remap = np.full(len(vertices), -1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return vertices[order], remap
+
+#==============================================================================#
+
+def plane_quadrics(indices, positions):
+    """Sum of the plane quadrics of the triangles around each vertex."""
+    corners = positions[indices]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    normals = np.divide(normals, lengths[:, None], out=np.zeros_like(normals), where=lengths[:, None] > 0.0)
+    planes = np.column_stack((normals, -np.einsum('ij,ij->i', normals, corners[:, 0])))
+    faceQuadrics = planes[:, :, None] * planes[:, None, :]
+    quadrics = np.zeros((len(positions), 4, 4))
+    for corner in range(3):
+        np.add.at(quadrics, indices[:, corner], faceQuadrics)
+    return quadrics
+
+def simplify_locked_vertices(vertices, indices, sharedPositions):
+    """Vertices that must not move when simplifying.
+
+    That includes vertices on open borders, vertices on uv or normal seams, where
+    more than one vertex has the same position, and vertices on the boundary with
+    another submesh.
+    """
+    locked = np.zeros(len(vertices), dtype=bool)
+
+    # edges used by only one triangle are on a border
+    edges = np.sort(np.concatenate((indices[:, [0, 1]], indices[:, [1, 2]], indices[:, [2, 0]])), axis=1)
+    edges, counts = np.unique(edges, axis=0, return_counts=True)
+    locked[edges[counts == 1].ravel()] = True
+
+    positions = vertices[:, :3]
+    _, inverse, counts = np.unique(positions, axis=0, return_inverse=True, return_counts=True)
+    locked |= counts[inverse.ravel()] > 1
+
+    if sharedPositions:
+        locked |= np.array([pos in sharedPositions for pos in map(tuple, positions.tolist())], dtype=bool)
+
+    return locked
+
+def collapse_flips(indices, positions, source, target):
+    """For each half edge collapse of source onto target, check if any triangle left around source would flip.
+
+    Moving one corner of a triangle changes its normal linearly, so the dot of
+    the old and new normals is a constant plus a dot product with the new
+    position. Those get computed once for every corner, then all the edges are
+    checked at once against the triangles around their source vertex.
+    """
+
+    # every corner of every triangle grouped by vertex, and the other two corners in winding order
+    order = np.argsort(indices.ravel(), kind='stable')
+    faces, corners = order // 3, order % 3
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(indices.ravel(), minlength=len(positions)))))
+    nextVerts, prevVerts = indices[faces, (corners + 1) % 3], indices[faces, (corners + 2) % 3]
+
+    # relative to the corner itself, so that meshes far from the origin keep their precision
+    origin = positions[indices[faces, corners]]
+    a, b = positions[nextVerts] - origin, positions[prevVerts] - origin
+    normals = np.cross(a, b)
+    constant = np.einsum('ij,ij->i', normals, normals)
+    linear = np.cross(a - b, normals)
+
+    flips = np.zeros(len(source), dtype=bool)
+
+    # expand to one row for each edge and triangle around its source, a batch of edges at a time
+    for first in range(0, len(source), 1 << 16):
+        u, v = source[first : first + (1 << 16)], target[first : first + (1 << 16)]
+        counts = offsets[u + 1] - offsets[u]
+        edgeRows = np.repeat(np.arange(len(u)), counts)
+        slots = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(offsets[u], counts)
+        moved = positions[v][edgeRows] - positions[u][edgeRows]
+        dots = constant[slots] + np.einsum('ij,ij->i', moved, linear[slots])
+        # triangles that contain both vertices are removed by the collapse
+        removed = (nextVerts[slots] == v[edgeRows]) | (prevVerts[slots] == v[edgeRows])
+        flips[first : first + len(u)] = np.bincount(edgeRows, weights=(dots <= 0.0) & ~removed, minlength=len(u)) > 0
+
+    return flips
+
+def simplify_indices(indices, positions, quadrics, locked, compatible, targetCount):
+    """Reduce a triangle list with quadric error half edge collapses.
+
+    Each pass finds every collapsible edge, then applies the cheapest collapses
+    that don't share any triangles with each other. A vertex always collapses
+    onto one of its neighbours, so no new vertices are ever created and the
+    result can use the same vertex buffer. Quadrics are updated in place, so
+    the result can be simplified further. Returns the new indices and the largest
+    collapse error, as a distance.
+    """
+    maxCost = 0.0
+    homogeneous = np.column_stack((positions, np.ones(len(positions))))
+
+    while len(indices) > targetCount:
+
+        # sorting one int64 per edge is much faster than np.unique on rows, and gives the same order
+        edges = np.concatenate((indices[:, [0, 1]], indices[:, [1, 2]], indices[:, [2, 0]]))
+        keys = np.sort(np.concatenate((edges[:, 0] * len(positions) + edges[:, 1], edges[:, 1] * len(positions) + edges[:, 0])))
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        edges = np.column_stack((keys // len(positions), keys % len(positions)))
+        edges = edges[~locked[edges[:, 0]]]
+        edges = edges[compatible(edges[:, 0], edges[:, 1])]
+
+        # collapses in the same pass never share triangles, so none of them can
+        # change what another sees, and they can all be checked for flips up front
+        edges = edges[~collapse_flips(indices, positions, edges[:, 0], edges[:, 1])]
+        if len(edges) == 0: break
+
+        source, target = edges[:, 0], edges[:, 1]
+        costs = np.einsum('ei,eij,ej->e', homogeneous[target], quadrics[source] + quadrics[target], homogeneous[target])
+        costs = np.maximum(costs, 0.0)
+
+        # vertex to triangle adjacency, stored as offsets into a flat array
+        adjacency = np.argsort(indices.ravel(), kind='stable') // 3
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(indices.ravel(), minlength=len(positions)))))
+
+        remap = np.arange(len(positions))
+        touched = np.zeros(len(positions), dtype=bool)
+        wanted, collapsed = (len(indices) - targetCount + 1) // 2, 0
+
+        for edge in np.argsort(costs, kind='stable').tolist():
+
+            u, v = source[edge], target[edge]
+            if touched[u] or touched[v]: continue
+
+            remap[u] = v
+            quadrics[v] += quadrics[u]
+            maxCost = max(maxCost, costs[edge])
+            touched[indices[adjacency[offsets[u] : offsets[u + 1]]].ravel()] = True
+            touched[v] = True
+
+            collapsed += 1
+            if collapsed == wanted: break
+
+        if collapsed == 0: break
+
+        indices = remap[indices]
+        indices = indices[(indices[:, 0] != indices[:, 1]) & (indices[:, 1] != indices[:, 2]) & (indices[:, 2] != indices[:, 0])]
+
+    return indices, np.sqrt(maxCost)
 
-def tidy_value(precision, value):
-    assert type(value) is float
-    result = ("%%.%df" % precision % value).rstrip("0")
-    if result.endswith("."): result += "0"
-    if result == "-0.0": result = "0.0"
-    return result
+#==============================================================================#
 
-def tidy_values(precision, *values):
-    return tuple(tidy_value(precision, val) for val in values)
+def build_meshlets(indices, positions, maxVertices, maxTriangles):
+    """Split a triangle list into small clusters for gpu driven culling.
+
+    Triangles are added to the current meshlet in order until either limit would
+    be exceeded, so this works best after optimize_vertex_cache. Returns a table
+    of (vertexOffset, vertexCount, triangleOffset, triangleCount) rows, the flat
+    list of vertex indices used by each meshlet, the triangles as local indices
+    into those lists, and the culling bounds from meshlet_bounds.
+    """
+    table, vertexLists, triangleLists = [], [], []
+    local, vertices, triangles = {}, [], []
+
+    def flush():
+        table.append((sum(map(len, vertexLists)), len(vertices), sum(map(len, triangleLists)), len(triangles)))
+        vertexLists.append(vertices)
+        triangleLists.append(triangles)
+
+    for face in indices.tolist():
+        newCount = len(set(v for v in face if v not in local))
+        if len(vertices) + newCount > maxVertices or len(triangles) == maxTriangles:
+            flush()
+            local, vertices, triangles = {}, [], []
+        for v in face:
+            if v not in local:
+                local[v] = len(vertices)
+                vertices.append(v)
+        triangles.append(tuple(local[v] for v in face))
+
+    if triangles: flush()
+
+    table = np.array(table, dtype=np.int64).reshape(-1, 4)
+    meshletVertices = np.array([v for vl in vertexLists for v in vl], dtype=np.int64)
+    meshletTriangles = np.array([t for tl in triangleLists for t in tl], dtype=np.int64).reshape(-1, 3)
+
+    bounds = np.array([ meshlet_bounds(positions[np.array(vl)], np.array(tl))
+                        for vl, tl in zip(vertexLists, triangleLists) ]).reshape(-1, 8)
+
+    return table, meshletVertices, meshletTriangles, bounds
+
+def meshlet_bounds(positions, triangles):
+    """Bounding sphere and normal cone of a meshlet.
+
+    Returns (centre xyz, radius, axis xyz, cutoff), using the same conventions as
+    meshoptimizer. A meshlet can be culled when
+
+        dot(centre - camera, axis) >= cutoff * length(centre - camera) + radius
+
+    If the triangles face too many different ways to ever be culled like that,
+    the cutoff is set to 1.0.
+    """
+    boundsMin, boundsMax = positions.min(axis=0), positions.max(axis=0)
+    centre = (boundsMin + boundsMax) * 0.5
+    radius = np.linalg.norm(positions - centre, axis=1).max()
+
+    corners = positions[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    normals = normals[lengths > 0.0] / lengths[lengths > 0.0, None]
+
+    axis, cutoff = np.array([0.0, 0.0, 0.0]), 1.0
+
+    if len(normals):
+        axis = normals.sum(axis=0)
+        axisLength = np.linalg.norm(axis)
+        if axisLength > 0.0:
+            axis /= axisLength
+            minDot = (normals @ axis).min()
+            # cones wider than about 85 degrees aren't worth testing
+            if minDot > 0.1:
+                cutoff = np.sqrt(1.0 - minDot * minDot)
+
+    return (*centre, radius, *axis, cutoff)
 
 #==============================================================================#
 
@@ -55,14 +651,75 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
 
     filter_glob: bpy.props.StringProperty(default="*.sqm", options={'HIDDEN'})
 
-    disableArmature: bpy.props.BoolProperty(name="Disable Armature Modifier", default=True)
-    swapYZ:          bpy.props.BoolProperty(name="Swap the Y and Z Axes",     default=False)
-    exportBounds:    bpy.props.BoolProperty(name="Export Bounding Info",      default=False)
-    exportTexCoords: bpy.props.BoolProperty(name="Export Texture Coords",     default=False)
-    exportNormals:   bpy.props.BoolProperty(name="Export Vertex Normals",     default=False)
-    exportTangents:  bpy.props.BoolProperty(name="Export Vertex Tangents",    default=False)
-    exportColours:   bpy.props.BoolProperty(name="Export Vertex Colours",     default=False)
-    exportBones:     bpy.props.BoolProperty(name="Export Bones and Weights",  default=False)
+    disableArmature:  bpy.props.BoolProperty(name="Disable Armature Modifier", default=True)
+    swapYZ:           bpy.props.BoolProperty(name="Swap the Y and Z Axes",     default=False)
+    exportBounds:     bpy.props.BoolProperty(name="Export Bounding Info",      default=False)
+    exportTexCoords:  bpy.props.BoolProperty(name="Export Texture Coords",     default=False)
+    exportNormals:    bpy.props.BoolProperty(name="Export Vertex Normals",     default=False)
+    exportTangents:   bpy.props.BoolProperty(name="Export Vertex Tangents",    default=False)
+    exportColours:    bpy.props.BoolProperty(name="Export Vertex Colours",     default=False)
+    exportBones:      bpy.props.BoolProperty(name="Export Bones and Weights",  default=False)
+    legacyExtract:    bpy.props.BoolProperty(name="Use Per-Loop Extraction",   default=False)
+    weldVertices:     bpy.props.BoolProperty(name="Weld Nearby Vertices",      default=False)
+    optimizeCache:    bpy.props.BoolProperty(name="Optimize for Vertex Cache", default=False)
+    optimizeOverdraw: bpy.props.BoolProperty(name="Optimize for Overdraw",     default=False)
+    exportMeshlets:   bpy.props.BoolProperty(name="Export Meshlets",           default=False)
+    exportLODs:       bpy.props.BoolProperty(name="Generate LODs",             default=False)
+    useCache:         bpy.props.BoolProperty(name="Skip If Unchanged",         default=False)
+
+    weldTolerance: bpy.props.FloatProperty(name="Weld Tolerance",    default=0.0001, min=0.0, max=0.1, precision=5)
+    cacheSize:     bpy.props.IntProperty  (name="Vertex Cache Size", default=16, min=4, max=64)
+
+    meshletVertices:  bpy.props.IntProperty(name="Max Meshlet Vertices",  default=64,  min=3, max=255)
+    meshletTriangles: bpy.props.IntProperty(name="Max Meshlet Triangles", default=124, min=1, max=255)
+
+    lodRatios:      bpy.props.StringProperty(name="LOD Triangle Ratios", default="0.5 0.25 0.125")
+    lodScreenError: bpy.props.FloatProperty (name="LOD Screen Error",    default=0.001, min=0.0, max=0.1, precision=4)
+
+    fileFormat: bpy.props.EnumProperty (
+        name = "File Format",
+        items = (
+            ('TEXT', "Text", "Human readable text, useful for debugging"),
+            ('BINARY', "Binary", "Packed little endian data that can be memory mapped"),
+        ),
+        default = 'TEXT',
+    )
+
+    # compact encodings, these only affect the binary format
+
+    quantizePositions: bpy.props.BoolProperty(name="Quantize Positions", default=False,
+        description="Store positions as unorm16 relative to the bounds of the vertices")
+
+    normalFormat: bpy.props.EnumProperty (
+        name = "Normal Format",
+        items = (
+            ('FLOAT32', "Float", "Full precision normals and tangents"),
+            ('OCT_SNORM16', "Octahedral", "Octahedral snorm16 normals and tangents, with the sign in a spare bit"),
+        ),
+        default = 'FLOAT32',
+    )
+
+    texcoordFormat: bpy.props.EnumProperty (
+        name = "Texcoord Format",
+        items = (('FLOAT32', "Float", "Full precision texcoords"), ('FLOAT16', "Half", "Half float texcoords")),
+        default = 'FLOAT32',
+    )
+
+    colourFormat: bpy.props.EnumProperty (
+        name = "Colour Format",
+        items = (('FLOAT32', "Float", "Full precision colours"), ('UNORM8', "Unorm8", "Eight bits per channel")),
+        default = 'FLOAT32',
+    )
+
+    weightFormat: bpy.props.EnumProperty (
+        name = "Weight Format",
+        items = (
+            ('FLOAT32', "Float", "Full precision bone weights"),
+            ('UNORM16', "Unorm16", "Sixteen bit bone weights, renormalized after quantization"),
+            ('UNORM8', "Unorm8", "Eight bit bone weights, renormalized after quantization"),
+        ),
+        default = 'FLOAT32',
+    )
 
     #----------------------------------------------------------#
 
@@ -70,11 +727,11 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
 
         if self.exportTangents:
             assert self.exportNormals, "tangents require normals"
-        if self.exportBounds:
-            assert not self.exportBones, "bounds don't work with bones"
+
+        STAGE_TIMER.lap("mesh.evaluate")
 
         obj = context.active_object
-        uvLayer = vcLayer = arma = boneIndexMap = None
+        boneIndexMap = boneList = None
 
         if self.disableArmature:
             armatureModifier = obj.modifiers.get('Armature')
@@ -83,7 +740,8 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
                 armatureModifier.show_viewport = False
 
         depsgraph = context.evaluated_depsgraph_get()
-        mesh = obj.evaluated_get(depsgraph).to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph)
+        evaluated = obj.evaluated_get(depsgraph)
+        mesh = evaluated.to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph)
         if self.exportTangents: mesh.calc_tangents()
 
         if self.disableArmature and armatureModifier and restoreArmatureModifier:
@@ -91,10 +749,6 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
 
         sqm = SqeeMesh()
 
-        if self.exportTexCoords: uvLayer = mesh.uv_layers.active.data
-        if self.exportColours: vcLayer = mesh.vertex_colors.active.data
-        if self.exportBones: arma = obj.parent.data
-
         #----------------------------------------------------------#
 
         for name in mesh.materials.keys():
@@ -108,31 +762,171 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
 
         # compute mapping of mesh bone indices to armature bone indices
         if self.exportBones:
-            bones = sorted(arma.bones, key = lambda bone: (len(bone.parent_recursive), bone.name))
-            boneNames = tuple(bone.name for bone in bones if bone.name[0] != '.')
+            arma = obj.parent.data
+            boneList = ordered_bones(arma.bones, arma)
+            boneNames = tuple(bone.name for bone in boneList)
             assert len(boneNames) == len(obj.vertex_groups), "wrong number of vertex groups in mesh"
             boneIndexMap = tuple(boneNames.index(group) for group in obj.vertex_groups.keys())
-            print(boneIndexMap)
+
+        # skip the export if nothing has changed since the last time
+        if self.useCache:
+            cache = ExportCache.for_file(self.filepath)
+            fingerprint = self.fingerprint(obj, mesh, boneIndexMap, boneList)
+            if cache.is_current(self.filepath, fingerprint):
+                print("'%s' is up to date" % self.filepath)
+                evaluated.to_mesh_clear()
+                return {'FINISHED'}
 
         #----------------------------------------------------------#
 
+        STAGE_TIMER.lap("mesh.extract")
+
         # compute axis aligned box and sphere
         if self.exportBounds:
-            boundsMin = Vector.Fill(3, float('+inf'))
-            boundsMax = Vector.Fill(3, float('-inf'))
-            for vert in mesh.vertices:
-                boundsMin = Vector(map(min, zip(boundsMin, vert.co)))
-                boundsMax = Vector(map(max, zip(boundsMax, vert.co)))
-            sqm.origin = (boundsMin + boundsMax) * 0.5
-            sqm.extents = (boundsMax - boundsMin) * 0.5
-            for vert in mesh.vertices:
-                sqm.radius = max(sqm.radius, (sqm.origin - vert.co).length)
-            if self.swapYZ:
-                sqm.origin.y, sqm.origin.z = sqm.origin.z, sqm.origin.y
-                sqm.extents.y, sqm.extents.z = sqm.extents.z, sqm.extents.y
+            positions = foreach_array(mesh.vertices, 'co', np.float32, 3).astype(np.float64)
+            if self.swapYZ: positions = positions[:, [0, 2, 1]]
+            bounds = compute_bounds(positions).tolist()
+            sqm.origin, sqm.extents, sqm.radius = bounds[0:3], bounds[3:6], bounds[6]
+
+        #----------------------------------------------------------#
+
+        if self.legacyExtract:
+            self.extract_per_loop(mesh, sqm, boneIndexMap)
+        else:
+            self.extract_arrays(mesh, sqm, boneIndexMap)
+
+        # everything needed is now in sqm, so free the temporary mesh
+        evaluated.to_mesh_clear()
+        mesh = None
+
+        STAGE_TIMER.lap("mesh.process")
+
+        if self.exportLODs:
+            lodRatios = [float(ratio) for ratio in self.lodRatios.replace(',', ' ').split()]
+            assert lodRatios, "no lod ratios given"
+            assert all(0.0 < ratio < 1.0 for ratio in lodRatios), "lod ratios must be between 0 and 1"
+            sqm.lodErrors = [0.0] * len(lodRatios)
+            sharedPositions = self.shared_positions(sqm) if len(sqm.subMeshList) > 1 else None
+
+        for subMesh in sqm.subMeshList:
+
+            cornerCount = len(subMesh.indices) * 3
+            uniqueCount = len(subMesh.vertices)
+
+            # merge vertices that differ only by small amounts
+            if self.weldVertices:
+                subMesh.vertices, remap = weld_vertices(subMesh.vertices, self.weld_tolerances())
+                subMesh.indices = remap[subMesh.indices]
+                # welding can collapse tiny triangles, so get rid of those
+                i = subMesh.indices
+                subMesh.indices = i[(i[:, 0] != i[:, 1]) & (i[:, 1] != i[:, 2]) & (i[:, 2] != i[:, 0])]
+
+            args = (subMesh.name, cornerCount, len(subMesh.vertices), cornerCount - uniqueCount)
+            print("SubMesh '%s': %d corners -> %d vertices, %d duplicates removed" % args, end="")
+            if self.weldVertices:
+                args = (uniqueCount - len(subMesh.vertices), cornerCount // 3 - len(subMesh.indices))
+                print(", %d vertices welded, %d faces collapsed" % args, end="")
+            print()
+
+            # simplify each lod from the previous one, they all share the same vertices
+            if self.exportLODs:
+                positions = subMesh.vertices[:, :3]
+                quadrics = plane_quadrics(subMesh.indices, positions)
+                locked = simplify_locked_vertices(subMesh.vertices, subMesh.indices, sharedPositions)
+                indices = subMesh.indices
+                for level, ratio in enumerate(lodRatios):
+                    targetCount = int(len(subMesh.indices) * ratio)
+                    args = (indices, positions, quadrics, locked, self.simplify_compatible(subMesh), targetCount)
+                    indices, error = simplify_indices(*args)
+                    subMesh.lods.append(indices)
+                    sqm.lodErrors[level] = max(sqm.lodErrors[level], float(error))
+                    args = (subMesh.name, level + 1, len(indices), len(subMesh.indices), error)
+                    print("SubMesh '%s': LOD %d has %d of %d faces, error %.6f" % args)
+
+            # reorder triangles for the gpu, then vertices to match
+            if self.optimizeCache or self.optimizeOverdraw:
+                before = compute_acmr(subMesh.indices, self.cacheSize)
+                args = (subMesh.indices, len(subMesh.vertices), self.cacheSize)
+                subMesh.indices, clusterStarts = optimize_vertex_cache(*args)
+                if self.optimizeOverdraw:
+                    args = (subMesh.indices, subMesh.vertices[:, :3], clusterStarts)
+                    subMesh.indices = sort_clusters_for_overdraw(*args)
+                subMesh.lods = [optimize_vertex_cache(lod, len(subMesh.vertices), self.cacheSize)[0] for lod in subMesh.lods]
+                subMesh.vertices, remap = reorder_vertices(subMesh.vertices, subMesh.indices)
+                subMesh.indices = remap[subMesh.indices]
+                subMesh.lods = [remap[lod] for lod in subMesh.lods]
+                after = compute_acmr(subMesh.indices, self.cacheSize)
+                args = (subMesh.name, self.cacheSize, before, after, len(clusterStarts))
+                print("SubMesh '%s': ACMR (cache size %d) %.3f -> %.3f, %d clusters" % args)
+
+            # split into clusters with their own bounds for culling
+            if self.exportMeshlets:
+                args = (subMesh.indices, subMesh.vertices[:, :3], self.meshletVertices, self.meshletTriangles)
+                subMesh.meshlets = build_meshlets(*args)
+                print("SubMesh '%s': %d meshlets" % (subMesh.name, len(subMesh.meshlets[0])))
+
+        # tight bounds for each sub mesh, and for each bone in bone space
+        if self.exportBounds:
+            for subMesh in sqm.subMeshList:
+                subMesh.bounds = compute_bounds(subMesh.vertices[:, :3])
+            if self.exportBones:
+                sqm.boneBounds = self.compute_bone_bounds(obj, sqm, boneList)
+
+        # screen size below which each lod is good enough, from the error relative to the mesh size
+        if self.exportLODs:
+            positions = np.concatenate([subMesh.vertices[:, :3] for subMesh in sqm.subMeshList])
+            centre = (positions.min(axis=0) + positions.max(axis=0)) * 0.5
+            diameter = np.linalg.norm(positions - centre, axis=1).max() * 2.0
+            for error in sqm.lodErrors:
+                sqm.lodThresholds.append(min(1.0, self.lodScreenError * float(diameter) / error) if error > 0.0 else 1.0)
+
+        #----------------------------------------------------------#
+
+        if len(sqm.subMeshList) > 1:
+
+            startIndex = len(sqm.subMeshList[0].vertices)
+
+            for subMesh in sqm.subMeshList[1:]:
+                subMesh.indices = subMesh.indices + startIndex
+                subMesh.lods = [lod + startIndex for lod in subMesh.lods]
+                if subMesh.meshlets is not None:
+                    table, vertices, triangles, bounds = subMesh.meshlets
+                    subMesh.meshlets = (table, vertices + startIndex, triangles, bounds)
+                startIndex += len(subMesh.vertices)
+
+        #----------------------------------------------------------#
+
+        STAGE_TIMER.lap("mesh.write")
+
+        if self.fileFormat == 'BINARY':
+            self.write_binary(sqm)
+        else:
+            self.write_text(sqm)
+
+        STAGE_TIMER.end()
+
+        if self.useCache:
+            cache.store(self.filepath, fingerprint)
+            cache.save()
 
         #----------------------------------------------------------#
 
+        return {'FINISHED'}
+
+    #----------------------------------------------------------#
+
+    def extract_per_loop(self, mesh, sqm, boneIndexMap):
+        """Reference implementation, builds each vertex one loop at a time.
+
+        Only works with triangulated meshes. Kept around to validate the output
+        of extract_arrays, which should always produce an identical file.
+        """
+
+        uvLayer = vcLayer = None
+
+        if self.exportTexCoords: uvLayer = mesh.uv_layers.active.data
+        if self.exportColours: vcLayer = mesh.vertex_colors.active.data
+
         for faceNum, f in enumerate(mesh.polygons):
 
             # the sub mesh containing this face
@@ -196,19 +990,206 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
                 # add the index of this vertex to the face
                 subMesh.faceList[-1][cornerNum] = vertexIndex
 
-        #----------------------------------------------------------#
+        # flatten the vertex keys into rows, skipping disabled attributes
+        flatten = lambda key: tuple(val for attr in key if attr is not None for val in attr)
+        rowWidth = sum(width for attr, width in self.vertex_layout())
+        for subMesh in sqm.subMeshList:
+            vertices = np.array(list(map(flatten, subMesh.vertexList)), dtype=np.float64)
+            subMesh.vertices = vertices.reshape(-1, rowWidth)
+            subMesh.indices = np.array(subMesh.faceList, dtype=np.int64).reshape(-1, 3)
 
-        if len(sqm.subMeshList) > 1:
+    #----------------------------------------------------------#
 
-            startIndex = len(sqm.subMeshList[0].vertexList)
+    def extract_arrays(self, mesh, sqm, boneIndexMap):
+        """Build vertices for every triangle corner at once with foreach_get.
 
-            for subMesh in sqm.subMeshList[1:]:
-                func = lambda face: tuple(i + startIndex for i in face)
-                subMesh.faceList = list(map(func, subMesh.faceList))
-                startIndex += len(subMesh.vertexList)
+        Polygons with more than three sides are split using the mesh's loop
+        triangles, so quads and n-gons are exported correctly.
+        """
+
+        mesh.calc_loop_triangles()
+
+        # loop indices for each corner of each triangle, in polygon order
+        cornerLoops = foreach_array(mesh.loop_triangles, 'loops', np.int32)
+        cornerPolys = np.repeat(foreach_array(mesh.loop_triangles, 'polygon_index', np.int32), 3)
+        cornerVerts = foreach_array(mesh.loops, 'vertex_index', np.int32)[cornerLoops]
+
+        columns = []
+
+        positions = foreach_array(mesh.vertices, 'co', np.float32, 3)[cornerVerts]
+        columns.append(rounded(positions, 5))
+
+        if self.exportTexCoords:
+            texcrds = foreach_array(mesh.uv_layers.active.data, 'uv', np.float32, 2)[cornerLoops]
+            columns.append(rounded(texcrds, 5))
+
+        if self.exportNormals:
+            smooth = foreach_array(mesh.polygons, 'use_smooth', bool)[cornerPolys]
+            vertNormals = foreach_array(mesh.vertices, 'normal', np.float32, 3)[cornerVerts]
+            faceNormals = foreach_array(mesh.polygons, 'normal', np.float32, 3)[cornerPolys]
+            normals = np.where(smooth[:, None], vertNormals, faceNormals)
+            columns.append(rounded(normalized_f32(normals), 5))
+
+        if self.exportTangents:
+            # change from blender tangent (+Y) to sqee tangent (-Y)
+            tangents = -normalized_f32(foreach_array(mesh.loops, 'tangent', np.float32, 3)[cornerLoops])
+            signs = foreach_array(mesh.loops, 'bitangent_sign', np.float32)[cornerLoops]
+            columns.append(rounded(np.column_stack((tangents, signs)), 5))
+
+        if self.exportColours:
+            colours = foreach_array(mesh.vertex_colors.active.data, 'color', np.float32, 4)[cornerLoops]
+            columns.append(rounded(colours, 5))
+
+        if self.exportBones:
+            bones, weights = vertex_group_arrays(mesh, boneIndexMap)
+            columns.append(bones[cornerVerts])
+            columns.append(rounded(weights, 4)[cornerVerts])
+
+        corners = np.column_stack(columns)
+
+        if self.swapYZ:
+            offset = 0
+            for attr, width in self.vertex_layout():
+                if attr in ('position', 'normal', 'tangent'):
+                    corners[:, [offset + 1, offset + 2]] = corners[:, [offset + 2, offset + 1]]
+                if attr == 'tangent':
+                    corners[:, offset + 3] *= -1.0
+                offset += width
 
         #----------------------------------------------------------#
 
+        cornerMaterials = foreach_array(mesh.polygons, 'material_index', np.int32)[cornerPolys]
+
+        for materialIndex, subMesh in enumerate(sqm.subMeshList):
+
+            # corners are visited in the same order as the per-loop path
+            subMesh.vertices, remap = dedupe_vertices(corners[cornerMaterials == materialIndex])
+            subMesh.indices = remap.reshape(-1, 3)
+
+            # ensure that winding order is consistent
+            if self.swapYZ:
+                subMesh.indices = subMesh.indices[:, [0, 2, 1]]
+
+    #----------------------------------------------------------#
+
+    def fingerprint(self, obj, mesh, boneIndexMap, boneList):
+        """Hash of the evaluated mesh data and the export options.
+
+        Bone bounds also depend on where the mesh is relative to the armature,
+        and on the rest pose of the bones, so those are included when exported.
+        """
+
+        options = self.as_keywords(ignore=("filepath", "filter_glob", "check_existing", "useCache"))
+        fingerprint = Fingerprint("mesh", bl_info["version"] + (SQM_VERSION,), options)
+
+        fingerprint.add(tuple(mesh.materials.keys()), boneIndexMap)
+        fingerprint.add(foreach_array(mesh.vertices, 'co', np.float32, 3))
+        fingerprint.add(foreach_array(mesh.loops, 'vertex_index', np.int32))
+        fingerprint.add(foreach_array(mesh.polygons, 'loop_total', np.int32))
+        fingerprint.add(foreach_array(mesh.polygons, 'material_index', np.int32))
+        fingerprint.add(foreach_array(mesh.polygons, 'use_smooth', bool))
+
+        # tangents are computed from the uvs, so they matter even when not exported
+        if self.exportTexCoords or self.exportTangents:
+            fingerprint.add(foreach_array(mesh.uv_layers.active.data, 'uv', np.float32, 2))
+        if self.exportColours:
+            fingerprint.add(foreach_array(mesh.vertex_colors.active.data, 'color', np.float32, 4))
+        if self.exportBones:
+            fingerprint.add(*vertex_group_arrays(mesh, boneIndexMap))
+        if self.exportBones and self.exportBounds:
+            fingerprint.add(np.array(obj.matrix_world), np.array(obj.parent.matrix_world))
+            fingerprint.add(np.array([np.array(bone.matrix_local) for bone in boneList]))
+
+        return fingerprint.hexdigest()
+
+    #----------------------------------------------------------#
+
+    def vertex_layout(self):
+        """Attribute names and widths for the columns of each vertex row."""
+
+        layout = [('position', 3)]
+        if self.exportTexCoords: layout.append(('texcoord', 2))
+        if self.exportNormals:   layout.append(('normal', 3))
+        if self.exportTangents:  layout.append(('tangent', 4))
+        if self.exportColours:   layout.append(('colour', 4))
+        if self.exportBones:     layout.extend((('bones', 4), ('weights', 4)))
+        return layout
+
+    def compute_bone_bounds(self, obj, sqm, boneList):
+        """Bounds of the vertices influenced by each bone, in that bone's rest space.
+
+        At runtime, transforming these by the current bone matrices gives cheap
+        bounds for an animated mesh. Bones that don't influence any vertices get
+        a radius of -1.
+        """
+
+        meshToArmature = np.array(obj.parent.matrix_world.inverted() @ obj.matrix_world)
+        boneMatrices = np.array([np.array(bone.matrix_local) for bone in boneList]).reshape(-1, 4, 4)
+
+        # vertices have already had their axes swapped, so do the same to the matrices
+        if self.swapYZ:
+            swap = np.eye(4)[[0, 2, 1, 3]]
+            meshToArmature = swap @ meshToArmature @ swap
+            boneMatrices = swap @ boneMatrices @ swap
+
+        rows = np.concatenate([subMesh.vertices for subMesh in sqm.subMeshList])
+        positions = np.column_stack((rows[:, :3], np.ones(len(rows)))) @ meshToArmature.T
+        bones, weights = rows[:, -8:-4], rows[:, -4:]
+
+        boneBounds = np.zeros((len(boneList), 7))
+        boneBounds[:, 6] = -1.0
+
+        for index, matrix in enumerate(boneMatrices):
+            influenced = np.any((bones == index) & (weights > 0.0), axis=1)
+            if np.any(influenced):
+                local = positions[influenced] @ np.linalg.inv(matrix).T
+                boneBounds[index] = compute_bounds(local[:, :3])
+
+        return boneBounds
+
+    def shared_positions(self, sqm):
+        """Positions used by more than one submesh, these are on material boundaries."""
+
+        counts = {}
+        for subMesh in sqm.subMeshList:
+            for pos in set(map(tuple, subMesh.vertices[:, :3].tolist())):
+                counts[pos] = counts.get(pos, 0) + 1
+        return set(pos for pos, count in counts.items() if count > 1)
+
+    def simplify_compatible(self, subMesh):
+        """Function that checks if vertices can be collapsed without changing skinning much.
+
+        Bone indices must match, and weights must all be within 0.1 of each other.
+        """
+
+        if not self.exportBones:
+            return lambda source, target: np.ones(len(source), dtype=bool)
+
+        # bones and weights are always the last eight columns
+        bones, weights = subMesh.vertices[:, -8:-4], subMesh.vertices[:, -4:]
+
+        def compatible(source, target):
+            sameBones = np.all(bones[source] == bones[target], axis=1)
+            closeWeights = np.all(np.abs(weights[source] - weights[target]) <= 0.1, axis=1)
+            return sameBones & closeWeights
+
+        return compatible
+
+    def weld_tolerances(self):
+        """Per column tolerances for welding, bone indices must match exactly."""
+
+        tolerances = []
+        for attr, width in self.vertex_layout():
+            tolerances += [0.0 if attr == 'bones' else self.weldTolerance] * width
+        return np.array(tolerances, dtype=np.float64)
+
+    #----------------------------------------------------------#
+
+    def write_text(self, sqm):
+
+        # bones and weights are always the last eight columns
+        floatCount = sum(width for attr, width in self.vertex_layout() if attr not in ('bones', 'weights'))
+
         with open(self.filepath, 'w', encoding='utf-8') as o:
 
             o.write("# SQEE Mesh Format")
@@ -231,10 +1212,33 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
                 o.write("\nExtents %s %s %s" % tidy_values(5, *sqm.extents))
                 o.write("\nRadius %s\n"      % tidy_value(5, sqm.radius))
 
+            if self.exportMeshlets:
+                o.write("\nMeshlets %d %d\n" % (self.meshletVertices, self.meshletTriangles))
+
             for subMesh in sqm.subMeshList:
-                args = (subMesh.name, len(subMesh.vertexList), len(subMesh.faceList) * 3)
+                args = (subMesh.name, len(subMesh.vertices), len(subMesh.indices) * 3)
                 o.write("\nSubMesh %s %d %d" % args)
 
+            if self.exportBounds:
+                o.write("\n")
+                for subMesh in sqm.subMeshList:
+                    o.write("\nSubMeshBounds %s " % subMesh.name + " ".join(tidy_values(5, *subMesh.bounds.tolist())))
+
+            # bone space bounds, only for bones that influence some vertices
+            if self.exportBounds and self.exportBones:
+                o.write("\n")
+                for index, bounds in enumerate(sqm.boneBounds.tolist()):
+                    if bounds[6] >= 0.0:
+                        o.write("\nBoneBounds %d " % index + " ".join(tidy_values(5, *bounds)))
+
+            # screen size threshold, error, then index count for each sub mesh
+            if self.exportLODs:
+                o.write("\n")
+                for level, (threshold, error) in enumerate(zip(sqm.lodThresholds, sqm.lodErrors)):
+                    o.write("\nLOD %d %s %s" % (level + 1, *tidy_values(5, threshold, error)))
+                    for subMesh in sqm.subMeshList:
+                        o.write(" %d" % (len(subMesh.lods[level]) * 3))
+
             o.write("\n\n\n################################################################################\n")
 
             o.write("\nSECTION Vertices\n")
@@ -243,21 +1247,19 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
 
                 # comment to seperate sub meshes
                 if len(sqm.subMeshList) > 1:
-                    smLine = "##### SubMesh '%s' (%d) " % (subMesh.name, len(subMesh.vertexList))
+                    smLine = "##### SubMesh '%s' (%d) " % (subMesh.name, len(subMesh.vertices))
                     o.write("\n\n{:#<60}\n".format(smLine))
 
-                for vert in subMesh.vertexList:
+                # position and all other float attributes which are enabled, formatted in one go
+                lines = tidy_rows(5, subMesh.vertices[:, :floatCount])
 
-                    # write vertex position attribute
-                    o.write("\n%s %s %s" % tidy_values(5, *vert[0]))
+                if self.exportBones:
+                    bones = subMesh.vertices[:, floatCount:floatCount+4].astype(np.int64).tolist()
+                    weights = tidy_rows(4, subMesh.vertices[:, floatCount+4:])
+                    lines = [ "%s %d %d %d %d %s" % (line, *b, w) for line, b, w in zip(lines, bones, weights) ]
 
-                    # write all other attributes which are enabled
-                    if self.exportTexCoords: o.write(" %s %s"       % tidy_values(5, *vert[1]))
-                    if self.exportNormals:   o.write(" %s %s %s"    % tidy_values(5, *vert[2]))
-                    if self.exportTangents:  o.write(" %s %s %s %s" % tidy_values(5, *vert[3]))
-                    if self.exportColours:   o.write(" %s %s %s %s" % tidy_values(5, *vert[4]))
-                    if self.exportBones:     o.write(" %d %d %d %d" % vert[5])
-                    if self.exportBones:     o.write(" %s %s %s %s" % tidy_values(4, *vert[6]))
+                for line in lines:
+                    o.write("\n" + line)
 
                 o.write("\n")
 
@@ -269,18 +1271,284 @@ class SqeeExportMesh_operator(bpy.types.Operator, ExportHelper):
 
                 # comment to seperate sub meshes
                 if len(sqm.subMeshList) > 1:
-                    smLine = "##### SubMesh '%s' (%d) " % (subMesh.name, len(subMesh.faceList) * 3)
+                    smLine = "##### SubMesh '%s' (%d) " % (subMesh.name, len(subMesh.indices) * 3)
                     o.write("\n\n{:#<60}\n".format(smLine))
 
                 # write each face is on its own line
-                for face in subMesh.faceList:
+                for face in subMesh.indices.tolist():
                     o.write("\n%d %d %d" % tuple(face))
 
                 o.write("\n")
 
+            if self.exportLODs:
+
+                o.write("\n\n################################################################################\n")
+
+                o.write("\nSECTION LODIndices\n")
+
+                for level in range(len(sqm.lodThresholds)):
+
+                    for subMesh in sqm.subMeshList:
+
+                        # comment to seperate lods and sub meshes
+                        smLine = "##### LOD %d SubMesh '%s' (%d) " % (level + 1, subMesh.name, len(subMesh.lods[level]) * 3)
+                        o.write("\n\n{:#<60}\n".format(smLine))
+
+                        for face in subMesh.lods[level].tolist():
+                            o.write("\n%d %d %d" % tuple(face))
+
+                        o.write("\n")
+
+            if self.exportMeshlets:
+
+                o.write("\n\n################################################################################\n")
+
+                o.write("\nSECTION Meshlets\n")
+
+                for subMesh in sqm.subMeshList:
+
+                    table, vertices, triangles, bounds = subMesh.meshlets
+
+                    # comment to seperate sub meshes
+                    if len(sqm.subMeshList) > 1:
+                        smLine = "##### SubMesh '%s' (%d) " % (subMesh.name, len(table))
+                        o.write("\n\n{:#<60}\n".format(smLine))
+
+                    # header line with bounds, then vertex indices, then local triangles
+                    for (vOffset, vCount, tOffset, tCount), meshletBounds in zip(table.tolist(), bounds.tolist()):
+                        o.write("\nMESHLET %d %d " % (vCount, tCount))
+                        o.write(" ".join(tidy_values(5, *meshletBounds)))
+                        o.write("\n " + " ".join(map(str, vertices[vOffset : vOffset + vCount].tolist())))
+                        o.write("\n " + " ".join(map(str, triangles[tOffset : tOffset + tCount].ravel().tolist())))
+                        o.write("\n")
+
+    #----------------------------------------------------------#
+
+    def encode_vertices(self, rows):
+        """Convert vertex rows to the selected formats, and report the error of each.
+
+        Returns a list of (attribute, format, values) and, if positions are
+        quantized, the offset and scale needed to decode them.
+        """
+
+        columns, offset = {}, 0
+        for attr, width in self.vertex_layout():
+            columns[attr] = rows[:, offset : offset + width]
+            offset += width
+
+        fields, errors, quantization = [], {}, None
+
+        if self.quantizePositions:
+            positions = columns['position']
+            # the box is the bounds of the mesh itself, empty meshes get a unit box at the origin
+            if len(positions) == 0: lower, upper = np.zeros(3), np.ones(3)
+            else: lower, upper = positions.min(axis=0), positions.max(axis=0)
+            # flat axes still need a non zero scale, every vertex encodes to zero on them
+            scale = (np.where(upper > lower, upper - lower, 1.0) / 65535.0).astype(np.float32)
+            lower = lower.astype(np.float32)
+            encoded = np.round((positions - lower) / scale).clip(0, 65535)
+            errors['position'] = np.abs(encoded * scale + lower - positions).max(initial=0.0)
+            fields.append(('position', 'UNORM16', np.column_stack((encoded, np.zeros(len(rows))))))
+            quantization = (lower, scale)
+        else:
+            fields.append(('position', 'FLOAT32', columns['position']))
+
+        if self.exportTexCoords:
+            fmt = self.texcoordFormat
+            fields.append(('texcoord', fmt, columns['texcoord']))
+            if fmt == 'FLOAT16':
+                encoded = columns['texcoord'].astype(np.float16)
+                errors['texcoord'] = np.abs(encoded - columns['texcoord']).max(initial=0.0)
+
+        if self.exportNormals:
+            fmt = self.normalFormat
+            if fmt == 'OCT_SNORM16':
+                normals = columns['normal']
+                encoded = octahedral_encode(normals)
+                errors['normal (degrees)'] = angle_error(octahedral_decode(encoded), normals)
+                fields.append(('normal', fmt, encoded))
+            else:
+                fields.append(('normal', fmt, columns['normal']))
+
+        if self.exportTangents:
+            fmt = self.normalFormat
+            if fmt == 'OCT_SNORM16':
+                tangents, signs = columns['tangent'][:, :3], columns['tangent'][:, 3]
+                encoded = octahedral_encode(tangents)
+                encoded[:, 1] = (encoded[:, 1] & ~1) | (signs < 0.0)
+                errors['tangent (degrees)'] = angle_error(octahedral_decode(encoded), tangents)
+                fields.append(('tangent', fmt, encoded))
+            else:
+                fields.append(('tangent', fmt, columns['tangent']))
+
+        if self.exportColours:
+            fmt = self.colourFormat
+            if fmt == 'UNORM8':
+                encoded = np.round(columns['colour'].clip(0.0, 1.0) * 255.0)
+                errors['colour'] = np.abs(encoded / 255.0 - columns['colour']).max(initial=0.0)
+                fields.append(('colour', fmt, encoded))
+            else:
+                fields.append(('colour', fmt, columns['colour']))
+
+        if self.exportBones:
+            # unused slots are -1, which becomes 255, so that can't be a real bone
+            assert columns['bones'].max(initial=-1) < 255, "too many bones for eight bit indices"
+            fields.append(('bones', 'UINT8', columns['bones'].astype(np.int64) & 0xFF))
+            fmt = self.weightFormat
+            if fmt in ('UNORM16', 'UNORM8'):
+                maxValue = 65535.0 if fmt == 'UNORM16' else 255.0
+                encoded = quantize_weights(columns['weights'], maxValue)
+                errors['weights'] = np.abs(encoded / maxValue - columns['weights']).max(initial=0.0)
+                fields.append(('weights', fmt, encoded))
+            else:
+                fields.append(('weights', fmt, columns['weights']))
+
+        for attr, error in errors.items():
+            print("Max %s error: %.6f" % (attr, error))
+
+        return fields, quantization
+
+    #----------------------------------------------------------#
+
+    def write_binary(self, sqm):
+
+        attributes = 0
+        if self.exportTexCoords: attributes |= SQM_ATTRIBUTE_FLAGS['TexCoords']
+        if self.exportNormals:   attributes |= SQM_ATTRIBUTE_FLAGS['Normals']
+        if self.exportTangents:  attributes |= SQM_ATTRIBUTE_FLAGS['Tangents']
+        if self.exportColours:   attributes |= SQM_ATTRIBUTE_FLAGS['Colours']
+        if self.exportBones:     attributes |= SQM_ATTRIBUTE_FLAGS['Bones']
+        if self.exportBounds:    attributes |= SQM_ATTRIBUTE_FLAGS['Bounds']
+        if self.exportMeshlets:  attributes |= SQM_ATTRIBUTE_FLAGS['Meshlets']
+        if self.exportLODs:      attributes |= SQM_ATTRIBUTE_FLAGS['LODs']
+
+        fields, quantization = self.encode_vertices(np.concatenate([subMesh.vertices for subMesh in sqm.subMeshList]))
+
+        formats = 0
+        for attr, fmt, values in fields:
+            formats |= SQM_FORMATS[fmt] << (SQM_ATTRIBUTE_ORDER.index(attr) * 4)
+
+        vertexType = np.dtype([(attr, SQM_ATTRIBUTE_TYPES[attr, fmt]) for attr, fmt, values in fields])
+
+        vertexCount = sum(len(subMesh.vertices) for subMesh in sqm.subMeshList)
+        indexCount = sum(len(subMesh.indices) * 3 for subMesh in sqm.subMeshList)
+        indexType = np.dtype('<u2') if vertexCount <= 0x10000 else np.dtype('<u4')
+
+        vertexData = np.zeros(vertexCount, dtype=vertexType)
+        indexData = np.empty(indexCount, dtype=indexType)
+
+        for attr, fmt, values in fields:
+            vertexData[attr] = values
+
+        subMeshTable = bytearray()
+        firstVertex = firstIndex = 0
+
+        for subMesh in sqm.subMeshList:
+
+            indexData[firstIndex : firstIndex + subMesh.indices.size] = subMesh.indices.ravel()
+
+            args = (subMesh.name.encode('utf-8'), firstVertex, len(subMesh.vertices), firstIndex, subMesh.indices.size)
+            subMeshTable += SQM_SUBMESH.pack(*args)
+
+            firstVertex += len(subMesh.vertices)
+            firstIndex += subMesh.indices.size
+
+        blocks = [(b"VERT", vertexData.tobytes()), (b"INDX", indexData.tobytes())]
+
+        if quantization is not None:
+            blocks.append((b"QPOS", np.concatenate(quantization).astype('<f4').tobytes()))
+
+        if self.exportMeshlets:
+
+            ranges = np.zeros(len(sqm.subMeshList), dtype=SQM_MESHLET_RANGE)
+            meshletTables, meshletVertices, meshletTriangles = [], [], []
+            firstMeshlet = vertexOffset = triangleOffset = 0
+
+            for index, subMesh in enumerate(sqm.subMeshList):
+
+                table, vertices, triangles, bounds = subMesh.meshlets
+                ranges[index] = (firstMeshlet, len(table))
+
+                meshlets = np.zeros(len(table), dtype=SQM_MESHLET)
+                meshlets['vertexOffset'] = table[:, 0] + vertexOffset
+                meshlets['vertexCount'] = table[:, 1]
+                meshlets['triangleOffset'] = table[:, 2] + triangleOffset
+                meshlets['triangleCount'] = table[:, 3]
+                meshlets['centre'], meshlets['radius'] = bounds[:, 0:3], bounds[:, 3]
+                meshlets['axis'], meshlets['cutoff'] = bounds[:, 4:7], bounds[:, 7]
+
+                meshletTables.append(meshlets)
+                meshletVertices.append(vertices.astype('<u4'))
+                meshletTriangles.append(triangles.astype('<u1'))
+
+                firstMeshlet += len(table)
+                vertexOffset += len(vertices)
+                triangleOffset += len(triangles)
+
+            blocks.append((b"MSUB", ranges.tobytes()))
+            blocks.append((b"MSHL", np.concatenate(meshletTables).tobytes()))
+            blocks.append((b"MSHV", np.concatenate(meshletVertices).tobytes()))
+            blocks.append((b"MSHT", np.concatenate(meshletTriangles).tobytes()))
+
+        if self.exportBounds:
+
+            bounds = np.zeros(len(sqm.subMeshList), dtype=SQM_BOUNDS)
+            for index, subMesh in enumerate(sqm.subMeshList):
+                bounds[index] = (subMesh.bounds[0:3], subMesh.bounds[3:6], subMesh.bounds[6], 0)
+            blocks.append((b"SUBB", bounds.tobytes()))
+
+            if self.exportBones:
+                bounds = np.zeros(len(sqm.boneBounds), dtype=SQM_BOUNDS)
+                bounds['origin'], bounds['extents'] = sqm.boneBounds[:, 0:3], sqm.boneBounds[:, 3:6]
+                bounds['radius'] = sqm.boneBounds[:, 6]
+                blocks.append((b"BONB", bounds.tobytes()))
+
+        if self.exportLODs:
+
+            lods = np.zeros(len(sqm.lodThresholds), dtype=SQM_LOD)
+            lods['screenSize'], lods['error'] = sqm.lodThresholds, sqm.lodErrors
+
+            ranges = np.zeros((len(lods), len(sqm.subMeshList)), dtype=SQM_INDEX_RANGE)
+            lodIndices, firstIndex = [], 0
+
+            for level in range(len(lods)):
+                for index, subMesh in enumerate(sqm.subMeshList):
+                    ranges[level, index] = (firstIndex, subMesh.lods[level].size)
+                    lodIndices.append(subMesh.lods[level].ravel().astype(indexType))
+                    firstIndex += subMesh.lods[level].size
+
+            blocks.append((b"LODS", lods.tobytes()))
+            blocks.append((b"LODR", ranges.tobytes()))
+            blocks.append((b"LODI", np.concatenate(lodIndices).tobytes()))
+
         #----------------------------------------------------------#
 
-        return {'FINISHED'}
+        origin = tuple(sqm.origin) if self.exportBounds else (0.0, 0.0, 0.0)
+        extents = tuple(sqm.extents) if self.exportBounds else (0.0, 0.0, 0.0)
+
+        header = SQM_HEADER.pack (
+            SQM_MAGIC, SQM_VERSION, SQM_HEADER.size, attributes, vertexCount, indexCount,
+            vertexType.itemsize, indexType.itemsize, len(sqm.subMeshList), len(blocks),
+            *origin, *extents, sqm.radius, formats
+        )
+
+        # work out where each block will go before writing anything
+        blockTable = bytearray()
+        offset = SQM_HEADER.size + len(subMeshTable) + SQM_BLOCK.size * len(blocks)
+        for tag, data in blocks:
+            offset = align_offset(offset)
+            blockTable += SQM_BLOCK.pack(tag, 0, offset, len(data))
+            offset += len(data)
+
+        with open(self.filepath, 'wb') as o:
+
+            o.write(header)
+            o.write(subMeshTable)
+            o.write(blockTable)
+
+            for tag, data in blocks:
+                o.write(bytes(align_offset(o.tell()) - o.tell()))
+                o.write(data)
 
 #==============================================================================#
 
@@ -300,4 +1568,3 @@ def unregister():
 if __name__ == "__main__":
     register()
     bpy.ops.sqee.export_mesh_operator('INVOKE_DEFAULT')
-
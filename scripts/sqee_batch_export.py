@@ -0,0 +1,226 @@
+"""Export every mesh, armature and animation in a tree of .blend files.
+
+Run from a shell, either with blender or with a normal python:
+
+    blender -b -P scripts/sqee_batch_export.py -- [options] [directories]
+    python scripts/sqee_batch_export.py [options] [directories]
+
+Each .blend file is opened by its own background blender process, with up to
+--jobs of them running at once. The workers use the same operators as the
+File > Export menu, writing into --output with one directory per .blend file.
+"""
+
+import argparse, os, shutil, subprocess, sys, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+#==============================================================================#
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+REPO_DIR = SCRIPTS_DIR.parent
+
+DEFAULT_ROOTS = [REPO_DIR / "RPG" / "blend", REPO_DIR / "STS"]
+
+# workers report each file they write with a line starting with this
+RESULT_PREFIX = "SQEE_BATCH_RESULT"
+
+# and each file they couldn't write with this, followed by the path, a tab and the error
+FAILURE_PREFIX = "SQEE_BATCH_FAILED"
+
+#==============================================================================#
+
+def parse_args():
+
+    # when run through blender, our arguments come after the '--'
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description="Batch export SQEE assets from .blend files")
+
+    parser.add_argument("roots", nargs="*", type=Path, default=DEFAULT_ROOTS,
+                        help="directories to search for .blend files")
+    parser.add_argument("--output", type=Path, default=REPO_DIR / "export",
+                        help="directory to write exported files to")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of blender processes to run at once")
+    parser.add_argument("--blender", default=None,
+                        help="blender executable used for the workers")
+    parser.add_argument("--swap-yz", action="store_true",
+                        help="swap the Y and Z axes of all exported data")
+    parser.add_argument("--format", choices=("TEXT", "BINARY"), default="TEXT",
+                        help="file format for exported meshes")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="export everything, even files that are up to date")
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args(argv)
+
+#==============================================================================#
+
+def find_blend_files(roots):
+    files = []
+    for root in roots:
+        if root.is_file(): files.append(root)
+        else: files.extend(sorted(root.rglob("*.blend")))
+    return files
+
+def output_dir_for(args, blendPath):
+    """Mirror the layout of the source tree in the output directory."""
+    try: relative = blendPath.resolve().relative_to(REPO_DIR)
+    except ValueError: relative = Path(blendPath.name)
+    return args.output / relative.with_suffix("")
+
+def find_blender(args):
+    if args.blender: return args.blender
+    if os.environ.get("BLENDER"): return os.environ["BLENDER"]
+    try:
+        import bpy
+        return bpy.app.binary_path
+    except ImportError:
+        return "blender"
+
+#==============================================================================#
+
+def run_worker(args, blender, blendPath):
+    """Export one .blend file in a separate blender process."""
+
+    command = [ blender, "-b", "--factory-startup", str(blendPath),
+                "--python-exit-code", "1", "--python", __file__,
+                "--", "--worker", "--output", str(output_dir_for(args, blendPath)),
+                "--format", args.format ]
+    if args.swap_yz: command.append("--swap-yz")
+    if args.no_cache: command.append("--no-cache")
+
+    startTime = time.perf_counter()
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - startTime
+
+    lines = process.stdout.splitlines()
+    outputs = [ line.split(maxsplit=2)[1:] for line in lines if line.startswith(RESULT_PREFIX) ]
+    failures = [ line[len(FAILURE_PREFIX) + 1:].partition("\t")[::2] for line in lines if line.startswith(FAILURE_PREFIX) ]
+
+    return blendPath, process.returncode, elapsed, outputs, failures, process.stdout
+
+def run_coordinator(args):
+
+    blendFiles = find_blend_files(args.roots)
+    if not blendFiles:
+        print("no .blend files found")
+        return 0
+
+    blender = find_blender(args)
+    if shutil.which(blender) is None:
+        print("blender executable not found: %s" % blender)
+        return 1
+
+    print("exporting %d files with %d jobs" % (len(blendFiles), args.jobs))
+
+    startTime = time.perf_counter()
+    results = []
+
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        futures = [ pool.submit(run_worker, args, blender, path) for path in blendFiles ]
+        for future in futures:
+            result = future.result()
+            blendPath, returnCode, elapsed, outputs, failures, log = result
+            if returnCode != 0:
+                print("\nFAILED: %s\n%s" % (blendPath, log))
+            for path, error in failures:
+                print("\nFAILED: %s\n    %s" % (path, error))
+            results.append(result)
+
+    totalTime = time.perf_counter() - startTime
+
+    #----------------------------------------------------------#
+
+    print("\n{:<60} {:>6} {:>8}  {}".format("File", "Files", "Seconds", "Status"))
+
+    for blendPath, returnCode, elapsed, outputs, failures, log in sorted(results, key=lambda r: -r[2]):
+        try: name = str(blendPath.resolve().relative_to(REPO_DIR))
+        except ValueError: name = str(blendPath)
+        if returnCode != 0: status = "FAILED (%d)" % returnCode
+        elif failures: status = "%d exports failed" % len(failures)
+        else: status = "ok"
+        print("{:<60} {:>6} {:>8.2f}  {}".format(name, len(outputs), elapsed, status))
+
+    failed = sum(1 for result in results if result[1] != 0)
+    failedExports = sum(len(result[4]) for result in results)
+    workTime = sum(result[2] for result in results)
+
+    print ( "\n%d files, %d failed, %d exports failed, %.2fs total, %.2fs of work" %
+            (len(results), failed, failedExports, totalTime, workTime) )
+
+    return 1 if failed or failedExports else 0
+
+#==============================================================================#
+
+def export_loaded_file(args):
+    """Runs inside a worker, with the .blend file already loaded."""
+
+    import bpy
+
+    if str(SCRIPTS_DIR) not in sys.path:
+        sys.path.insert(0, str(SCRIPTS_DIR))
+
+    import io_sqee_mesh_export, io_sqee_armature_export, io_sqee_animation_export
+
+    for module in (io_sqee_mesh_export, io_sqee_armature_export, io_sqee_animation_export):
+        module.register()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    context = bpy.context
+    viewLayer = context.view_layer
+
+    def export(obj, operator, path, **options):
+        """Export one object, a failure is reported and the rest of the file still gets exported."""
+        viewLayer.objects.active = obj
+        startTime = time.perf_counter()
+        try:
+            operator(filepath=str(path), useCache=not args.no_cache, **options)
+        except Exception as error:
+            traceback.print_exc()
+            # operators raise a RuntimeError containing the whole traceback, the last line is the cause
+            lines = [ line for line in str(error).splitlines() if line.strip() ]
+            message = lines[-1].strip() if lines else type(error).__name__
+            print("%s %s\t%s" % (FAILURE_PREFIX, path, message), flush=True)
+            return
+        print("%s %.3f %s" % (RESULT_PREFIX, time.perf_counter() - startTime, path), flush=True)
+
+    for obj in list(viewLayer.objects):
+
+        if obj.name[0] == '.':
+            continue
+
+        if obj.type == 'MESH':
+            mesh = obj.data
+            exportBones = obj.parent is not None and obj.parent.type == 'ARMATURE' and len(obj.vertex_groups) > 0
+            export ( obj, bpy.ops.sqee.export_mesh_operator, args.output / (obj.name + ".sqm"),
+                     swapYZ = args.swap_yz,
+                     fileFormat = args.format,
+                     exportBounds = True,
+                     exportTexCoords = len(mesh.uv_layers) > 0,
+                     exportNormals = True,
+                     exportTangents = len(mesh.uv_layers) > 0,
+                     exportColours = len(mesh.vertex_colors) > 0,
+                     exportBones = exportBones )
+
+        elif obj.type == 'ARMATURE':
+            export ( obj, bpy.ops.sqee.export_armature_operator, args.output / (obj.name + ".json"),
+                     swapYZ = args.swap_yz )
+
+            if obj.animation_data and obj.animation_data.action:
+                action = obj.animation_data.action
+                export ( obj, bpy.ops.sqee.export_animation_operator, args.output / (action.name + ".sqa"),
+                         swapYZ = args.swap_yz )
+
+#==============================================================================#
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    if args.worker:
+        export_loaded_file(args)
+    else:
+        sys.exit(run_coordinator(args))
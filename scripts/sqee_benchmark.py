@@ -0,0 +1,486 @@
+"""Benchmark the SQEE exporters and the BrawlCrate importer on generated scenes.
+
+Run from a shell, either with blender or with a normal python:
+
+    blender -b --factory-startup -P scripts/sqee_benchmark.py -- [options]
+    python scripts/sqee_benchmark.py [options]
+
+Every input is generated, so no .blend files are needed and no gpu is used.
+Each case is timed --repeat times with the stages reported by the exporters,
+keeping the fastest run, then run once more with tracemalloc to find the peak
+memory held by python and numpy objects created during the run. Results are
+written to --output as json. Pass an earlier result file with --compare to
+flag cases that got slower or use more memory.
+"""
+
+import argparse, datetime, json, os, platform, shutil, subprocess, sys, tempfile, time, tracemalloc
+from pathlib import Path
+
+#==============================================================================#
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+REPO_DIR = SCRIPTS_DIR.parent
+
+RESULTS_VERSION = 1
+
+MESH_LOOPS = (10_000, 100_000, 1_000_000)
+ARMATURE_BONES = (50, 200)
+ACTION_FRAMES = (60, 300, 1000)
+
+# the generated .anim has a key on every channel of every bone this often
+ANIM_BONES, ANIM_FRAMES, ANIM_KEY_STEP = 50, 1000, 4
+
+#==============================================================================#
+
+def parse_args():
+
+    # when run through blender, our arguments come after the '--'
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description="Benchmark the SQEE exporters and importers")
+
+    parser.add_argument("--output", type=Path, default=Path("sqee_benchmark.json"),
+                        help="json file to write the results to")
+    parser.add_argument("--compare", type=Path, default=None,
+                        help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="flag stages that are this much slower than in --compare")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of timed runs of each case, the fastest is kept")
+    parser.add_argument("--quick", action="store_true",
+                        help="only run the smallest size of each kind of case")
+    parser.add_argument("--filter", default="",
+                        help="only run cases whose names contain this")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the extra run of each case that measures memory")
+    parser.add_argument("--blender", default=None,
+                        help="blender executable, when not run from inside blender")
+
+    return parser.parse_args(argv)
+
+def find_blender(args):
+    if args.blender: return args.blender
+    if os.environ.get("BLENDER"): return os.environ["BLENDER"]
+    return "blender"
+
+#==============================================================================#
+
+def generate_anim_text(boneNames, endTime, keyStep):
+    """A BrawlCrate style .anim file with every channel of every bone keyed."""
+
+    import math
+
+    lines = [ "animVersion 1.1;", "mayaVersion 2015;", "timeUnit ntscf;",
+              "linearUnit cm;", "angularUnit deg;", "startTime 0;", "endTime %d;" % endTime ]
+
+    channels = ( ("translate", "X", "linear"), ("translate", "Y", "linear"), ("translate", "Z", "linear"),
+                 ("rotate", "X", "angular"), ("rotate", "Y", "angular"), ("rotate", "Z", "angular"),
+                 ("scale", "X", "linear"), ("scale", "Y", "linear"), ("scale", "Z", "linear") )
+
+    for boneIndex, boneName in enumerate(boneNames):
+        for channelIndex, (kind, axis, output) in enumerate(channels):
+            lines.append("anim %s.%s%s %s%s %s 0 0 0;" % (kind, kind, axis, kind, axis, boneName))
+            lines.append("animData {")
+            lines.append("  input time;")
+            lines.append("  output %s;" % output)
+            lines.append("  weighted 1;")
+            lines.append("  preInfinity constant;")
+            lines.append("  postInfinity constant;")
+            lines.append("  keys {")
+            for frame in range(0, endTime + 1, keyStep):
+                phase = frame * 0.05 + boneIndex * 0.3 + channelIndex
+                if kind == "translate": value = math.sin(phase) * 2.0
+                elif kind == "rotate": value = math.sin(phase) * 45.0
+                else: value = 1.0 + math.sin(phase) * 0.1
+                angle = math.cos(phase) * 10.0
+                lines.append("    %d %.6f fixed fixed 1 1 0 %.6f 1 %.6f 1;" % (frame, value, angle, angle))
+            lines.append("  }")
+            lines.append("}")
+
+    return "\n".join(lines) + "\n"
+
+def generate_colour_text(boneCount, frameCount):
+    """A clr.txt file that fades alpha out on every other bone, and holds the rest constant."""
+    blocks = []
+    for boneIndex in range(boneCount):
+        if boneIndex % 2: rows = [ "FFFFFF%02X" % (255 - 255 * frame // max(frameCount - 1, 1)) for frame in range(frameCount) ]
+        else: rows = [ "FFFFFFFF" ] * frameCount
+        blocks.append("\n".join(rows))
+    return "\n\n".join(blocks) + "\n"
+
+#==============================================================================#
+
+def summarize_stages(stages, seconds):
+    """Combine stages with the same name, returns {name: {seconds, peakMemory}}."""
+    result = {}
+    for name, stageSeconds, peak in stages:
+        entry = result.setdefault(name, { 'seconds': 0.0, 'peakMemory': None })
+        entry['seconds'] += stageSeconds
+        if peak is not None: entry['peakMemory'] = max(entry['peakMemory'] or 0, peak)
+    result['total'] = { 'seconds': seconds, 'peakMemory': None }
+    return result
+
+def compare_results(results, baseline, threshold):
+    """Print how each stage changed since the baseline, returns the number of regressions."""
+
+    regressions = 0
+
+    print("\n{:<32} {:<22} {:>9} {:>9} {:>8}  {}".format("Case", "Stage", "Before", "After", "Change", ""))
+
+    for caseName, case in results['cases'].items():
+        before = baseline['cases'].get(caseName)
+        if before is None:
+            print("{:<32} {:<22} {:>9} {:>9.4f} {:>8}".format(caseName, "total", "-", case['stages']['total']['seconds'], "new"))
+            continue
+        for stageName, stage in case['stages'].items():
+            previous = before['stages'].get(stageName)
+            if previous is None or previous['seconds'] <= 0.0: continue
+            change = stage['seconds'] / previous['seconds'] - 1.0
+            # very short stages are mostly noise
+            slower = change > threshold and stage['seconds'] - previous['seconds'] > 0.002
+            regressions += slower
+            print ( "{:<32} {:<22} {:>9.4f} {:>9.4f} {:>+7.1f}%  {}".format (
+                    caseName, stageName, previous['seconds'], stage['seconds'], change * 100.0,
+                    "REGRESSION" if slower else "" ) )
+        if before.get('peakMemory') and case.get('peakMemory'):
+            change = case['peakMemory'] / before['peakMemory'] - 1.0
+            if change > threshold:
+                regressions += 1
+                print ( "{:<32} {:<22} {:>9} {:>9} {:>+7.1f}%  REGRESSION".format (
+                        caseName, "peak memory", before['peakMemory'], case['peakMemory'], change * 100.0 ) )
+
+    return regressions
+
+#==============================================================================#
+
+class Scene():
+    """Generates and caches the test objects, which are shared between cases."""
+
+    def __init__(self, bpy, workDir):
+        self.bpy = bpy
+        self.workDir = workDir
+        self.armatures = {}
+        self.meshes = {}
+
+    def activate(self, obj):
+        bpy = self.bpy
+        for other in bpy.context.view_layer.objects:
+            other.select_set(False)
+        bpy.context.view_layer.objects.active = obj
+        obj.select_set(True)
+
+    def armature(self, boneCount):
+        """An armature with a random looking tree of bones, all named 'bone###'."""
+
+        if boneCount in self.armatures: return self.armatures[boneCount]
+
+        import random
+        from mathutils import Vector
+        bpy = self.bpy
+        rng = random.Random(boneCount)
+
+        arma = bpy.data.armatures.new("BenchArmature%d" % boneCount)
+        obj = bpy.data.objects.new("BenchArmature%d" % boneCount, arma)
+        bpy.context.scene.collection.objects.link(obj)
+        self.activate(obj)
+
+        bpy.ops.object.mode_set(mode='EDIT')
+        editBones = []
+        for index in range(boneCount):
+            bone = arma.edit_bones.new("bone%03d" % index)
+            if editBones:
+                parent = editBones[rng.randrange(max(0, len(editBones) - 8), len(editBones))]
+                bone.parent = parent
+                bone.use_connect = False
+                bone.head = parent.tail
+            else:
+                bone.head = (0.0, 0.0, 0.0)
+            bone.tail = bone.head + Vector((rng.uniform(-0.3, 0.3), rng.uniform(-0.3, 0.3), 0.5))
+            bone.roll = rng.uniform(-1.0, 1.0)
+            editBones.append(bone)
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+        self.armatures[boneCount] = obj
+        return obj
+
+    def action(self, armature, frameCount):
+        """An action with bezier keys every 5 frames on every channel of every bone."""
+
+        import numpy as np
+        bpy = self.bpy
+
+        name = "%s_%d" % (armature.name, frameCount)
+        action = bpy.data.actions.get(name)
+        if action is None:
+            action = bpy.data.actions.new(name)
+            frames = np.arange(0, frameCount, 5, dtype=np.float32)
+            if frames[-1] != frameCount - 1: frames = np.append(frames, np.float32(frameCount - 1))
+            for boneIndex, pb in enumerate(armature.pose.bones):
+                pb.rotation_mode = 'QUATERNION'
+                for path, count, base, amount in ( ("location", 3, 0.0, 0.2), ("rotation_quaternion", 4, 0.5, 0.3),
+                                                   ("scale", 3, 1.0, 0.1) ):
+                    for index in range(count):
+                        fcurve = action.fcurves.new('pose.bones["%s"].%s' % (pb.name, path), index=index, action_group=pb.name)
+                        values = base + amount * np.sin(frames * 0.1 + boneIndex + index)
+                        co = np.empty(len(frames) * 2, dtype=np.float32)
+                        co[0::2], co[1::2] = frames, values
+                        fcurve.keyframe_points.add(len(frames))
+                        fcurve.keyframe_points.foreach_set('co', co)
+                        fcurve.update()
+
+        armature.animation_data_create()
+        armature.animation_data.action = action
+        return action
+
+    def mesh(self, loopCount):
+        """A triangulated grid with two materials, uvs, colours and weights for a 50 bone armature."""
+
+        if loopCount in self.meshes: return self.meshes[loopCount]
+
+        import numpy as np
+        bpy = self.bpy
+
+        armature = self.armature(ARMATURE_BONES[0])
+
+        # a square grid of quads, each split into two triangles
+        side = max(2, int(round((loopCount / 6.0) ** 0.5)))
+        gx, gy = np.meshgrid(np.arange(side + 1, dtype=np.float32), np.arange(side + 1, dtype=np.float32))
+        positions = np.column_stack((gx.ravel() / side, gy.ravel() / side, np.sin(gx.ravel() * 0.3) * 0.05))
+
+        quads = np.arange(side * side)
+        corner = quads // side * (side + 1) + quads % side
+        a, b, c, d = corner, corner + 1, corner + side + 2, corner + side + 1
+        triangles = np.column_stack((a, b, c, a, c, d)).reshape(-1, 3)
+
+        mesh = bpy.data.meshes.new("BenchMesh%d" % loopCount)
+        mesh.vertices.add(len(positions))
+        mesh.vertices.foreach_set('co', positions.astype(np.float32).ravel())
+        mesh.loops.add(triangles.size)
+        mesh.loops.foreach_set('vertex_index', triangles.astype(np.int32).ravel())
+        mesh.polygons.add(len(triangles))
+        mesh.polygons.foreach_set('loop_start', np.arange(0, triangles.size, 3, dtype=np.int32))
+        mesh.polygons.foreach_set('loop_total', np.full(len(triangles), 3, dtype=np.int32))
+        mesh.polygons.foreach_set('material_index', (np.arange(len(triangles)) // 2 % 2).astype(np.int32))
+        mesh.polygons.foreach_set('use_smooth', np.ones(len(triangles), dtype=bool))
+        mesh.update(calc_edges=True)
+
+        for name in ("BenchMatA", "BenchMatB"):
+            mesh.materials.append(bpy.data.materials.get(name) or bpy.data.materials.new(name))
+
+        loopVerts = triangles.ravel()
+        mesh.uv_layers.new(name="UVMap").data.foreach_set('uv', positions[loopVerts, :2].astype(np.float32).ravel())
+        colours = np.column_stack((positions[loopVerts], np.ones(len(loopVerts)))).astype(np.float32)
+        mesh.vertex_colors.new(name="Col").data.foreach_set('color', colours.ravel())
+
+        obj = bpy.data.objects.new("BenchMesh%d" % loopCount, mesh)
+        bpy.context.scene.collection.objects.link(obj)
+        obj.parent = armature
+
+        # each vertex is weighted to up to four bones, by distance along the grid
+        vertexIndices = np.arange(len(positions))
+        boneNames = [ bone.name for bone in armature.data.bones ]
+        groups = [ obj.vertex_groups.new(name=name) for name in boneNames ]
+        for offset, weight in enumerate((0.4, 0.3, 0.2, 0.1)):
+            boneIndices = (vertexIndices * 7 + offset * 13) % len(boneNames)
+            for boneIndex in np.unique(boneIndices):
+                groups[boneIndex].add(vertexIndices[boneIndices == boneIndex].tolist(), weight, 'ADD')
+
+        self.meshes[loopCount] = obj
+        return obj
+
+    def anim_file(self):
+        """Write the generated .anim and its clr.txt, returns the path of the .anim."""
+        directory = self.workDir / "anim"
+        directory.mkdir(exist_ok=True)
+        boneNames = [ bone.name for bone in self.armature(ANIM_BONES).data.bones ]
+        animPath = directory / "BenchAnim.anim"
+        animPath.write_text(generate_anim_text(boneNames, ANIM_FRAMES - 1, ANIM_KEY_STEP))
+        (directory / "clr.txt").write_text(generate_colour_text(len(boneNames) - 1, ANIM_FRAMES))
+        return animPath
+
+#==============================================================================#
+
+def build_cases(args, scene):
+    """Returns a list of (name, setup, run), setup prepares the scene and run is timed."""
+
+    import bpy
+    import brawlcrate_anim, io_brawlcrate_anim_import
+    from sqee_io import STAGE_TIMER
+
+    workDir = scene.workDir
+    sizes = lambda values: values[:1] if args.quick else values
+    cases = []
+
+    for loopCount in sizes(MESH_LOOPS):
+        for fileFormat in ('TEXT', 'BINARY'):
+            def setup(loopCount=loopCount):
+                scene.activate(scene.mesh(loopCount))
+            def run(loopCount=loopCount, fileFormat=fileFormat):
+                bpy.ops.sqee.export_mesh_operator ( filepath=str(workDir / "mesh.sqm"), fileFormat=fileFormat,
+                    exportBounds=True, exportTexCoords=True, exportNormals=True, exportTangents=True,
+                    exportColours=True, exportBones=True )
+            cases.append(("mesh_%dk_%s" % (loopCount // 1000, fileFormat.lower()), setup, run))
+
+    for boneCount in ARMATURE_BONES:
+        for fileFormat in ('JSON', 'BINARY'):
+            def setup(boneCount=boneCount):
+                scene.activate(scene.armature(boneCount))
+            def run(fileFormat=fileFormat):
+                bpy.ops.sqee.export_armature_operator(filepath=str(workDir / "armature.json"), fileFormat=fileFormat)
+            cases.append(("armature_%d_%s" % (boneCount, fileFormat.lower()), setup, run))
+
+    for boneCount in sizes(ARMATURE_BONES):
+        for frameCount in sizes(ACTION_FRAMES):
+            for fileFormat in ('TEXT', 'BINARY', 'CHUNKED'):
+                def setup(boneCount=boneCount, frameCount=frameCount):
+                    armature = scene.armature(boneCount)
+                    scene.action(armature, frameCount)
+                    scene.activate(armature)
+                def run(fileFormat=fileFormat):
+                    bpy.ops.sqee.export_animation_operator(filepath=str(workDir / "animation.sqa"), fileFormat=fileFormat, jobs=1)
+                cases.append(("animation_%d_%d_%s" % (boneCount, frameCount, fileFormat.lower()), setup, run))
+
+    # the importer is timed in stages like the exporters, with parsing as one more stage
+    animState = {}
+    def setup():
+        if 'path' not in animState: animState['path'] = scene.anim_file()
+        scene.activate(scene.armature(ANIM_BONES))
+    def run():
+        STAGE_TIMER.lap("import.parse")
+        anim, colours = brawlcrate_anim.parse_files(str(animState['path']), str(animState['path'].with_name("clr.txt")))
+        io_brawlcrate_anim_import.read_brawlcrate_anim(bpy.context, "BenchImport", anim)
+        io_brawlcrate_anim_import.read_colour_anim(bpy.context, colours)
+        bpy.data.actions.remove(bpy.data.actions["BenchImport"])
+    cases.append(("import_anim_%d_%d" % (ANIM_BONES, ANIM_FRAMES), setup, run))
+
+    return [ case for case in cases if args.filter in case[0] ]
+
+def run_case(setup, run, repeat, measureMemory):
+    """Time a case, returns {seconds, peakMemory, stages}."""
+
+    from sqee_io import STAGE_TIMER
+
+    setup()
+    best = None
+
+    STAGE_TIMER.enabled = True
+    try:
+        for _ in range(max(repeat, 1)):
+            STAGE_TIMER.take()
+            startTime = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - startTime
+            stages = STAGE_TIMER.take()
+            if best is None or seconds < best[0]:
+                best = (seconds, stages)
+
+        peakMemory = None
+        memoryStages = []
+        if measureMemory:
+            tracemalloc.start()
+            try:
+                run()
+                memoryStages = STAGE_TIMER.take()
+                # the timer resets the peak for each stage, so the overall peak is the largest of them
+                peaks = [ peak for name, stageSeconds, peak in memoryStages if peak is not None ]
+                peakMemory = max(peaks + [tracemalloc.get_traced_memory()[1]])
+            finally:
+                tracemalloc.stop()
+    finally:
+        STAGE_TIMER.enabled = False
+        STAGE_TIMER.take()
+
+    seconds, stages = best
+    result = summarize_stages(stages, seconds)
+    for name, entry in summarize_stages(memoryStages, 0.0).items():
+        if name in result and name != 'total': result[name]['peakMemory'] = entry['peakMemory']
+    result['total']['peakMemory'] = peakMemory
+
+    return { 'seconds': seconds, 'peakMemory': peakMemory, 'stages': result }
+
+def run_benchmarks(args):
+    """Runs inside blender."""
+
+    import bpy
+
+    if str(SCRIPTS_DIR) not in sys.path:
+        sys.path.insert(0, str(SCRIPTS_DIR))
+
+    import io_sqee_mesh_export, io_sqee_armature_export, io_sqee_animation_export, io_brawlcrate_anim_import
+
+    for module in (io_sqee_mesh_export, io_sqee_armature_export, io_sqee_animation_export, io_brawlcrate_anim_import):
+        module.register()
+
+    workDir = Path(tempfile.mkdtemp(prefix="sqee_benchmark_"))
+    scene = Scene(bpy, workDir)
+
+    results = { 'version': RESULTS_VERSION,
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'blender': bpy.app.version_string,
+                'python': platform.python_version(),
+                'machine': "%s %s, %d cpus" % (platform.system(), platform.machine(), os.cpu_count() or 1),
+                'repeat': args.repeat,
+                'cases': {} }
+
+    try:
+        cases = build_cases(args, scene)
+        print("running %d cases" % len(cases))
+
+        print("\n{:<32} {:>9} {:>12}  {}".format("Case", "Seconds", "Peak Memory", "Stages"))
+
+        for name, setup, run in cases:
+            result = run_case(setup, run, args.repeat, not args.no_memory)
+            results['cases'][name] = result
+            stages = ", ".join ( "%s %.3f" % (stage.split(".")[-1], entry['seconds'])
+                                 for stage, entry in result['stages'].items() if stage != 'total' )
+            memory = "%.1f MiB" % (result['peakMemory'] / 2**20) if result['peakMemory'] is not None else "-"
+            print("{:<32} {:>9.4f} {:>12}  {}".format(name, result['seconds'], memory, stages), flush=True)
+
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    try:
+        import resource
+        results['maxRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+    print("\nwrote '%s'" % args.output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold)
+        print("\n%d regressions" % regressions)
+        return 1 if regressions else 0
+
+    return 0
+
+#==============================================================================#
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    try:
+        import bpy
+    except ImportError:
+        bpy = None
+
+    if bpy is not None:
+        sys.exit(run_benchmarks(args))
+
+    # not inside blender, so run this script again with it
+    blender = find_blender(args)
+    if shutil.which(blender) is None:
+        print("blender executable not found: %s" % blender)
+        sys.exit(1)
+
+    argv = sys.argv[1:]
+    command = [ blender, "-b", "--factory-startup", "--python-exit-code", "1", "--python", __file__, "--", *argv ]
+    command += [ "--output", str(args.output.resolve()) ]
+    if args.compare: command += [ "--compare", str(args.compare.resolve()) ]
+    sys.exit(subprocess.run(command).returncode)
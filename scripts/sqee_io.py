@@ -0,0 +1,1347 @@
+"""Shared code for the SQEE exporters and importers that doesn't depend on blender.
+
+This needs to be installed next to the exporter scripts, see README.md.
+"""
+
+import hashlib, json, math, os, struct, time, tracemalloc
+from collections import defaultdict
+import numpy as np
+
+#==============================================================================#
+
+CACHE_MANIFEST_NAME = ".sqee_cache.json"
+CACHE_MANIFEST_VERSION = 1
+
+class Fingerprint():
+    """Incremental hash of everything that affects the contents of an output file."""
+
+    def __init__(self, exporter, version, options):
+        self.hasher = hashlib.blake2b(digest_size=16)
+        self.add(exporter, tuple(version), sorted(options.items()))
+
+    def add(self, *values):
+        for value in values:
+            if hasattr(value, 'tobytes'):
+                self.hasher.update(repr((value.dtype.str, value.shape)).encode())
+                self.hasher.update(value.tobytes())
+            else:
+                self.hasher.update(repr(value).encode())
+        return self
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+#==============================================================================#
+
+class ExportCache():
+    """Sidecar manifest that remembers the fingerprint of each exported file.
+
+    The manifest lives in the same directory as the files it describes. An entry
+    is only trusted if its file still exists with the same size and modification
+    time as when it was written, anything else gets evicted when saving.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, CACHE_MANIFEST_NAME)
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == CACHE_MANIFEST_VERSION:
+                self.entries = manifest['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @classmethod
+    def for_file(cls, filepath):
+        return cls(os.path.dirname(os.path.abspath(filepath)))
+
+    @staticmethod
+    def file_state(filepath):
+        try: stat = os.stat(filepath)
+        except OSError: return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_current(self, filepath, fingerprint):
+        entry = self.entries.get(os.path.basename(filepath))
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        return entry['state'] == self.file_state(filepath)
+
+    def store(self, filepath, fingerprint):
+        state = self.file_state(filepath)
+        if state is not None:
+            self.entries[os.path.basename(filepath)] = { 'fingerprint': fingerprint, 'state': state }
+
+    def evict_stale(self):
+        directory = os.path.dirname(self.path)
+        for name, entry in list(self.entries.items()):
+            if entry['state'] != self.file_state(os.path.join(directory, name)):
+                del self.entries[name]
+
+    def save(self):
+        self.evict_stale()
+        manifest = { 'version': CACHE_MANIFEST_VERSION, 'entries': self.entries }
+        # write to a temporary file first so that a crash can't leave a broken manifest
+        tempPath = self.path + ".tmp%d" % os.getpid()
+        with open(tempPath, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tempPath, self.path)
+
+#==============================================================================#
+
+class StageTimer():
+    """Time and memory used by each stage of an export, for the benchmarks.
+
+    Exporters call lap() at the start of each stage, which also ends the one
+    before it. Nothing is recorded unless enabled is set. If tracemalloc is
+    tracing, the peak traced memory during each stage is recorded as well, or
+    the peak so far with python versions older than 3.9.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = []
+        self.current = None
+
+    def lap(self, name):
+        if not self.enabled: return
+        self.end()
+        if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.current = (name, time.perf_counter())
+
+    def end(self):
+        """End the current stage, if there is one."""
+        if self.current is None: return
+        name, startTime = self.current
+        seconds = time.perf_counter() - startTime
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        self.stages.append((name, seconds, peak))
+        self.current = None
+
+    def take(self):
+        """End the current stage, then return and forget every (name, seconds, peak) recorded."""
+        self.end()
+        stages, self.stages = self.stages, []
+        return stages
+
+STAGE_TIMER = StageTimer()
+
+#==============================================================================#
+
+# bone order for each armature, by pointer, with the bone names and parents it was worked out from
+BONE_ORDER_CACHE = {}
+
+def bone_order(armature):
+    """Names of the bones of an armature, parents first and then by name.
+
+    This is the order used by every SQEE file. It's worked out once for each
+    armature, and only again if bones are renamed, added or reparented.
+    """
+
+    signature = tuple((bone.name, bone.parent.name if bone.parent else None) for bone in armature.bones)
+
+    cached = BONE_ORDER_CACHE.get(armature.as_pointer())
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    parents = dict(signature)
+    depths = {}
+    def depth(name):
+        if name not in depths:
+            depths[name] = 0 if parents[name] is None else depth(parents[name]) + 1
+        return depths[name]
+
+    order = tuple(sorted(parents, key = lambda name: (depth(name), name)))
+    BONE_ORDER_CACHE[armature.as_pointer()] = (signature, order)
+
+    return order
+
+def ordered_bones(bones, armature, hidden=False):
+    """Items of a bone collection, such as armature.bones or pose.bones, in bone_order.
+
+    Bones whose names start with '.' are left out unless hidden is True.
+    """
+    return [ bones[name] for name in bone_order(armature) if hidden or name[0] != '.' ]
+
+#==============================================================================#
+
+def tidy_value(precision, value):
+    result = ("%%.%df" % precision % value).rstrip("0")
+    if result.endswith("."): result += "0"
+    if result == "-0.0": result = "0.0"
+    return result
+
+def tidy_values(precision, *values):
+    return tuple(tidy_value(precision, val) for val in values)
+
+def tidy_rows(precision, values):
+    """Format a 2D array the same as tidy_values, returns a space separated string for each row.
+
+    Everything is formatted with a single string format, then the characters
+    that tidy_value would strip are found with numpy instead of string methods.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    rows, columns = values.shape
+    if rows == 0: return []
+    if columns == 0: return [""] * rows
+
+    # every value is followed by a space, so it's easy to find where each one ends
+    rowFormat = "%%.%df " % precision * columns
+    text = "\n".join([rowFormat] * rows) % tuple(values.ravel().tolist()) + "\n"
+
+    chars = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    keep = np.ones(len(chars), dtype=bool)
+    ends = np.flatnonzero(chars == ord(" "))
+
+    # strip trailing zeros, but always leave one decimal place
+    zeros = np.ones(len(ends), dtype=bool)
+    for count in range(1, precision + 1):
+        zeros &= chars[ends - count] == ord("0")
+        if count < precision: keep[(ends - count)[zeros]] = False
+
+    # values that were "-0.000..." lose their minus sign
+    starts = ends - precision - 3
+    negative = zeros & (starts >= 0)
+    negative[negative] &= chars[starts[negative]] == ord("-")
+    negative[negative] &= chars[starts[negative] + 1] == ord("0")
+    negative[negative] &= (starts[negative] == 0) | (chars[starts[negative] - 1] <= ord(" "))
+    keep[starts[negative]] = False
+
+    # and the space at the end of each row
+    keep[ends[chars[ends + 1] == ord("\n")]] = False
+
+    return chars[keep].tobytes().decode('ascii').split("\n")[:-1]
+
+#==============================================================================#
+
+# same values as blender's keyframe interpolation enum
+INTERPOLATION_CONSTANT = 0
+INTERPOLATION_LINEAR = 1
+INTERPOLATION_BEZIER = 2
+
+class FCurveKeys():
+    """Keyframes of an F-Curve as flat arrays, enough to evaluate it without blender.
+
+    Only constant, linear and bezier interpolation are supported, anything else
+    needs to be sampled by blender instead.
+    """
+
+    def __init__(self, co, handleLeft, handleRight, interpolation, extrapolation):
+        self.co = np.asarray(co, dtype=np.float64).reshape(-1, 2)
+        self.handleLeft = np.asarray(handleLeft, dtype=np.float64).reshape(-1, 2)
+        self.handleRight = np.asarray(handleRight, dtype=np.float64).reshape(-1, 2)
+        self.interpolation = np.asarray(interpolation, dtype=np.int32)
+        self.extrapolation = extrapolation
+
+def correct_bezier_handles(p0, p1, p2, p3):
+    """Shorten handles that overlap in time, like BKE_fcurve_correct_bezpart."""
+    len1 = np.abs(p0[:, 0] - p1[:, 0])
+    len2 = np.abs(p3[:, 0] - p2[:, 0])
+    total = len1 + len2
+    fac = np.where(total > p3[:, 0] - p0[:, 0], (p3[:, 0] - p0[:, 0]) / np.where(total > 0.0, total, 1.0), 1.0)
+    return p0 - (p0 - p1) * fac[:, None], p3 - (p3 - p2) * fac[:, None]
+
+def evaluate_fcurve(keys, frames):
+    """Evaluate an F-Curve at every frame in an array at once."""
+
+    frames = np.asarray(frames, dtype=np.float64)
+    co = keys.co
+
+    if len(co) == 0: return np.zeros(len(frames))
+    if len(co) == 1: return np.full(len(frames), co[0, 1])
+
+    # index of the key at or before each frame, clamped to the valid segments
+    segment = np.clip(np.searchsorted(co[:, 0], frames, side='right') - 1, 0, len(co) - 2)
+    k0, k1 = co[segment], co[segment + 1]
+    interpolation = keys.interpolation[segment]
+
+    span = np.where(k1[:, 0] > k0[:, 0], k1[:, 0] - k0[:, 0], 1.0)
+    factor = np.clip((frames - k0[:, 0]) / span, 0.0, 1.0)
+
+    result = np.where(interpolation == INTERPOLATION_CONSTANT, k0[:, 1], k0[:, 1] + (k1[:, 1] - k0[:, 1]) * factor)
+
+    bezier = interpolation == INTERPOLATION_BEZIER
+    if np.any(bezier):
+        p0, p3 = k0[bezier], k1[bezier]
+        p1, p2 = correct_bezier_handles(p0, keys.handleRight[segment[bezier]], keys.handleLeft[segment[bezier] + 1], p3)
+        x = frames[bezier]
+        # x(t) is monotonic once the handles are corrected, so bisection always works
+        lower, upper = np.zeros(len(x)), np.ones(len(x))
+        for iteration in range(40):
+            t = (lower + upper) * 0.5
+            s = 1.0 - t
+            xt = s*s*s*p0[:, 0] + 3.0*s*s*t*p1[:, 0] + 3.0*s*t*t*p2[:, 0] + t*t*t*p3[:, 0]
+            below = xt < x
+            lower = np.where(below, t, lower)
+            upper = np.where(below, upper, t)
+        t = (lower + upper) * 0.5
+        s = 1.0 - t
+        result[bezier] = s*s*s*p0[:, 1] + 3.0*s*s*t*p1[:, 1] + 3.0*s*t*t*p2[:, 1] + t*t*t*p3[:, 1]
+
+    # handle frames outside of the keyframe range, segments are clamped so the last key needs doing here too
+    before, after = frames < co[0, 0], frames >= co[-1, 0]
+    result[before], result[after] = co[0, 1], co[-1, 1]
+
+    if keys.extrapolation == 'LINEAR':
+        slopes = []
+        for key, handle, neighbour, interp in ((0, keys.handleLeft[0], co[1], keys.interpolation[0]),
+                                              (-1, keys.handleRight[-1], co[-2], keys.interpolation[-1])):
+            if interp == INTERPOLATION_CONSTANT: slopes.append(0.0)
+            elif interp == INTERPOLATION_BEZIER:
+                dx = co[key, 0] - handle[0]
+                slopes.append((co[key, 1] - handle[1]) / dx if dx != 0.0 else 0.0)
+            else:
+                dx = co[key, 0] - neighbour[0]
+                slopes.append((co[key, 1] - neighbour[1]) / dx if dx != 0.0 else 0.0)
+        result[before] += (frames[before] - co[0, 0]) * slopes[0]
+        result[after] += (frames[after] - co[-1, 0]) * slopes[1]
+
+    return result
+
+#==============================================================================#
+
+def quaternions_to_matrices(quats):
+    """Convert (w, x, y, z) quaternions to 3x3 rotation matrices, normalizing them first."""
+    q = quats / np.linalg.norm(quats, axis=-1, keepdims=True)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    return np.stack ((
+        np.stack((1.0 - 2.0*(y*y + z*z), 2.0*(x*y - w*z), 2.0*(x*z + w*y)), axis=-1),
+        np.stack((2.0*(x*y + w*z), 1.0 - 2.0*(x*x + z*z), 2.0*(y*z - w*x)), axis=-1),
+        np.stack((2.0*(x*z - w*y), 2.0*(y*z + w*x), 1.0 - 2.0*(x*x + y*y)), axis=-1),
+    ), axis=-2)
+
+def eulers_to_matrices(angles, order):
+    """Convert euler angles to 3x3 rotation matrices, applying axes in the given order."""
+    result = np.broadcast_to(np.eye(3), angles.shape[:-1] + (3, 3)).copy()
+    for axis in order:
+        index = 'XYZ'.index(axis)
+        c, s = np.cos(angles[..., index]), np.sin(angles[..., index])
+        rotation = np.zeros(angles.shape[:-1] + (3, 3))
+        i, j = (index + 1) % 3, (index + 2) % 3
+        rotation[..., index, index] = 1.0
+        rotation[..., i, i], rotation[..., j, j] = c, c
+        rotation[..., j, i], rotation[..., i, j] = s, -s
+        result = rotation @ result
+    return result
+
+def matrices_to_quaternions(matrices):
+    """Rotation part of 4x4 or 3x3 matrices as (w, x, y, z) quaternions.
+
+    This is the same algorithm as blender's mat3_normalized_to_quat, including
+    its choice of branches, so the signs of the results match to_quaternion().
+    """
+    m = matrices[..., :3, :3]
+    m = m / np.linalg.norm(m, axis=-2, keepdims=True)
+
+    m00, m11, m22 = m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]
+    trace = 0.25 * (1.0 + m00 + m11 + m22)
+
+    # blender's matrices are column major, so these use [row, column] swapped from the C code
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        s = np.sqrt(np.maximum(trace, 0.0))
+        inv = 1.0 / (4.0 * s)
+        branch0 = np.stack((s, (m[..., 2, 1] - m[..., 1, 2]) * inv,
+                               (m[..., 0, 2] - m[..., 2, 0]) * inv, (m[..., 1, 0] - m[..., 0, 1]) * inv), axis=-1)
+
+        s = 2.0 * np.sqrt(np.maximum(1.0 + m00 - m11 - m22, 0.0))
+        branch1 = np.stack(((m[..., 2, 1] - m[..., 1, 2]) / s, 0.25 * s,
+                            (m[..., 0, 1] + m[..., 1, 0]) / s, (m[..., 0, 2] + m[..., 2, 0]) / s), axis=-1)
+
+        s = 2.0 * np.sqrt(np.maximum(1.0 + m11 - m00 - m22, 0.0))
+        branch2 = np.stack(((m[..., 0, 2] - m[..., 2, 0]) / s, (m[..., 0, 1] + m[..., 1, 0]) / s,
+                            0.25 * s, (m[..., 1, 2] + m[..., 2, 1]) / s), axis=-1)
+
+        s = 2.0 * np.sqrt(np.maximum(1.0 + m22 - m00 - m11, 0.0))
+        branch3 = np.stack(((m[..., 1, 0] - m[..., 0, 1]) / s, (m[..., 0, 2] + m[..., 2, 0]) / s,
+                            (m[..., 1, 2] + m[..., 2, 1]) / s, 0.25 * s), axis=-1)
+
+    useTrace = (trace > 1e-4)[..., None]
+    use1 = ((m00 > m11) & (m00 > m22))[..., None]
+    use2 = (m11 > m22)[..., None]
+
+    q = np.where(useTrace, branch0, np.where(use1, branch1, np.where(use2, branch2, branch3)))
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+def decompose_matrices(matrices, allowNegativeScale=False):
+    """Split 4x4 matrices into translation, (w, x, y, z) rotation and scale.
+
+    By default this matches to_translation(), to_quaternion() and to_scale(), so
+    scales are never negative. With allowNegativeScale, a negative determinant
+    is moved into the scale like blender's decompose(), for keying pose bones.
+    """
+    translation = matrices[..., :3, 3]
+    rotation = matrices[..., :3, :3]
+    scale = np.linalg.norm(rotation, axis=-2)
+    negative = np.linalg.det(rotation) < 0.0
+    if allowNegativeScale and np.any(negative):
+        rotation = np.where(negative[..., None, None], -rotation, rotation)
+        scale = np.where(negative[..., None], -scale, scale)
+    return translation, matrices_to_quaternions(rotation), scale
+
+def make_quaternions_continuous(quats, axis=0):
+    """Flip the signs of quaternions along an axis so that neighbours are never more than 180 degrees apart."""
+    quats = np.moveaxis(quats, axis, 0)
+    dots = np.sum(quats[1:] * quats[:-1], axis=-1, keepdims=True)
+    signs = np.cumprod(np.where(dots < 0.0, -1.0, 1.0), axis=0)
+    result = np.concatenate((quats[:1], quats[1:] * signs), axis=0)
+    return np.moveaxis(result, 0, axis)
+
+#==============================================================================#
+
+class PoseBoneData():
+    """Everything needed to compute the pose of one bone without blender.
+
+    Each component of a channel is an FCurveKeys, an array of sampled values
+    for each frame, or a constant for components that have no F-Curve.
+    """
+
+    def __init__(self, name, parent, restMatrix, rotationMode, location, rotation, scale):
+        self.name = name
+        self.parent = parent
+        self.restMatrix = np.asarray(restMatrix, dtype=np.float64)
+        self.rotationMode = rotationMode
+        self.location = location
+        self.rotation = rotation
+        self.scale = scale
+
+def channel_array(values, frames):
+    """Stack a list of per-component curves, samples or constants into a (frames, n) array.
+
+    Samples must have a value for every frame of the action, and are indexed by frames.
+    """
+    frames = np.asarray(frames)
+    columns = []
+    for v in values:
+        if isinstance(v, FCurveKeys): columns.append(evaluate_fcurve(v, frames))
+        elif np.ndim(v) == 0: columns.append(np.full(len(frames), v, dtype=np.float64))
+        else: columns.append(np.asarray(v, dtype=np.float64)[frames.astype(np.int64)])
+    return np.column_stack(columns)
+
+def sample_local_matrices(bones, frames):
+    """Compute the transform of each bone relative to its parent for each of some frames.
+
+    Bones must be ordered so that parents come before their children, and bone
+    parents are given as indices into the same list. This matches blender's pose
+    evaluation for bones that inherit rotation and scale normally, and have no
+    constraints. Bones whose parent is hidden, or who have no parent, get their
+    armature space matrices instead, like the frame_set path in the exporter.
+    """
+
+    frameCount = len(frames)
+    poseMatrices = [None] * len(bones)
+    localMatrices = {}
+
+    for index, bone in enumerate(bones):
+
+        basis = np.zeros((frameCount, 4, 4))
+        basis[:, 3, 3] = 1.0
+
+        if bone.rotationMode == 'QUATERNION':
+            rotation = quaternions_to_matrices(channel_array(bone.rotation, frames))
+        else:
+            rotation = eulers_to_matrices(channel_array(bone.rotation, frames), bone.rotationMode)
+
+        basis[:, :3, :3] = rotation * channel_array(bone.scale, frames)[:, None, :]
+        basis[:, :3, 3] = channel_array(bone.location, frames)
+
+        if bone.parent >= 0:
+            parent = bones[bone.parent]
+            offset = np.linalg.inv(parent.restMatrix) @ bone.restMatrix
+            local = offset @ basis
+            poseMatrices[index] = poseMatrices[bone.parent] @ local
+            if parent.name[0] != '.':
+                localMatrices[bone.name] = local
+        else:
+            poseMatrices[index] = bone.restMatrix @ basis
+
+        if bone.name not in localMatrices:
+            localMatrices[bone.name] = poseMatrices[index]
+
+    return localMatrices
+
+#==============================================================================#
+
+def track_errors(approx, values, rotation):
+    """Error of each approximated frame, angle in radians for (x, y, z, w) quaternions."""
+    if rotation:
+        approx = approx / np.linalg.norm(approx, axis=-1, keepdims=True)
+        dots = np.abs(np.sum(approx * values, axis=-1)) / np.linalg.norm(values, axis=-1)
+        return 2.0 * np.arccos(np.minimum(dots, 1.0))
+    return np.linalg.norm(approx - values, axis=-1)
+
+def rebuild_track(frames, keyValues, frameCount):
+    """Linearly interpolate keyed values at every frame, like the engine does."""
+    return np.column_stack([ np.interp(np.arange(frameCount), frames, keyValues[:, i])
+                             for i in range(keyValues.shape[1]) ])
+
+def reduce_keyframes(values, tolerance, rotation=False):
+    """Choose which frames to keep so that interpolation rebuilds a track within tolerance.
+
+    Uses recursive subdivision, starting with just the first and last frames and
+    adding the worst frame of any span that is out of tolerance. Quaternions are
+    interpolated with nlerp and judged by angle. Returns the kept frame indices
+    and the maximum error over the whole track.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    frameCount = len(values)
+
+    keep = { 0, frameCount - 1 }
+    spans = [ (0, frameCount - 1) ]
+
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2: continue
+        factors = (np.arange(first + 1, last) - first) / (last - first)
+        approx = values[first] + (values[last] - values[first]) * factors[:, None]
+        errors = track_errors(approx, values[first+1:last], rotation)
+        worst = int(np.argmax(errors))
+        if errors[worst] > tolerance:
+            split = first + 1 + worst
+            keep.add(split)
+            spans.append((first, split))
+            spans.append((split, last))
+
+    frames = np.array(sorted(keep))
+    rebuilt = rebuild_track(frames, values[frames], frameCount)
+    maxError = float(np.max(track_errors(rebuilt, values, rotation)))
+
+    return frames, maxError
+
+#==============================================================================#
+
+# layout of binary animation files, all values are little endian
+#
+#   header        32 bytes, see SQA_HEADER
+#   blocks        24 bytes each, see SQA_BLOCK
+#   block data    each block starts on a 16 byte boundary
+#
+#   TRAK   one entry for each track, see SQA_TRACK
+#   CMSK   uint32 bitmask of tracks with a bit set for each animated track
+#   NAME   32 byte utf-8 property name for each extra track, in track order
+#   FRAM   frameCount frames of frameStride bytes, each frame holds the uint16
+#          values of every animated track, starting at the track's offset
+#
+# constant tracks store their value as float32 in the minimum field of their
+# track entry. animated offsets, scales and extras are range normalized, so the
+# value is minimum + extent * (x / 65535). rotations are stored as the smallest
+# three components of the quaternion, see encode_smallest_three.
+#
+# chunked files use SQA_CHUNKED_MAGIC and split the frames into chunks of
+# chunkFrames frames (the last may be shorter), which can be decoded on their
+# own. instead of FRAM they have these blocks:
+#
+#   CIDX   uint64 file offset of each chunk
+#   CHNK   all of the chunks, each starting on a 16 byte boundary
+#
+# each chunk starts with an SQA_CHUNK_RANGE for every animated track, which
+# replace the minimum and extent in the track entries, followed by its frames
+# laid out the same as FRAM. the header's chunkFrames is zero for other files.
+
+SQA_MAGIC = b"SQAB"
+SQA_CHUNKED_MAGIC = b"SQAC"
+SQA_VERSION = 1
+
+SQA_HEADER = struct.Struct("<4sHHIIIIII")
+SQA_BLOCK = struct.Struct("<4sIQQ")
+
+SQA_CHUNK_RANGE = np.dtype([('minimum', '<f4', 4), ('extent', '<f4', 4)])
+
+SQA_TRACK = np.dtype ([
+    ('boneIndex', '<u2'), ('channel', '<u1'), ('padding', '<u1'), ('offset', '<u4'),
+    ('minimum', '<f4', 4), ('extent', '<f4', 4),
+])
+
+SQA_CHANNELS = { 'offset': 0, 'rotation': 1, 'scale': 2, 'extra': 3 }
+
+# number of values for each channel, and number of uint16s they get encoded to
+SQA_CHANNEL_WIDTHS = { 'offset': (3, 3), 'rotation': (4, 3), 'scale': (3, 3), 'extra': (4, 4) }
+
+SMALLEST_THREE_LIMIT = 2.0 ** -0.5
+
+class AnimTrack():
+    """One channel of one bone, values has a row for each frame, or just one row if constant."""
+
+    def __init__(self, boneIndex, channel, values, name=""):
+        self.boneIndex = boneIndex
+        self.channel = channel
+        self.values = np.asarray(values, dtype=np.float64).reshape(-1, SQA_CHANNEL_WIDTHS[channel][0])
+        self.name = name
+
+    @property
+    def constant(self):
+        return len(self.values) == 1
+
+def encode_smallest_three(quats):
+    """Pack (x, y, z, w) quaternions into three uint16s each.
+
+    The largest component is dropped, the other three are stored in the low
+    15 bits of each value. The top bits of the first two values give the index
+    of the dropped component, and the top bit of the last is set if it was
+    negative, so that the quaternions decode with the same sign.
+    """
+
+    quats = quats / np.linalg.norm(quats, axis=1, keepdims=True)
+    largest = np.argmax(np.abs(quats), axis=1)
+    negative = quats[np.arange(len(quats)), largest] < 0.0
+
+    others = np.array([[i for i in range(4) if i != index] for index in range(4)])[largest]
+    small = np.take_along_axis(quats, others, axis=1)
+
+    scaled = (np.clip(small / SMALLEST_THREE_LIMIT, -1.0, 1.0) + 1.0) * 0.5
+    result = np.round(scaled * 32767.0).astype(np.uint16)
+
+    result[:, 0] |= ((largest & 1) << 15).astype(np.uint16)
+    result[:, 1] |= ((largest >> 1) << 15).astype(np.uint16)
+    result[:, 2] |= (negative.astype(np.uint16) << 15)
+
+    return result
+
+def decode_smallest_three(packed):
+    """Reference decoder for encode_smallest_three."""
+
+    packed = packed.astype(np.uint32)
+    largest = (packed[:, 0] >> 15) | ((packed[:, 1] >> 15) << 1)
+    negative = (packed[:, 2] >> 15) != 0
+
+    small = ((packed & 0x7fff) / 32767.0 * 2.0 - 1.0) * SMALLEST_THREE_LIMIT
+    dropped = np.sqrt(np.maximum(1.0 - np.sum(small * small, axis=1), 0.0))
+
+    quats = np.zeros((len(packed), 4))
+    others = np.array([[i for i in range(4) if i != index] for index in range(4)])[largest]
+    np.put_along_axis(quats, others, small, axis=1)
+    quats[np.arange(len(packed)), largest] = np.where(negative, -dropped, dropped)
+
+    return quats
+
+def encode_range(values):
+    """Range normalize values to uint16, returns (minimum, extent, encoded)."""
+    minimum, maximum = values.min(axis=0), values.max(axis=0)
+    # use the rounded float32 range, so that decoding matches the stored values
+    minimum, extent = minimum.astype(np.float32), (maximum - minimum).astype(np.float32)
+    scaled = (values - minimum) / np.where(extent > 0.0, extent, 1.0)
+    return minimum, extent, np.round(np.clip(scaled, 0.0, 1.0) * 65535.0).astype(np.uint16)
+
+def decode_range(minimum, extent, encoded):
+    """Reference decoder for encode_range."""
+    return minimum + extent.astype(np.float64) * (encoded / 65535.0)
+
+def align_offset(offset, alignment=16):
+    return (offset + alignment - 1) // alignment * alignment
+
+def layout_blocks(blocks, headerSize=SQA_HEADER.size):
+    """Work out where each of a list of (tag, size) blocks goes, returns (blockTable, offsets)."""
+    blockTable, offsets = bytearray(), []
+    offset = headerSize + SQA_BLOCK.size * len(blocks)
+    for tag, size in blocks:
+        offset = align_offset(offset)
+        blockTable += SQA_BLOCK.pack(tag, 0, offset, size)
+        offsets.append(offset)
+        offset += size
+    return bytes(blockTable), offsets
+
+def read_blocks(data):
+    """Parse the header and block table of a binary animation, returns (header, blocks).
+
+    Blocks are memoryview slices of data, so nothing is copied or read until
+    it's used. A memory mapped file can't be closed while they're still alive.
+    """
+
+    header = SQA_HEADER.unpack_from(data, 0)
+    magic, version, headerSize = header[:3]
+
+    assert magic in (SQA_MAGIC, SQA_CHUNKED_MAGIC), "not a binary animation"
+    assert version == SQA_VERSION, "unsupported version %d" % version
+
+    view = memoryview(data)
+    blocks = {}
+    for index in range(header[7]):
+        tag, padding, offset, size = SQA_BLOCK.unpack_from(data, headerSize + index * SQA_BLOCK.size)
+        blocks[tag] = view[offset : offset + size]
+
+    return header, blocks
+
+#==============================================================================#
+
+def encode_track_table(tracks, constant=None):
+    """Build the TRAK, CMSK and NAME blocks, returns (blocks, animated, frameStride).
+
+    Constant tracks get their first value stored in the table. By default tracks
+    with only one value are constant, otherwise it's given for each track.
+    """
+
+    if constant is None:
+        constant = [ track.constant for track in tracks ]
+
+    trackTable = np.zeros(len(tracks), dtype=SQA_TRACK)
+    animatedMask = np.zeros((len(tracks) + 31) // 32, dtype='<u4')
+    animated, names = [], []
+    frameStride = 0
+
+    for index, track in enumerate(tracks):
+
+        entry = trackTable[index]
+        entry['boneIndex'] = track.boneIndex
+        entry['channel'] = SQA_CHANNELS[track.channel]
+
+        if track.channel == 'extra':
+            encoded = track.name.encode('utf-8')
+            assert len(encoded) <= 32, "property name '%s' is too long" % track.name
+            names.append(encoded)
+
+        if constant[index]:
+            entry['minimum'][:track.values.shape[1]] = track.values[0]
+            continue
+
+        animatedMask[index // 32] |= 1 << (index % 32)
+        entry['offset'] = frameStride
+        animated.append(index)
+        frameStride += SQA_CHANNEL_WIDTHS[track.channel][1] * 2
+
+    blocks = [(b"TRAK", trackTable.tobytes()), (b"CMSK", animatedMask.tobytes())]
+    if names:
+        blocks.append((b"NAME", np.array(names, dtype='S32').tobytes()))
+
+    return blocks, animated, frameStride
+
+def decode_track_table(blocks):
+    """Returns (trackTable, channel and name of each track, index of each animated track)."""
+
+    trackTable = np.frombuffer(blocks[b"TRAK"], dtype=SQA_TRACK)
+    animatedMask = np.frombuffer(blocks[b"CMSK"], dtype='<u4')
+    names = iter(np.frombuffer(blocks.get(b"NAME", b""), dtype='S32'))
+
+    channelNames = { value: key for key, value in SQA_CHANNELS.items() }
+    channels = [ channelNames[int(entry['channel'])] for entry in trackTable ]
+    names = [ next(names).decode('utf-8') if channel == 'extra' else "" for channel in channels ]
+    animated = [ index for index in range(len(trackTable)) if animatedMask[index // 32] & (1 << (index % 32)) ]
+
+    return trackTable, channels, names, animated
+
+def encode_frames(valuesList, channels):
+    """Encode the values of animated tracks frame by frame, returns (ranges, frameData)."""
+
+    ranges = np.zeros(len(valuesList), dtype=SQA_CHUNK_RANGE)
+    columns = []
+
+    for index, (values, channel) in enumerate(zip(valuesList, channels)):
+        if channel == 'rotation':
+            columns.append(encode_smallest_three(values))
+        else:
+            width = values.shape[1]
+            minimum, extent, encoded = encode_range(values)
+            ranges[index]['minimum'][:width], ranges[index]['extent'][:width] = minimum, extent
+            columns.append(encoded)
+
+    frameCount = len(valuesList[0]) if valuesList else 0
+    if columns: frameData = np.column_stack(columns).astype('<u2')
+    else: frameData = np.zeros((frameCount, 0), dtype='<u2')
+
+    return ranges, frameData
+
+def decode_frames(ranges, frameData, channels):
+    """Reference decoder for encode_frames, returns a list of values."""
+
+    result, column = [], 0
+    for index, channel in enumerate(channels):
+        width, encodedWidth = SQA_CHANNEL_WIDTHS[channel]
+        encoded = frameData[:, column : column + encodedWidth]
+        if channel == 'rotation':
+            result.append(decode_smallest_three(encoded))
+        else:
+            result.append(decode_range(ranges[index]['minimum'][:width], ranges[index]['extent'][:width], encoded))
+        column += encodedWidth
+    return result
+
+#==============================================================================#
+
+def encode_animation(boneCount, frameCount, tracks):
+    """Build a binary animation file from a list of AnimTracks."""
+
+    blocks, animated, frameStride = encode_track_table(tracks)
+
+    for index in animated:
+        assert len(tracks[index].values) == frameCount, "animated tracks need a value for every frame"
+
+    ranges, frameData = encode_frames([tracks[i].values for i in animated], [tracks[i].channel for i in animated])
+
+    # whole file animations keep their ranges in the track table
+    trackTable = np.frombuffer(blocks[0][1], dtype=SQA_TRACK).copy()
+    trackTable['minimum'][animated], trackTable['extent'][animated] = ranges['minimum'], ranges['extent']
+    blocks[0] = (b"TRAK", trackTable.tobytes())
+
+    blocks.append((b"FRAM", frameData.tobytes()))
+
+    blockTable, offsets = layout_blocks([(tag, len(data)) for tag, data in blocks])
+    header = SQA_HEADER.pack ( SQA_MAGIC, SQA_VERSION, SQA_HEADER.size, boneCount,
+                               frameCount, len(tracks), frameStride, len(blocks), 0 )
+
+    result = bytearray(header + blockTable)
+    for (tag, data), offset in zip(blocks, offsets):
+        result += bytes(offset - len(result))
+        result += data
+
+    return bytes(result)
+
+def decode_animation(data):
+    """Reference decoder for encode_animation, returns (boneCount, frameCount, tracks)."""
+
+    header, blocks = read_blocks(data)
+    magic, version, headerSize, boneCount, frameCount, trackCount, frameStride, blockCount, chunkFrames = header
+    assert magic == SQA_MAGIC, "use decode_animation_chunk for chunked files"
+
+    trackTable, channels, names, animated = decode_track_table(blocks)
+    frameData = np.frombuffer(blocks[b"FRAM"], dtype='<u2').reshape(frameCount, frameStride // 2)
+
+    ranges = np.zeros(len(animated), dtype=SQA_CHUNK_RANGE)
+    ranges['minimum'], ranges['extent'] = trackTable['minimum'][animated], trackTable['extent'][animated]
+    decoded = dict(zip(animated, decode_frames(ranges, frameData, [channels[i] for i in animated])))
+
+    tracks = []
+    for index, entry in enumerate(trackTable):
+        width = SQA_CHANNEL_WIDTHS[channels[index]][0]
+        values = decoded[index] if index in decoded else entry['minimum'][:width].astype(np.float64)
+        tracks.append(AnimTrack(int(entry['boneIndex']), channels[index], values, names[index]))
+
+    return boneCount, frameCount, tracks
+
+def decode_animation_chunk(data, chunkIndex):
+    """Reference decoder for one chunk of a chunked file, returns (firstFrame, tracks).
+
+    Only reads the header, the track table and the chunk itself, so it works on a
+    memory mapped file without touching the other chunks.
+    """
+
+    header, blocks = read_blocks(data)
+    magic, version, headerSize, boneCount, frameCount, trackCount, frameStride, blockCount, chunkFrames = header
+    assert magic == SQA_CHUNKED_MAGIC, "use decode_animation for files that are not chunked"
+
+    trackTable, channels, names, animated = decode_track_table(blocks)
+    chunkOffsets = np.frombuffer(blocks[b"CIDX"], dtype='<u8')
+
+    firstFrame = chunkIndex * chunkFrames
+    chunkFrameCount = min(chunkFrames, frameCount - firstFrame)
+
+    offset = int(chunkOffsets[chunkIndex])
+    ranges = np.frombuffer(data, dtype=SQA_CHUNK_RANGE, count=len(animated), offset=offset)
+    offset += ranges.nbytes
+    frameData = np.frombuffer(data, dtype='<u2', count=chunkFrameCount * frameStride // 2, offset=offset)
+    frameData = frameData.reshape(chunkFrameCount, frameStride // 2)
+
+    decoded = dict(zip(animated, decode_frames(ranges, frameData, [channels[i] for i in animated])))
+
+    tracks = []
+    for index, entry in enumerate(trackTable):
+        width = SQA_CHANNEL_WIDTHS[channels[index]][0]
+        values = decoded[index] if index in decoded else entry['minimum'][:width].astype(np.float64)
+        tracks.append(AnimTrack(int(entry['boneIndex']), channels[index], values, names[index]))
+
+    return firstFrame, tracks
+
+#==============================================================================#
+
+# layout of binary skeleton files, all values are little endian
+#
+#   header        16 bytes, see SQS_HEADER
+#   blocks        24 bytes each, the same as SQA_BLOCK
+#   block data    each block starts on a 16 byte boundary
+#
+#   BONE   one entry for each bone, see SQS_BONE, parents come before children
+#   BIND   float32 4x4 armature space rest matrix of each bone, column major
+#   IBND   float32 4x4 inverse of each BIND matrix, column major
+#   HASH   int32 bone index for each slot of an open addressing hash table, -1
+#          for empty slots. the table size is a power of two, and a name starts
+#          at slot (nameHash & (size - 1)), moving to the next slot until its
+#          nameHash matches or an empty slot is found
+#   NAME   32 byte utf-8 name for each bone
+#
+# rotations are (x, y, z, w) quaternions, and name hashes are 32 bit FNV-1a of
+# the utf-8 name. transforms use the same axes as the json files.
+
+SQS_MAGIC = b"SQSB"
+SQS_VERSION = 1
+
+SQS_HEADER = struct.Struct("<4sHHII")
+
+SQS_BONE = np.dtype ([
+    ('parent', '<i4'), ('nameHash', '<u4'),
+    ('offset', '<f4', 3), ('rotation', '<f4', 4), ('scale', '<f4', 3),
+])
+
+SQS_NAME_SIZE = 32
+
+def fnv1a_hash(name):
+    result = 0x811c9dc5
+    for byte in name.encode('utf-8'):
+        result = ((result ^ byte) * 0x01000193) & 0xffffffff
+    return result
+
+def read_armature_json(filepath):
+    """Read an armature written by the SQEE armature exporter.
+
+    Returns the list of bones as dicts, with 'parentIndex' added to each one,
+    or -1 for bones without a parent. Parents always come before children.
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        bones = json.load(f)
+    boneIndices = { bone['name']: index for index, bone in enumerate(bones) }
+    for bone in bones:
+        bone['parentIndex'] = boneIndices[bone['parent']] if bone['parent'] is not None else -1
+        assert bone['parentIndex'] < boneIndices[bone['name']], "parent of '%s' comes after it" % bone['name']
+    return bones
+
+def armature_rest_matrices(bones):
+    """Armature space rest matrices of bones read with read_armature_json, in the axes of the file."""
+    local = np.zeros((len(bones), 4, 4))
+    local[:, 3, 3] = 1.0
+    rotations = np.array([bone['rotation'] for bone in bones], dtype=np.float64).reshape(-1, 4)
+    local[:, :3, :3] = quaternions_to_matrices(rotations[:, [3, 0, 1, 2]])
+    local[:, :3, :3] *= np.array([bone['scale'] for bone in bones], dtype=np.float64).reshape(-1, 1, 3)
+    local[:, :3, 3] = np.array([bone['offset'] for bone in bones], dtype=np.float64).reshape(-1, 3)
+    result = local.copy()
+    for index, bone in enumerate(bones):
+        if bone['parentIndex'] >= 0:
+            result[index] = result[bone['parentIndex']] @ local[index]
+    return result
+
+def write_armature_json(filepath, bones, precision):
+    """Write bones as the compact json the engine reads.
+
+    Each bone is a dict of name, parent, offset, rotation and scale. This is
+    the same text as json.dumps with indent=2, but with every list on one line.
+    """
+
+    def tidy_list(values):
+        rounded = ( round(val, precision) for val in values )
+        return "[ %s ]" % ", ".join(json.dumps(0.0 if val == -0.0 else val) for val in rounded)
+
+    entries = []
+    for bone in bones:
+        entries.append ( '  {\n    "name": %s,\n    "parent": %s,\n    "offset": %s,\n'
+                         '    "rotation": %s,\n    "scale": %s\n  }' %
+                         ( json.dumps(bone['name']), json.dumps(bone['parent']), tidy_list(bone['offset']),
+                           tidy_list(bone['rotation']), tidy_list(bone['scale']) ) )
+
+    with open(filepath, 'w', encoding='utf-8') as o:
+        o.write("[\n%s\n]" % ",\n".join(entries) if entries else "[]")
+
+def encode_skeleton(bones):
+    """Build a binary skeleton file from a list of bone dicts with parentIndex set."""
+
+    boneTable = np.zeros(len(bones), dtype=SQS_BONE)
+    boneTable['parent'] = [ bone['parentIndex'] for bone in bones ]
+    boneTable['nameHash'] = [ fnv1a_hash(bone['name']) for bone in bones ]
+    boneTable['offset'] = np.array([ bone['offset'] for bone in bones ]).reshape(-1, 3)
+    boneTable['rotation'] = np.array([ bone['rotation'] for bone in bones ]).reshape(-1, 4)
+    boneTable['scale'] = np.array([ bone['scale'] for bone in bones ]).reshape(-1, 3)
+
+    # transposed so that the matrices are column major
+    bindMatrices = armature_rest_matrices(bones)
+    bindData = bindMatrices.transpose(0, 2, 1).astype('<f4')
+    inverseData = np.linalg.inv(bindMatrices).transpose(0, 2, 1).astype('<f4')
+
+    # at most half full, so that probes stay short
+    hashSize = 1
+    while hashSize < len(bones) * 2: hashSize *= 2
+    hashTable = np.full(hashSize, -1, dtype='<i4')
+    for index, nameHash in enumerate(boneTable['nameHash'].tolist()):
+        slot = nameHash & (hashSize - 1)
+        while hashTable[slot] >= 0: slot = (slot + 1) & (hashSize - 1)
+        hashTable[slot] = index
+
+    names = bytearray()
+    for bone in bones:
+        encoded = bone['name'].encode('utf-8')
+        assert len(encoded) <= SQS_NAME_SIZE, "bone name '%s' is too long" % bone['name']
+        names += encoded.ljust(SQS_NAME_SIZE, b"\0")
+
+    blocks = [ (b"BONE", boneTable.tobytes()), (b"BIND", bindData.tobytes()), (b"IBND", inverseData.tobytes()),
+               (b"HASH", hashTable.tobytes()), (b"NAME", bytes(names)) ]
+
+    blockTable, offsets = layout_blocks([(tag, len(data)) for tag, data in blocks], SQS_HEADER.size)
+    header = SQS_HEADER.pack(SQS_MAGIC, SQS_VERSION, SQS_HEADER.size, len(bones), len(blocks))
+
+    result = bytearray(header + blockTable)
+    for (tag, data), offset in zip(blocks, offsets):
+        result += bytes(offset - len(result))
+        result += data
+
+    return bytes(result)
+
+def decode_skeleton(data):
+    """Reference decoder for encode_skeleton, returns (boneTable, bindMatrices, inverseMatrices, names, lookup).
+
+    lookup finds the index of a bone by name using the hash table, or -1.
+    """
+
+    magic, version, headerSize, boneCount, blockCount = SQS_HEADER.unpack_from(data, 0)
+    assert magic == SQS_MAGIC, "not a binary skeleton"
+    assert version == SQS_VERSION, "unsupported version %d" % version
+
+    blocks = {}
+    for index in range(blockCount):
+        tag, padding, offset, size = SQA_BLOCK.unpack_from(data, headerSize + index * SQA_BLOCK.size)
+        blocks[tag] = data[offset : offset + size]
+
+    boneTable = np.frombuffer(blocks[b"BONE"], dtype=SQS_BONE)
+    bindMatrices = np.frombuffer(blocks[b"BIND"], dtype='<f4').reshape(-1, 4, 4).transpose(0, 2, 1)
+    inverseMatrices = np.frombuffer(blocks[b"IBND"], dtype='<f4').reshape(-1, 4, 4).transpose(0, 2, 1)
+    hashTable = np.frombuffer(blocks[b"HASH"], dtype='<i4')
+    names = [ bytes(blocks[b"NAME"][i:i+SQS_NAME_SIZE]).rstrip(b"\0").decode('utf-8')
+              for i in range(0, boneCount * SQS_NAME_SIZE, SQS_NAME_SIZE) ]
+
+    def lookup(name):
+        nameHash = fnv1a_hash(name)
+        slot = nameHash & (len(hashTable) - 1)
+        while hashTable[slot] >= 0:
+            index = int(hashTable[slot])
+            if boneTable['nameHash'][index] == nameHash and names[index] == name: return index
+            slot = (slot + 1) & (len(hashTable) - 1)
+        return -1
+
+    return boneTable, bindMatrices, inverseMatrices, names, lookup
+
+#==============================================================================#
+
+class SqeeAnim():
+    def __init__(self):
+        self.boneCount = 0
+        self.frameCount = 0
+        self.baseTracks = defaultdict(dict)
+        self.extraTracks = defaultdict(dict)
+
+class AnimJob():
+    """Everything needed to export one action, so that it can be done in another process.
+
+    Either anim is already filled in, or bones holds PoseBoneData for every bone
+    of the armature, parents first, and extraChannels holds the channels for
+    each of extraKeys. boneNames and chainLengths are only for exported bones.
+    """
+
+    def __init__(self, filepath, frameCount, boneNames, chainLengths, extraKeys, options):
+        self.filepath = filepath
+        self.frameCount = frameCount
+        self.boneNames = boneNames
+        self.chainLengths = chainLengths
+        self.extraKeys = extraKeys
+        self.options = options
+        self.anim = None
+        self.bones = None
+        self.extraChannels = None
+
+#==============================================================================#
+
+def sample_job_tracks(job, frames):
+    """Sample the tracks of a job for some frames, in the order that binary files use."""
+
+    swapYZ = job.options['swapYZ']
+    localMatrices = sample_local_matrices(job.bones, frames)
+    tracks = []
+
+    for boneIndex, boneName in enumerate(job.boneNames):
+
+        translation, rotation, scale = decompose_matrices(localMatrices[boneName])
+
+        if swapYZ:
+            translation = translation[:, [0, 2, 1]]
+            rotation = np.column_stack((-rotation[:, 1], -rotation[:, 3], -rotation[:, 2], rotation[:, 0]))
+            scale = scale[:, [0, 2, 1]]
+        else:
+            rotation = rotation[:, [1, 2, 3, 0]]
+
+        tracks.append(AnimTrack(boneIndex, "offset", translation))
+        tracks.append(AnimTrack(boneIndex, "rotation", rotation))
+        tracks.append(AnimTrack(boneIndex, "scale", scale))
+
+    if job.options['exportCustom']:
+        boneIndices = { name: index for index, name in enumerate(job.boneNames) }
+        for (boneName, key), channels in zip(job.extraKeys, job.extraChannels):
+            tracks.append(AnimTrack(boneIndices[boneName], "extra", channel_array(channels, frames), key))
+
+    return tracks
+
+def anim_track_name(job, track):
+    boneName = job.boneNames[track.boneIndex]
+    if track.channel == "extra": return "%s %s Vec4F" % (boneName, track.name)
+    return "%s %s" % (boneName, track.channel)
+
+def sample_anim_tracks(anim, job):
+    """Fill in the tracks of an animation from the channels of a job."""
+
+    for track in sample_job_tracks(job, np.arange(job.frameCount)):
+        tracks = anim.extraTracks if track.channel == "extra" else anim.baseTracks
+        tracks[anim_track_name(job, track)] = dict(enumerate(map(tuple, track.values.tolist())))
+
+def collapse_constant_tracks(tracks):
+    """Replace tracks that never move more than 0.0001 from their first frame with that value."""
+
+    for trackName, trackDict in tracks.items():
+        values = np.array(list(trackDict.values()))
+        if np.all(np.linalg.norm(values - values[0], axis=1) < 0.0001):
+            tracks[trackName] = tuple(trackDict[0])
+
+def reduce_anim_tracks(anim, job, log):
+    """Drop the frames that interpolation can rebuild within each channel's tolerance.
+
+    An error in the rotation or scale of a bone moves the end of its chain by
+    up to the error times the chain's length, so those tolerances get divided
+    by it. Offset errors don't grow along the chain, so they are used as is.
+    """
+
+    tolerances = { "offset": job.options['offsetTolerance'],
+                   "rotation": math.radians(job.options['rotationTolerance']),
+                   "scale": job.options['scaleTolerance'] }
+
+    totalBefore, totalAfter = 0, 0
+
+    for boneName in job.boneNames:
+
+        for channel, tolerance in tolerances.items():
+            trackName = "%s %s" % (boneName, channel)
+            track = anim.baseTracks[trackName]
+            if type(track) is not dict:
+                continue
+
+            if channel != "offset":
+                tolerance /= max(job.chainLengths[boneName], 1.0)
+
+            frames, maxError = reduce_keyframes(list(track.values()), tolerance, channel == "rotation")
+            anim.baseTracks[trackName] = { frame: track[frame] for frame in frames.tolist() }
+
+            if channel == "rotation": errorStr = "%.4f degrees" % math.degrees(maxError)
+            else: errorStr = "%.6f" % maxError
+
+            log.append ( "%s: %d of %d frames (%.1f%%), max error %s" %
+                         (trackName, len(frames), len(track), 100.0 * len(frames) / len(track), errorStr) )
+
+            totalBefore += len(track)
+            totalAfter += len(frames)
+
+    if totalBefore != 0:
+        log.append ( "kept %d of %d animated frames, compression ratio %.2f" %
+                     (totalAfter, totalBefore, totalBefore / totalAfter) )
+
+#==============================================================================#
+
+def write_anim_text(filepath, anim, precision, exportCustom):
+
+    with open(filepath, 'w', encoding='utf-8') as o:
+
+        frameFmtStr = "\n %{}d".format(len(str(anim.frameCount - 1)))
+
+        o.write("# SQEE Animation Format\n")
+
+        o.write("\n\n################################################################################\n")
+
+        o.write("\nSECTION Header\n")
+
+        o.write("\nBoneCount %d" % anim.boneCount)
+        o.write("\nFrameCount %d\n" % anim.frameCount)
+
+        o.write("\n\n################################################################################\n")
+
+        o.write("\nSECTION BaseTracks\n")
+
+        def write_track(trackName, trackData):
+            o.write("\nTRACK %s" % trackName)
+            if type(trackData) is not dict:
+                for val in tidy_values(precision, *trackData):
+                    o.write(" %s" % val)
+            else:
+                lines = tidy_rows(precision, list(trackData.values()))
+                for frame, line in zip(trackData.keys(), lines):
+                    o.write(frameFmtStr % frame + " " + line)
+            o.write("\n")
+
+        for trackName, trackData in anim.baseTracks.items():
+            write_track(trackName, trackData)
+
+        if exportCustom:
+
+            o.write("\n\n################################################################################\n")
+
+            o.write("\nSECTION ExtraTracks\n")
+
+            for trackName, trackData in anim.extraTracks.items():
+                write_track(trackName, trackData)
+
+def anim_binary_tracks(anim, job):
+    """Convert the tracks of an animation to AnimTracks, in the order binary files use."""
+
+    tracks = []
+
+    def add_track(boneIndex, channel, name=""):
+        track = AnimTrack(boneIndex, channel, [[0.0] * SQA_CHANNEL_WIDTHS[channel][0]], name)
+        trackData = (anim.extraTracks if channel == "extra" else anim.baseTracks)[anim_track_name(job, track)]
+        if type(trackData) is not dict:
+            track.values = np.array([trackData], dtype=np.float64)
+        else:
+            # reduced tracks are sparse, but binary files store every frame
+            frames = np.array(list(trackData.keys()))
+            values = np.array(list(trackData.values()), dtype=np.float64)
+            track.values = rebuild_track(frames, values, anim.frameCount)
+        tracks.append(track)
+
+    for boneIndex in range(len(job.boneNames)):
+        for channel in ("offset", "rotation", "scale"):
+            add_track(boneIndex, channel)
+
+    if job.options['exportCustom']:
+        boneIndices = { name: index for index, name in enumerate(job.boneNames) }
+        for boneName, key in job.extraKeys:
+            add_track(boneIndices[boneName], "extra", key)
+
+    return tracks
+
+def write_anim_binary(filepath, anim, job, log):
+
+    tracks = anim_binary_tracks(anim, job)
+    data = encode_animation(anim.boneCount, anim.frameCount, tracks)
+
+    with open(filepath, 'wb') as o:
+        o.write(data)
+
+    # make sure that the file decodes, and report how much precision was lost
+    boneCount, frameCount, decoded = decode_animation(data)
+    assert (boneCount, frameCount, len(decoded)) == (anim.boneCount, anim.frameCount, len(tracks))
+
+    maxErrors = { "offset": 0.0, "rotation": 0.0, "scale": 0.0, "extra": 0.0 }
+    for original, result in zip(tracks, decoded):
+        errors = track_errors(result.values, original.values, original.channel == "rotation")
+        maxErrors[original.channel] = max(maxErrors[original.channel], float(np.max(errors)))
+
+    animated = sum(not track.constant for track in tracks)
+    log.append("wrote %d tracks, %d animated, %d bytes" % (len(tracks), animated, len(data)))
+    log.append ( "max error: offset %.6f, rotation %.4f degrees, scale %.6f, extra %.6f" %
+                 (maxErrors["offset"], math.degrees(maxErrors["rotation"]), maxErrors["scale"], maxErrors["extra"]) )
+
+#==============================================================================#
+
+def write_anim_chunked(filepath, job, log):
+    """Sample and write an animation a chunk at a time, so memory use doesn't grow with its length.
+
+    Takes two passes over the chunks. The first finds the constant tracks, then
+    the second samples each chunk again, encodes it and writes it straight out.
+    """
+
+    chunkFrames, frameCount = job.options['chunkFrames'], job.frameCount
+    chunkStarts = range(0, frameCount, chunkFrames)
+
+    if job.anim is not None:
+        # sampled with frame_set, so everything is already in memory
+        fullTracks = anim_binary_tracks(job.anim, job)
+        sample_chunk = lambda frames: [ AnimTrack(t.boneIndex, t.channel, t.values[frames], t.name) for t in fullTracks ]
+    else:
+        sample_chunk = lambda frames: sample_job_tracks(job, frames)
+
+    def chunk_frames(first):
+        return np.arange(first, min(first + chunkFrames, frameCount))
+
+    #--------------------------------------------------------------------------#
+
+    firstTracks, moving = None, None
+
+    for first in chunkStarts:
+        tracks = sample_chunk(chunk_frames(first))
+        if firstTracks is None:
+            firstTracks = [ AnimTrack(t.boneIndex, t.channel, t.values[:1], t.name) for t in tracks ]
+            moving = np.zeros(len(tracks), dtype=bool)
+        for index, track in enumerate(tracks):
+            if not moving[index]:
+                moving[index] = np.any(np.linalg.norm(track.values - firstTracks[index].values, axis=1) >= 0.0001)
+
+    tableBlocks, animated, frameStride = encode_track_table(firstTracks, np.logical_not(moving))
+    channels = [ firstTracks[index].channel for index in animated ]
+
+    rangeSize = SQA_CHUNK_RANGE.itemsize * len(animated)
+    chunkSizes = [ align_offset(rangeSize + len(chunk_frames(first)) * frameStride) for first in chunkStarts ]
+
+    blocks = [ (tag, len(data)) for tag, data in tableBlocks ]
+    blocks += [ (b"CIDX", 8 * len(chunkSizes)), (b"CHNK", sum(chunkSizes)) ]
+    blockTable, offsets = layout_blocks(blocks)
+
+    chunkOffsets = offsets[-1] + np.concatenate(([0], np.cumsum(chunkSizes)[:-1])).astype('<u8')
+
+    header = SQA_HEADER.pack ( SQA_CHUNKED_MAGIC, SQA_VERSION, SQA_HEADER.size, len(job.boneNames),
+                               frameCount, len(firstTracks), frameStride, len(blocks), chunkFrames )
+
+    #--------------------------------------------------------------------------#
+
+    maxErrors = { "offset": 0.0, "rotation": 0.0, "scale": 0.0, "extra": 0.0 }
+
+    with open(filepath, 'wb') as o:
+
+        o.write(header)
+        o.write(blockTable)
+
+        for (tag, data), offset in zip(tableBlocks + [(b"CIDX", chunkOffsets.tobytes())], offsets):
+            o.write(bytes(offset - o.tell()))
+            o.write(data)
+
+        for first, chunkSize, chunkOffset in zip(chunkStarts, chunkSizes, chunkOffsets):
+
+            tracks = sample_chunk(chunk_frames(first))
+            values = [ tracks[index].values for index in animated ]
+            ranges, frameData = encode_frames(values, channels)
+
+            o.write(bytes(int(chunkOffset) - o.tell()))
+            o.write(ranges.tobytes())
+            o.write(frameData.tobytes())
+            o.write(bytes(int(chunkOffset) + chunkSize - o.tell()))
+
+            # check each chunk against the reference decoder while it is still in memory
+            for original, result, channel in zip(values, decode_frames(ranges, frameData, channels), channels):
+                errors = track_errors(result, original, channel == "rotation")
+                maxErrors[channel] = max(maxErrors[channel], float(np.max(errors)))
+
+    log.append ( "wrote %d tracks, %d animated, in %d chunks of %d frames" %
+                 (len(firstTracks), len(animated), len(chunkSizes), chunkFrames) )
+    log.append ( "max error: offset %.6f, rotation %.4f degrees, scale %.6f, extra %.6f" %
+                 (maxErrors["offset"], math.degrees(maxErrors["rotation"]), maxErrors["scale"], maxErrors["extra"]) )
+
+#==============================================================================#
+
+def run_anim_job(job):
+    """Sample, reduce and write one action, returns (filepath, seconds, size, log)."""
+
+    startTime = time.perf_counter()
+    log = []
+
+    # chunked files are sampled as they are written, and always store every frame
+    if job.options['fileFormat'] == 'CHUNKED':
+        STAGE_TIMER.lap("animation.write")
+        write_anim_chunked(job.filepath, job, log)
+        STAGE_TIMER.end()
+        return job.filepath, time.perf_counter() - startTime, os.path.getsize(job.filepath), log
+
+    STAGE_TIMER.lap("animation.sample")
+
+    anim = job.anim
+    if anim is None:
+        anim = SqeeAnim()
+        anim.boneCount = len(job.boneNames)
+        anim.frameCount = job.frameCount
+        sample_anim_tracks(anim, job)
+
+    STAGE_TIMER.lap("animation.reduce")
+
+    collapse_constant_tracks(anim.baseTracks)
+    collapse_constant_tracks(anim.extraTracks)
+
+    if job.options['reduceKeyframes']:
+        reduce_anim_tracks(anim, job, log)
+
+    STAGE_TIMER.lap("animation.write")
+
+    if job.options['fileFormat'] == 'BINARY':
+        write_anim_binary(job.filepath, anim, job, log)
+    else:
+        write_anim_text(job.filepath, anim, job.options['precision'], job.options['exportCustom'])
+
+    STAGE_TIMER.end()
+
+    return job.filepath, time.perf_counter() - startTime, os.path.getsize(job.filepath), log
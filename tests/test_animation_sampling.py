@@ -0,0 +1,246 @@
+"""Checks that the batched animation sampler agrees with blender's frame_set.
+
+The numpy checks run with any python. The export checks need blender:
+
+    blender -b --factory-startup --python-exit-code 1 --python tests/test_animation_sampling.py
+"""
+
+import os, sys, tempfile, unittest
+import numpy as np
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts")
+sys.path.insert(0, os.path.normpath(SCRIPTS_DIR))
+
+from sqee_io import FCurveKeys, PoseBoneData, correct_bezier_handles, eulers_to_matrices
+from sqee_io import evaluate_fcurve, matrices_to_quaternions, quaternions_to_matrices, sample_local_matrices
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+#==============================================================================#
+
+def fcurve_keys(points, interpolation, extrapolation='CONSTANT', handles=None):
+    """Keys through (frame, value) points, by default with handles a third of the way along each segment."""
+    co = np.array(points, dtype=np.float64)
+    if handles is None:
+        handleLeft, handleRight = co.copy(), co.copy()
+        handleLeft[1:] = co[1:] + (co[:-1] - co[1:]) / 3.0
+        handleRight[:-1] = co[:-1] + (co[1:] - co[:-1]) / 3.0
+    else:
+        handleLeft, handleRight = (np.array(h, dtype=np.float64) for h in handles)
+    return FCurveKeys(co, handleLeft, handleRight, np.full(len(co), interpolation, dtype=np.int32), extrapolation)
+
+POINTS = ((0.0, 0.0), (5.0, 3.0), (10.0, 5.0))
+
+class EvaluateFCurveTest(unittest.TestCase):
+
+    def test_constant(self):
+        keys = fcurve_keys(POINTS, 0)
+        result = evaluate_fcurve(keys, [-2.0, 0.0, 4.0, 5.0, 9.0, 10.0, 12.0])
+        np.testing.assert_array_equal(result, (0.0, 0.0, 0.0, 3.0, 3.0, 5.0, 5.0))
+
+    def test_linear(self):
+        keys = fcurve_keys(POINTS, 1)
+        result = evaluate_fcurve(keys, [-2.0, 0.0, 2.5, 5.0, 7.5, 10.0, 12.0])
+        np.testing.assert_allclose(result, (0.0, 0.0, 1.5, 3.0, 4.0, 5.0, 5.0))
+
+    def test_bezier_with_straight_handles_is_linear(self):
+        keys = fcurve_keys(POINTS, 2)
+        frames = np.linspace(-2.0, 12.0, 29)
+        np.testing.assert_allclose(evaluate_fcurve(keys, frames), evaluate_fcurve(fcurve_keys(POINTS, 1), frames), atol=1e-9)
+
+    def test_bezier_passes_through_keys(self):
+        # flat handles, so the curve eases in and out of every key
+        co = np.array(POINTS)
+        handles = (co - (2.0, 0.0), co + (2.0, 0.0))
+        keys = fcurve_keys(POINTS, 2, handles=handles)
+        result = evaluate_fcurve(keys, [-1.0, 0.0, 5.0, 10.0, 11.0])
+        np.testing.assert_allclose(result, (0.0, 0.0, 3.0, 5.0, 5.0), atol=1e-9)
+        # halfway between two keys with symmetric handles is halfway between their values
+        np.testing.assert_allclose(evaluate_fcurve(keys, [2.5]), [1.5], atol=1e-9)
+
+    def test_linear_extrapolation(self):
+        keys = fcurve_keys(POINTS, 1, 'LINEAR')
+        result = evaluate_fcurve(keys, [-2.0, 0.0, 10.0, 12.0])
+        np.testing.assert_allclose(result, (-1.2, 0.0, 5.0, 5.8))
+        # constant keys don't have a slope to extend
+        keys = fcurve_keys(POINTS, 0, 'LINEAR')
+        np.testing.assert_array_equal(evaluate_fcurve(keys, [-2.0, 10.0, 12.0]), (0.0, 5.0, 5.0))
+
+    def test_single_key(self):
+        keys = fcurve_keys(POINTS[1:2], 2)
+        np.testing.assert_array_equal(evaluate_fcurve(keys, [0.0, 5.0, 10.0]), (3.0, 3.0, 3.0))
+
+class CorrectBezierHandlesTest(unittest.TestCase):
+
+    def test_overlapping_handles_are_scaled(self):
+        p0, p1 = np.array([[0.0, 0.0]]), np.array([[8.0, 1.0]])
+        p2, p3 = np.array([[2.0, 4.0]]), np.array([[10.0, 5.0]])
+        q1, q2 = correct_bezier_handles(p0, p1, p2, p3)
+        # both handles were 8 frames long over a 10 frame segment, so they're scaled to 5
+        np.testing.assert_allclose(q1, [[5.0, 0.625]])
+        np.testing.assert_allclose(q2, [[5.0, 4.375]])
+
+    def test_short_handles_are_unchanged(self):
+        p0, p1 = np.array([[0.0, 0.0]]), np.array([[3.0, 1.0]])
+        p2, p3 = np.array([[7.0, 4.0]]), np.array([[10.0, 5.0]])
+        q1, q2 = correct_bezier_handles(p0, p1, p2, p3)
+        np.testing.assert_array_equal(q1, p1)
+        np.testing.assert_array_equal(q2, p2)
+
+#==============================================================================#
+
+class MatricesToQuaternionsTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = np.random.default_rng(1)
+        quats = rng.normal(size=(200, 4))
+        quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+        result = matrices_to_quaternions(quaternions_to_matrices(quats))
+        # q and -q are the same rotation
+        np.testing.assert_allclose(np.abs(np.sum(result * quats, axis=1)), 1.0, atol=1e-9)
+
+    def test_each_branch(self):
+        # identity uses the trace, half turns about each axis use the other three branches
+        angles = np.array([[0.0, 0.0, 0.0], [np.pi, 0.0, 0.0], [0.0, np.pi, 0.0], [0.0, 0.0, np.pi]])
+        result = matrices_to_quaternions(eulers_to_matrices(angles, 'XYZ'))
+        np.testing.assert_allclose(np.abs(result), np.vstack(([1.0, 0.0, 0.0, 0.0], np.eye(4)[1:])), atol=1e-9)
+
+    def test_scaled_matrices(self):
+        rotation = eulers_to_matrices(np.array([[0.3, -0.2, 0.9]]), 'XYZ')
+        expected = matrices_to_quaternions(rotation)
+        np.testing.assert_allclose(matrices_to_quaternions(rotation * (2.0, 0.5, 3.0)), expected, atol=1e-12)
+
+class SampleLocalMatricesTest(unittest.TestCase):
+
+    @staticmethod
+    def rest_matrix(angles, offset):
+        matrix = np.eye(4)
+        matrix[:3, :3] = eulers_to_matrices(np.array(angles, dtype=np.float64), 'XYZ')
+        matrix[:3, 3] = offset
+        return matrix
+
+    @staticmethod
+    def basis(location, quat, scale):
+        matrix = np.eye(4)
+        matrix[:3, :3] = quaternions_to_matrices(np.array(quat, dtype=np.float64)) * scale
+        matrix[:3, 3] = location
+        return matrix
+
+    def setUp(self):
+        self.frames = np.arange(3)
+        self.rootRest = self.rest_matrix((0.1, 0.2, 0.3), (1.0, 0.0, 0.0))
+        self.childRest = self.rest_matrix((-0.4, 0.0, 0.5), (1.0, 2.0, 0.5))
+        # the child has a location curve and a constant rotation and scale
+        self.childLocation = fcurve_keys(((0.0, 0.0), (2.0, 1.0)), 1)
+        self.childQuat = (0.9, 0.1, 0.3, 0.2)
+
+    def bones(self, rootName):
+        root = PoseBoneData(rootName, -1, self.rootRest, 'QUATERNION', (0.5, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0), (2.0, 2.0, 2.0))
+        child = PoseBoneData ( "child", 0, self.childRest, 'QUATERNION', (self.childLocation, 0.0, 0.0),
+                               self.childQuat, (1.0, 1.0, 1.0) )
+        return [root, child]
+
+    def test_local_matrices(self):
+        result = sample_local_matrices(self.bones("root"), self.frames)
+        rootBasis = self.basis((0.5, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0), 2.0)
+        for frame in self.frames:
+            childBasis = self.basis((frame * 0.5, 0.0, 0.0), self.childQuat, 1.0)
+            np.testing.assert_allclose(result["root"][frame], self.rootRest @ rootBasis, atol=1e-12)
+            np.testing.assert_allclose(result["child"][frame], np.linalg.inv(self.rootRest) @ self.childRest @ childBasis, atol=1e-12)
+
+    def test_hidden_parent(self):
+        # children of hidden bones get armature space matrices
+        result = sample_local_matrices(self.bones(".root"), self.frames)
+        rootPose = self.rootRest @ self.basis((0.5, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0), 2.0)
+        for frame in self.frames:
+            childLocal = np.linalg.inv(self.rootRest) @ self.childRest @ self.basis((frame * 0.5, 0.0, 0.0), self.childQuat, 1.0)
+            np.testing.assert_allclose(result["child"][frame], rootPose @ childLocal, atol=1e-12)
+
+#==============================================================================#
+
+def read_anim_text(filepath, frameCount):
+    """Tracks of a text .sqa as (frames, n) arrays, constant tracks are repeated for every frame."""
+
+    tracks, current = {}, None
+
+    with open(filepath, 'r', encoding='utf-8') as inFile:
+        for line in inFile:
+            tokens = line.split()
+            if not tokens or line.startswith("#") or tokens[0] in ("SECTION", "BoneCount", "FrameCount"):
+                continue
+            if tokens[0] == "TRACK":
+                # names are "<bone> <channel>" followed by the values of a constant track
+                name, values = " ".join(tokens[1:3]), [ float(v) for v in tokens[3:] ]
+                tracks[name] = [values] * frameCount if values else []
+                current = name
+            else:
+                tracks[current].append([ float(v) for v in tokens[1:] ])
+
+    return { name: np.array(rows) for name, rows in tracks.items() }
+
+@unittest.skipIf(bpy is None, "needs blender")
+class MirroredBoneTest(unittest.TestCase):
+
+    frameCount = 21
+
+    @classmethod
+    def setUpClass(cls):
+        import io_sqee_animation_export
+        try: io_sqee_animation_export.register()
+        except ValueError: pass # already registered
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="sqee_test_")
+
+        arma = bpy.data.armatures.new("MirrorTest")
+        self.obj = bpy.data.objects.new("MirrorTest", arma)
+        bpy.context.scene.collection.objects.link(self.obj)
+        bpy.context.view_layer.objects.active = self.obj
+
+        bpy.ops.object.mode_set(mode='EDIT')
+        root = arma.edit_bones.new("root")
+        root.head, root.tail = (0.0, 0.0, 0.0), (0.0, 0.0, 1.0)
+        child = arma.edit_bones.new("child")
+        child.head, child.tail, child.roll = (0.0, 0.0, 1.0), (0.3, 0.2, 2.0), 0.4
+        child.parent = root
+        bpy.ops.object.mode_set(mode='OBJECT')
+
+        # the child is mirrored on x for the whole action, and also turns and grows
+        action = bpy.data.actions.new("MirrorTest")
+        self.obj.animation_data_create()
+        self.obj.animation_data.action = action
+        for pb in self.obj.pose.bones:
+            pb.rotation_mode = 'QUATERNION'
+        child = self.obj.pose.bones["child"]
+        for frame, angle, grow in ((0, 0.0, 1.0), (self.frameCount - 1, 1.2, 1.5)):
+            child.rotation_quaternion = (np.cos(angle), 0.0, np.sin(angle), 0.0)
+            child.scale = (-grow, 1.0, grow)
+            child.location = (0.1 * grow, 0.0, 0.0)
+            for path in ("rotation_quaternion", "scale", "location"):
+                child.keyframe_insert(path, frame=frame)
+
+    def tearDown(self):
+        action = self.obj.animation_data.action
+        bpy.data.objects.remove(self.obj)
+        bpy.data.actions.remove(action)
+
+    def export(self, name, legacySample):
+        filepath = os.path.join(self.directory, name + ".sqa")
+        bpy.ops.sqee.export_animation_operator(filepath=filepath, fileFormat='TEXT', legacySample=legacySample)
+        return read_anim_text(filepath, self.frameCount)
+
+    def test_batched_matches_frame_set(self):
+        reference = self.export("reference", True)
+        batched = self.export("batched", False)
+        self.assertEqual(sorted(reference), sorted(batched))
+        for name in reference:
+            np.testing.assert_allclose(batched[name], reference[name], atol=2e-5, err_msg=name)
+
+#==============================================================================#
+
+if __name__ == "__main__":
+    result = unittest.main(argv=[sys.argv[0]], exit=False).result
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,37 @@
+"""Checks for decompose_matrices, which the exporter and the BrawlCrate importer share."""
+
+import os, sys, unittest
+import numpy as np
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts")
+sys.path.insert(0, os.path.normpath(SCRIPTS_DIR))
+
+from sqee_io import decompose_matrices
+
+#==============================================================================#
+
+def mirrored_matrix():
+    """A rotation about z, then a mirror on x, then a translation."""
+    c, s = np.cos(0.5), np.sin(0.5)
+    matrix = np.eye(4)
+    matrix[:3, :3] = np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]]) @ np.diag([-2.0, 1.0, 1.0])
+    matrix[:3, 3] = (1.0, 2.0, 3.0)
+    return matrix
+
+class DecomposeMatricesTest(unittest.TestCase):
+
+    def test_scale_is_positive_by_default(self):
+        translation, rotation, scale = decompose_matrices(mirrored_matrix()[None])
+        np.testing.assert_allclose(translation[0], (1.0, 2.0, 3.0))
+        np.testing.assert_allclose(scale[0], (2.0, 1.0, 1.0))
+
+    def test_negative_scale_when_allowed(self):
+        translation, rotation, scale = decompose_matrices(mirrored_matrix()[None], allowNegativeScale=True)
+        np.testing.assert_allclose(scale[0], (-2.0, -1.0, -1.0))
+        # the flipped rotation is a proper rotation, so it has a unit quaternion
+        np.testing.assert_allclose(np.linalg.norm(rotation[0]), 1.0)
+
+#==============================================================================#
+
+if __name__ == "__main__":
+    unittest.main()